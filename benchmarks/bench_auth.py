@@ -0,0 +1,38 @@
+"""
+Compares queries and time per token check for DRF's TokenAuthentication
+and CachedTokenAuthentication.
+"""
+from benchmarks.utils import setup_django, bench, report
+
+CHECKS = 1000
+
+
+def main():
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from rest_framework.authentication import TokenAuthentication
+    from rest_framework.authtoken.models import Token
+    from contentstore.authentication import CachedTokenAuthentication
+
+    user = User.objects.create_user('bench', 'bench@example.com')
+    key = Token.objects.create(user=user).key
+
+    for auth_class in (TokenAuthentication, CachedTokenAuthentication):
+        auth = auth_class()
+
+        def check():
+            for i in range(CHECKS):
+                auth.authenticate_credentials(key)
+
+        connection.queries_log.clear()
+        with CaptureQueriesContext(connection) as ctx:
+            check()
+        report('%s (%.1f queries)' % (
+            auth_class.__name__, len(ctx.captured_queries) / float(CHECKS)),
+            bench(check), CHECKS, 'check')
+
+
+if __name__ == '__main__':
+    main()
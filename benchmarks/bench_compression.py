@@ -0,0 +1,48 @@
+"""
+Measures bytes on the wire and response time for
+``/messageset/<pk>/messages`` with each encoding ``CompressionMiddleware``
+can produce, for a set with long texts in 11 languages.
+"""
+from benchmarks.utils import setup_django, bench, report
+
+MESSAGES = 100
+LANGS = ('eng_ZA', 'afr_ZA', 'zul_ZA', 'xho_ZA', 'sot_ZA', 'tsn_ZA',
+         'nso_ZA', 'tso_ZA', 'ssw_ZA', 'ven_ZA', 'nbl_ZA')
+TEXT = (u"Week %s: your baby is growing fast. Remember to go to the clinic "
+        u"for your check up, take your vitamins every day and drink plenty "
+        u"of clean water. Reply HELP for more information or STOP to opt "
+        u"out of these messages. (%s)")
+
+
+def main():
+    setup_django()
+    from django.contrib.auth.models import User
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+    from contentstore.compression import available_encodings
+    from contentstore.models import Schedule, MessageSet, Message
+
+    schedule = Schedule.objects.create()
+    messageset = MessageSet.objects.create(
+        short_name='bench', default_schedule=schedule)
+    Message.objects.bulk_create([
+        Message(messageset=messageset, sequence_number=i, lang=lang,
+                text_content=TEXT % (i, lang))
+        for i in range(MESSAGES) for lang in LANGS])
+    user = User.objects.create_user('bench')
+    client = APIClient()
+    client.credentials(
+        HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+    path = '/messageset/%s/messages' % (messageset.pk,)
+
+    print('%s messages in %s languages' % (MESSAGES * len(LANGS),
+                                           len(LANGS)))
+    for encoding in ('identity',) + available_encodings():
+        response = client.get(path, HTTP_ACCEPT_ENCODING=encoding)
+        seconds = bench(lambda: client.get(
+            path, HTTP_ACCEPT_ENCODING=encoding))
+        report('%s (%s bytes)' % (encoding, len(response.content)), seconds)
+
+
+if __name__ == '__main__':
+    main()
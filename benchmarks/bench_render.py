@@ -0,0 +1,38 @@
+"""
+Compares rendering a message for many recipients from its compiled
+template with substituting the placeholders of the raw text each time.
+"""
+import re
+
+from benchmarks.utils import bench, report
+
+RECIPIENTS = 100000
+TEXT = (u"Hi {{ name }}, your next visit to {{ clinic }} is on "
+        u"{{ due_date }}. Reply STOP to opt out.")
+
+
+def main():
+    from contentstore.templating import compile_template, render_many
+
+    variable_sets = [
+        {'name': 'Mother %s' % i, 'clinic': 'Clinic %s' % (i % 50),
+         'due_date': '2015-06-%02d' % (i % 28 + 1)}
+        for i in range(RECIPIENTS)]
+    compiled, names = compile_template(TEXT)
+    placeholder = re.compile(r'{{\s*(.*?)\s*}}')
+
+    def substituted():
+        for variables in variable_sets:
+            placeholder.sub(lambda m: variables[m.group(1)], TEXT)
+
+    def precompiled():
+        render_many(compiled, variable_sets)
+
+    report('substituting raw text', bench(substituted, number=1),
+           RECIPIENTS, 'text')
+    report('render_many (precompiled)', bench(precompiled, number=1),
+           RECIPIENTS, 'text')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Compares per-message serialization cost of the DRF serializers against
+the ``.values()`` fast path for ``/messageset/<pk>/messages``.
+"""
+from benchmarks.utils import setup_django, bench, report
+
+MESSAGES = 2000
+LANGS = ('eng_ZA', 'afr_ZA', 'zul_ZA', 'xho_ZA')
+
+
+def main():
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from contentstore.fastpath import serialize_values
+    from contentstore.models import Schedule, MessageSet, Message
+    from contentstore.renderers import FastJSONRenderer
+    from contentstore.serializers import MessageSetMessagesSerializer
+
+    schedule = Schedule.objects.create()
+    messageset = MessageSet.objects.create(
+        short_name='bench', default_schedule=schedule)
+    Message.objects.bulk_create([
+        Message(messageset=messageset, sequence_number=i // len(LANGS),
+                lang=LANGS[i % len(LANGS)],
+                text_content='Message %s with some typical SMS text.' % i)
+        for i in range(MESSAGES)])
+
+    request = Request(APIRequestFactory().get('/'))
+    context = {'request': request}
+    queryset = MessageSet.objects.filter(pk=messageset.pk)
+
+    class FastView(object):
+        values_rendered = True
+
+    def drf():
+        data = MessageSetMessagesSerializer(
+            queryset.prefetch_related('messages__binary_content').get(),
+            context=context).data
+        JSONRenderer().render(data)
+
+    def fast():
+        data = serialize_values(
+            queryset, MessageSetMessagesSerializer(context=context))[0]
+        FastJSONRenderer().render(data, renderer_context={
+            'view': FastView()})
+
+    print('%s messages in one messageset' % (MESSAGES,))
+    report('DRF serializer + JSONRenderer', bench(drf), MESSAGES, 'message')
+    report('values fast path + FastJSONRenderer', bench(fast), MESSAGES,
+           'message')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Measures message lookup latency from an exported snapshot, with and
+without preloading.
+"""
+import os
+import shutil
+import tempfile
+
+from benchmarks.utils import setup_django, bench, report
+
+MESSAGES = 5000
+LOOKUPS = 1000
+
+
+def main():
+    setup_django()
+    from django.core.management import call_command
+    from django.utils import six
+    from contentstore.models import Schedule, MessageSet, Message
+    from client.messaging_contentstore.snapshot import ContentStoreSnapshot
+
+    schedule = Schedule.objects.create()
+    messageset = MessageSet.objects.create(
+        short_name='bench', default_schedule=schedule)
+    Message.objects.bulk_create([
+        Message(messageset=messageset, sequence_number=i, lang='eng_ZA',
+                text_content='Message %s' % i) for i in range(MESSAGES)])
+    ids = list(Message.objects.values_list('id', flat=True)[:LOOKUPS])
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, 'snapshot.db')
+        call_command('export_snapshot', path, stdout=six.StringIO())
+        for preload in (True, False):
+            snapshot = ContentStoreSnapshot(path, preload=preload)
+
+            def by_id():
+                for pk in ids:
+                    snapshot.get_message(pk)
+
+            def by_track():
+                for seq in range(LOOKUPS):
+                    snapshot.get_track_message(messageset.id, 'eng_ZA', seq)
+
+            label = 'preloaded' if preload else 'sqlite'
+            report('get_message (%s)' % label, bench(by_id), LOOKUPS,
+                   'lookup')
+            report('get_track_message (%s)' % label, bench(by_track),
+                   LOOKUPS, 'lookup')
+            snapshot.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
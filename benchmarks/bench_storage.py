@@ -0,0 +1,131 @@
+"""
+Compares upload and read throughput of binary content storage backends:
+the local file system, a stand-in for a remote object store that adds a
+round trip per request, and either of them behind ``SpooledStorage``.
+"""
+import io
+import shutil
+import tempfile
+import time
+
+from benchmarks.utils import setup_django, bench, report
+
+FILE_SIZE = 256 * 1024
+ROUND_TRIP = 0.02
+BANDWIDTH = 50 * 1024 * 1024
+
+
+def object_store_class():
+    from django.core.files.base import ContentFile
+    from django.core.files.storage import Storage
+
+    class ObjectStoreStandIn(Storage):
+
+        """
+        Keeps files in memory, sleeping for a round trip and the transfer
+        time on every request like a remote object store would.
+        """
+
+        def __init__(self):
+            self.objects = {}
+
+        def _request(self, size=0):
+            time.sleep(ROUND_TRIP + float(size) / BANDWIDTH)
+
+        def _open(self, name, mode='rb'):
+            data = self.objects[name]
+            self._request(len(data))
+            return ContentFile(data, name=name)
+
+        def _save(self, name, content):
+            data = content.read()
+            self._request(len(data))
+            self.objects[name] = data
+            return name
+
+        def exists(self, name):
+            self._request()
+            return name in self.objects
+
+        def delete(self, name):
+            self._request()
+            self.objects.pop(name, None)
+
+        def size(self, name):
+            return len(self.objects[name])
+
+        def url(self, name):
+            return 'https://objects.example.com/' + name
+
+    return ObjectStoreStandIn
+
+
+def main():
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.core.files.storage import FileSystemStorage
+    from rest_framework.authtoken.models import Token
+    from rest_framework.test import APIClient
+    from contentstore.models import BinaryContent
+    from contentstore.storage import SpooledStorage, flush_spool
+
+    user = User.objects.create_user('bench')
+    client = APIClient()
+    client.credentials(
+        HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=user).key)
+    payload = b'\x89PNG\r\n\x1a\n' + b'\0' * (FILE_SIZE - 8)
+    field = BinaryContent._meta.get_field('content')
+    original = field.storage
+    ObjectStoreStandIn = object_store_class()
+    directories = []
+
+    def directory():
+        directories.append(tempfile.mkdtemp())
+        return directories[-1]
+
+    backends = [
+        ('file system', lambda: FileSystemStorage(location=directory())),
+        ('object store', ObjectStoreStandIn),
+        ('spooled file system', lambda: SpooledStorage(
+            backend=FileSystemStorage(location=directory()),
+            location=directory())),
+        ('spooled object store', lambda: SpooledStorage(
+            backend=ObjectStoreStandIn(), location=directory())),
+    ]
+
+    def upload():
+        upload = io.BytesIO(payload)
+        upload.name = 'audio.png'
+        response = client.post('/binarycontent/', {'content': upload},
+                               format='multipart')
+        assert response.status_code == 201, response.status_code
+
+    print('%s KB files, %s ms object store round trip' % (
+        FILE_SIZE // 1024, int(ROUND_TRIP * 1000)))
+    try:
+        for label, make_storage in backends:
+            field.storage = storage = make_storage()
+            report('%s upload request' % (label,), bench(upload, number=5))
+            names = list(BinaryContent.objects.values_list(
+                'content', flat=True))
+            if isinstance(storage, SpooledStorage):
+                start = time.time()
+                count, moved = flush_spool(storage, min_age=0)
+                report('%s flush per file' % (label,),
+                       (time.time() - start) / count)
+
+            def read():
+                for name in names:
+                    with storage.open(name) as content:
+                        content.read()
+            report('%s read per file' % (label,),
+                   bench(read, number=1) / len(names))
+            BinaryContent.objects.all().delete()
+    finally:
+        field.storage = original
+        for path in directories:
+            shutil.rmtree(path)
+
+
+if __name__ == '__main__':
+    main()
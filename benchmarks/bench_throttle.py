@@ -0,0 +1,48 @@
+"""
+Measures the overhead the throttles add to a request, using the cache from
+the settings (local memory unless configured otherwise).
+"""
+from benchmarks.utils import setup_django, bench, report
+
+CHECKS = 1000
+
+
+def main():
+    setup_django()
+    from django.contrib.auth.models import User
+    from django.test.utils import override_settings
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from contentstore.throttling import (ConcurrencyThrottle,
+                                         SlidingWindowThrottle)
+    from contentstore.views import MessageViewSet
+
+    request = Request(APIRequestFactory().get('/message/'))
+    request.user = User.objects.create_user('bench', 'bench@example.com')
+    request.auth = None
+    view = MessageViewSet(action='list', request=request)
+
+    def sliding_window():
+        for i in range(CHECKS):
+            SlidingWindowThrottle().allow_request(request, view)
+
+    def concurrency():
+        for i in range(CHECKS):
+            view.throttle_releases = []
+            ConcurrencyThrottle().allow_request(request, view)
+            for release in view.throttle_releases:
+                release()
+
+    with override_settings(
+            CONTENTSTORE_THROTTLE_RATES={'user': '%s/d' % (10 ** 9),
+                                         'route': '%s/d' % (10 ** 9)},
+            CONTENTSTORE_MAX_CONCURRENT_REQUESTS=10):
+        report('SlidingWindowThrottle (2 budgets)', bench(sliding_window),
+               CHECKS, 'check')
+        report('ConcurrencyThrottle', bench(concurrency), CHECKS, 'check')
+    report('SlidingWindowThrottle (unconfigured)', bench(sliding_window),
+           CHECKS, 'check')
+
+
+if __name__ == '__main__':
+    main()
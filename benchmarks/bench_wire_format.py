@@ -0,0 +1,59 @@
+"""
+Compares payload size and encode/decode time of JSON and MessagePack for
+a ``/messageset/<pk>/messages`` response.
+"""
+import json
+
+from benchmarks.utils import setup_django, bench, report
+
+MESSAGES = 2000
+LANGS = ('eng_ZA', 'afr_ZA', 'zul_ZA', 'xho_ZA')
+
+
+def main():
+    setup_django()
+    from rest_framework.renderers import JSONRenderer
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+    from contentstore.fastpath import serialize_values
+    from contentstore.models import Schedule, MessageSet, Message
+    from contentstore.renderers import MessagePackRenderer, msgpack
+    from contentstore.serializers import MessageSetMessagesSerializer
+
+    if msgpack is None:
+        print('msgpack is not installed')
+        return
+
+    schedule = Schedule.objects.create()
+    messageset = MessageSet.objects.create(
+        short_name='bench', default_schedule=schedule)
+    Message.objects.bulk_create([
+        Message(messageset=messageset, sequence_number=i // len(LANGS),
+                lang=LANGS[i % len(LANGS)],
+                text_content=u'Message %s with some typical SMS text.' % i)
+        for i in range(MESSAGES)])
+    context = {'request': Request(APIRequestFactory().get('/'))}
+    data = serialize_values(
+        MessageSet.objects.filter(pk=messageset.pk),
+        MessageSetMessagesSerializer(context=context))[0]
+
+    as_json = JSONRenderer().render(data)
+    as_msgpack = MessagePackRenderer().render(data)
+
+    print('%s messages in one messageset' % (MESSAGES,))
+    print('JSON %s bytes, MessagePack %s bytes' % (len(as_json),
+                                                   len(as_msgpack)))
+    report('JSON encode', bench(lambda: JSONRenderer().render(data)),
+           MESSAGES, 'message')
+    report('MessagePack encode',
+           bench(lambda: MessagePackRenderer().render(data)),
+           MESSAGES, 'message')
+    report('JSON decode', bench(lambda: json.loads(as_json)),
+           MESSAGES, 'message')
+    report('MessagePack decode',
+           bench(lambda: msgpack.unpackb(as_msgpack, raw=False)),
+           MESSAGES, 'message')
+
+
+if __name__ == '__main__':
+    main()
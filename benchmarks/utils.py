@@ -0,0 +1,35 @@
+"""
+Helpers shared by the benchmark scripts.
+
+Benchmarks run against a throwaway test database created from the
+settings module in ``DJANGO_SETTINGS_MODULE`` (``testsettings`` by
+default)::
+
+    $ python -m benchmarks.bench_serialization
+"""
+import os
+import timeit
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'testsettings')
+    import django
+    django.setup()
+    from django.db import connection
+    from django.test.utils import setup_test_environment
+    setup_test_environment()
+    connection.creation.create_test_db(verbosity=0)
+
+
+def bench(func, number=10, repeat=3):
+    """
+        Returns the best time in seconds for a single call of ``func``.
+    """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number
+
+
+def report(label, seconds, per=None, unit='op'):
+    line = '%-40s %10.3f ms' % (label, seconds * 1000)
+    if per:
+        line += '  %8.2f us/%s' % (seconds * 1e6 / per, unit)
+    print(line)
@@ -2,8 +2,12 @@
 
 __version__ = "0.1.7"
 
+from .batch import ContentStoreBatch
 from .contentstore import ContentStoreApiClient
+from .snapshot import ContentStoreSnapshot
 
 __all__ = [
-    'ContentStoreApiClient'
+    'ContentStoreApiClient',
+    'ContentStoreBatch',
+    'ContentStoreSnapshot',
 ]
@@ -0,0 +1,148 @@
+"""
+Batches of content store writes, sent together instead of one at a time.
+"""
+import copy
+import threading
+from collections import namedtuple
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+BatchItem = namedtuple('BatchItem', ['result', 'error'])
+
+OPERATIONS = ('create_', 'update_', 'patch_', 'delete_')
+
+# Session settings a worker's session copies from the client's.
+SESSION_ATTRS = ('auth', 'verify', 'cert', 'trust_env', 'max_redirects')
+SESSION_DICTS = ('headers', 'cookies', 'proxies', 'hooks', 'params')
+
+
+def _copy_session(session):
+    # The copy shares the original's transport adapters, whose urllib3
+    # connection pools are thread-safe, but not its cookies or settings.
+    copied = requests.Session()
+    for attr in SESSION_ATTRS:
+        setattr(copied, attr, getattr(session, attr))
+    for attr in SESSION_DICTS:
+        setattr(copied, attr, getattr(session, attr).copy())
+    copied.adapters = session.adapters.copy()
+    return copied
+
+
+def _copy_client(client):
+    # A copy of the client for another thread, with a session of its own.
+    copied = copy.copy(client)
+    copied.session = _copy_session(client.session)
+    return copied
+
+
+class ContentStoreBatch(object):
+
+    """
+    Queues creates, updates, patches and deletes made through a
+    :class:`ContentStoreApiClient` and sends them all on :meth:`flush`, or
+    when used as a context manager, on leaving the block::
+
+        with client.batch() as batch:
+            for schedule in schedules:
+                batch.create_schedule(schedule)
+        for item in batch.results:
+            ...
+
+    Operations don't take effect in the order they were queued: message set
+    deletes are all sent first, in one request to the server's bulk delete,
+    and the rest are then sent at once by a pool of ``max_workers``
+    threads. Queued operations mustn't depend on each other.
+
+    ``requests.Session`` isn't thread-safe, so each worker thread sends
+    requests through a copy of the client with its own session.
+
+    :param client:
+        The :class:`ContentStoreApiClient` to send requests with.
+    :param int max_workers:
+        The most requests to have in flight at once.
+    """
+
+    def __init__(self, client, max_workers=8):
+        self.client = client
+        self.max_workers = max_workers
+        self.queue = []
+        self.results = None
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        if not name.startswith(OPERATIONS) or not hasattr(self.client, name):
+            raise AttributeError(name)
+
+        def queue(*args, **kwargs):
+            self.queue.append((name, args, kwargs))
+            return len(self.queue) - 1
+        return queue
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.flush()
+
+    def _worker_client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = _copy_client(self.client)
+        return client
+
+    def _call(self, operation, client=None):
+        name, args, kwargs = operation
+        if client is None:
+            client = self._worker_client()
+        try:
+            return BatchItem(getattr(client, name)(*args, **kwargs), None)
+        except Exception as err:
+            return BatchItem(None, err)
+
+    def _delete_messagesets(self, queue, deletes):
+        # One bulk request deletes every queued message set. Ids it reports
+        # missing are deleted again one at a time to get the same 404 error
+        # as an unbatched delete, and if the bulk request fails as a whole,
+        # each set is deleted on its own so every item gets its own error.
+        ids = [args[0] if args else kwargs['messageset_id']
+               for name, args, kwargs in (queue[i] for i in deletes)]
+        item = self._call(('delete_messagesets', (ids,), {}), self.client)
+        results = {}
+        if item.error is None:
+            missing = set(item.result['missing'])
+            for i, messageset_id in zip(deletes, ids):
+                if messageset_id not in missing:
+                    results[i] = BatchItem(None, None)
+        return results
+
+    def flush(self):
+        """
+        Sends the queued operations, returning a :class:`BatchItem` of
+        ``(result, error)`` for each, in the order they were queued (though
+        not necessarily sent in that order). Failed operations have
+        ``error`` set to the exception they raised instead of stopping the
+        batch.
+        """
+        queue, self.queue = self.queue, []
+        results = [None] * len(queue)
+
+        deletes = [i for i, (name, args, kwargs) in enumerate(queue)
+                   if name == 'delete_messageset']
+        if deletes:
+            for i, item in self._delete_messagesets(queue, deletes).items():
+                results[i] = item
+
+        rest = [i for i in range(len(queue)) if results[i] is None]
+        if rest:
+            pool = ThreadPool(min(self.max_workers, len(rest)))
+            try:
+                items = pool.map(self._call, [queue[i] for i in rest])
+            finally:
+                pool.close()
+                pool.join()
+            for i, item in zip(rest, items):
+                results[i] = item
+        self.results = results
+        return results
@@ -5,6 +5,56 @@ Client for Messaging Content Store HTTP services APIs.
 """
 import requests
 import json
+import zlib
+from multiprocessing.pool import ThreadPool
+
+from requests.packages.urllib3.response import HTTPResponse
+
+from .batch import ContentStoreBatch, _copy_client
+from .upload import MultipartUpload, file_checksum
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+JSON_MEDIA_TYPE = 'application/json'
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+# Whether urllib3 already decodes Brotli bodies itself.
+DECODES_BROTLI = 'br' in getattr(HTTPResponse, 'CONTENT_DECODERS', ())
+
+
+def accept_encoding():
+    if brotli is not None:
+        return 'br, gzip'
+    return 'gzip'
+
+
+def decode_body(response):
+    """
+    Parse a JSON or MessagePack response, decompressing it if the transport
+    passed the compressed body through, as Brotli bodies are unless urllib3
+    supports them.
+    """
+    encoding = response.headers.get('Content-Encoding', '')
+    content = response.content
+    if encoding == 'br' and not DECODES_BROTLI and brotli is not None:
+        content = brotli.decompress(content)
+    elif encoding == 'gzip' and content[:2] == b'\x1f\x8b':
+        content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+    if not content:
+        # Deletes answer 204 No Content.
+        return None
+    content_type = response.headers.get('Content-Type', '')
+    if content_type.startswith(MSGPACK_MEDIA_TYPE):
+        return msgpack.unpackb(content, raw=False)
+    return json.loads(content.decode('utf-8'))
 
 
 class ContentStoreApiClient(object):
@@ -20,16 +70,37 @@ class ContentStoreApiClient(object):
         The full URL of the API. Defaults to
         ``http://testserver/contentstore``.
 
+    :param str wire_format:
+        ``json`` (the default) or ``msgpack``, which is more compact and
+        quicker to decode. MessagePack needs the ``msgpack`` package on
+        both ends. Servers without it answer in JSON, which is still
+        understood.
+
     """
 
-    def __init__(self, auth_token, api_url=None, session=None):
+    def __init__(self, auth_token, api_url=None, session=None,
+                 wire_format='json'):
         self.auth_token = auth_token
         if api_url is None:
             api_url = "http://testserver/contentstore"
         self.api_url = api_url
+        if wire_format == 'msgpack':
+            if msgpack is None:
+                raise ValueError(
+                    "The msgpack wire format needs the msgpack package.")
+            self.encode = lambda data: msgpack.packb(data, use_bin_type=True)
+            content_type = MSGPACK_MEDIA_TYPE
+            accept = '%s, %s;q=0.5' % (MSGPACK_MEDIA_TYPE, JSON_MEDIA_TYPE)
+        elif wire_format == 'json':
+            self.encode = json.dumps
+            content_type = accept = JSON_MEDIA_TYPE
+        else:
+            raise ValueError("Unknown wire format %r." % (wire_format,))
         self.headers = {
             'Authorization': 'Token ' + auth_token,
-            'Content-Type': 'application/json'
+            'Content-Type': content_type,
+            'Accept': accept,
+            'Accept-Encoding': accept_encoding(),
         }
         if session is None:
             session = requests.Session()
@@ -44,11 +115,86 @@ class ContentStoreApiClient(object):
         result = {
             'get': self.session.get,
             'post': self.session.post,
-            'put': self.session.post,
+            'put': self.session.put,
+            'patch': self.session.patch,
             'delete': self.session.delete,
-        }.get(method, None)(url, params=params, data=json.dumps(data))
+        }.get(method, None)(url, params=params, data=self.encode(data))
         result.raise_for_status()
-        return result.json()
+        return decode_body(result)
+
+    def batch(self, max_workers=8):
+        """
+        Start a :class:`ContentStoreBatch` of creates, updates and deletes
+        to send together.
+        """
+        return ContentStoreBatch(self, max_workers=max_workers)
+
+    def get_changes(self, since=None, limit=None):
+        params = {}
+        if since is not None:
+            params['since'] = since
+        if limit is not None:
+            params['limit'] = limit
+        return self.call('changes', 'get', params=params)
+
+    def sync(self, mirror, since=None, limit=None):
+        """
+        Apply every change after the ``since`` cursor to ``mirror``, a dict
+        of ``{model: {id: object}}`` such as ``{'message': {1: {...}}}``.
+
+        :param dict mirror:
+            The local mirror, updated in place.
+        :param int since:
+            The cursor returned by the previous sync, or ``None`` to replay
+            the whole change log.
+
+        :returns: The cursor to pass to the next sync.
+        """
+        while True:
+            page = self.get_changes(since=since, limit=limit)
+            for change in page['changes']:
+                objects = mirror.setdefault(change['model'], {})
+                if change['action'] == 'deleted':
+                    objects.pop(change['object_id'], None)
+                else:
+                    objects[change['object_id']] = change['data']
+            since = page['cursor']
+            if not page['more']:
+                return since
+
+    def iter_objects(self, endpoint, params=None, page_size=1000):
+        """
+        Yield every object listed by ``endpoint``, in id order, fetching
+        ``page_size`` at a time so memory use doesn't grow with the
+        collection. The next page is fetched in the background, through a
+        session of its own, while the current one is being consumed.
+
+        :param dict params:
+            Filters, as for the matching ``get_*`` method.
+        """
+        params = dict(params or {}, limit=page_size)
+        prefetcher = _copy_client(self)
+        pool = ThreadPool(1)
+        try:
+            page = self.call(endpoint, 'get', params=params)
+            while True:
+                pending = None
+                if page['more']:
+                    params = dict(params, after=page['cursor'])
+                    pending = pool.apply_async(
+                        prefetcher.call, (endpoint, 'get'),
+                        {'params': params})
+                for obj in page['results']:
+                    yield obj
+                if pending is None:
+                    return
+                page = pending.get()
+        finally:
+            pool.close()
+            pool.join()
+
+    def iter_messagesets(self, params=None, page_size=1000):
+        return self.iter_objects('messageset', params, page_size)
 
     def get_messagesets(self, params=None):
         return self.call('messageset', 'get', params=params)
@@ -60,6 +206,60 @@ class ContentStoreApiClient(object):
         return self.call('messageset', 'get',
                          obj='%s/messages' % messageset_id)
 
+    def get_messageset_bundles(self, messageset_id):
+        return self.call('messageset', 'get',
+                         obj='%s/bundles' % messageset_id)
+
+    def get_messageset_bundle(self, messageset_id, lang):
+        return self.call('messageset', 'get',
+                         obj='%s/bundles/%s' % (messageset_id, lang))
+
+    def publish_messageset(self, messageset_id):
+        """
+        Snapshot a message set's current messages as its next published
+        version, which never changes afterwards.
+
+        :returns: ``{"messageset", "version", "published_at", "langs"}``.
+        """
+        return self.call('messageset', 'post',
+                         obj='%s/publish/' % messageset_id)
+
+    def get_messageset_versions(self, messageset_id):
+        return self.call('messageset', 'get',
+                         obj='%s/versions' % messageset_id)
+
+    def get_messageset_version(self, messageset_id, version, lang=None):
+        """
+        Fetch a published version of a message set, with every language
+        track in ``tracks``, or only the ``messages`` of ``lang``.
+        """
+        obj = '%s/versions/%s' % (messageset_id, version)
+        if lang is not None:
+            obj = '%s/%s' % (obj, lang)
+        return self.call('messageset', 'get', obj=obj)
+
+    def get_messageset_timeline(self, messageset_id, start, lang,
+                                start_sequence=1):
+        """
+        Project when a subscriber in ``lang`` who starts on message
+        ``start_sequence`` at ``start`` will be sent each message of the
+        message set and the sets after it, on the runs of each set's
+        default schedule.
+
+        :param datetime start:
+            A timezone aware start time, or an ISO 8601 string.
+        :returns: ``{"messageset", "start_sequence", "lang", "sends",
+            "finishes_at"}``, with ``sends`` listing ``{"messageset",
+            "sequence_number", "send_at"}``.
+        """
+        params = {
+            'start': getattr(start, 'isoformat', lambda: start)(),
+            'start_sequence': start_sequence,
+            'lang': lang,
+        }
+        return self.call('messageset', 'get',
+                         obj='%s/timeline/' % messageset_id, params=params)
+
     def create_messageset(self, messageset):
         return self.call('messageset', 'post', data=messageset)
 
@@ -67,15 +267,133 @@ class ContentStoreApiClient(object):
         return self.call('messageset', 'put', obj=messageset_id,
                          data=messageset)
 
+    def patch_messageset(self, messageset_id, fields):
+        """
+        Update only the fields given in ``fields``, leaving the rest of the
+        message set as it is. The server only writes the columns whose
+        values changed.
+        """
+        return self.call('messageset', 'patch', obj=messageset_id,
+                         data=fields)
+
     def delete_messageset(self, messageset_id):
         return self.call('messageset', 'delete', obj=messageset_id)
 
+    def delete_messagesets(self, messageset_ids):
+        """
+        Delete several message sets and all their messages at once. Sets
+        whose ``next_set`` is one of them are deleted too, as with
+        ``delete_messageset``.
+
+        :returns: ``{"messagesets": <sets deleted>,
+                     "messages": <messages deleted>,
+                     "missing": <ids that didn't exist>}``
+        """
+        return self.call('messageset', 'post', obj='delete_many/',
+                         data={'ids': list(messageset_ids)})
+
+    def clone_messageset_track(self, messageset_id, lang, to_lang,
+                               to_messageset=None):
+        """
+        Copy every message in the ``lang`` track of a message set into the
+        empty ``to_lang`` track, on the server in a single transaction.
+
+        :param int to_messageset:
+            The message set to copy into, defaults to the same one.
+
+        :returns: ``{"count": <number of messages copied>}``
+        """
+        data = {'lang': lang, 'to_lang': to_lang}
+        if to_messageset is not None:
+            data['to_messageset'] = to_messageset
+        return self.call('messageset', 'post',
+                         obj='%s/clone/' % messageset_id, data=data)
+
+    def clone_messageset(self, messageset_id, short_name_suffix,
+                         include_next_sets=False):
+        """
+        Copy a message set and all its messages, naming the copy with
+        ``short_name_suffix`` appended to the original short name.
+
+        :param bool include_next_sets:
+            Also copy the sets reached through ``next_set``, linking the
+            copies to each other.
+
+        :returns: The list of new message sets.
+        """
+        return self.call('messageset', 'post',
+                         obj='%s/clone/' % messageset_id,
+                         data={'short_name_suffix': short_name_suffix,
+                               'include_next_sets': include_next_sets})
+
+    def resequence_messageset_track(self, messageset_id, lang, start=None,
+                                    shift=None, order=None):
+        """
+        Renumber the ``lang`` track of a message set atomically on the
+        server. Either pass ``start`` and ``shift`` to move every message
+        from sequence number ``start`` on by ``shift``, or pass ``order``,
+        a list of every message id in the track, to number them from 1.
+
+        :returns: ``{"count": <number of messages renumbered>}``
+        """
+        data = {'lang': lang}
+        if order is not None:
+            data['order'] = order
+        else:
+            data.update({'start': start, 'shift': shift})
+        return self.call('messageset', 'post',
+                         obj='%s/resequence/' % messageset_id, data=data)
+
+    def iter_messages(self, params=None, page_size=1000):
+        return self.iter_objects('message', params, page_size)
+
     def get_messages(self, params=None):
         return self.call('message', 'get', params=params)
 
+    def search_messages(self, query, params=None):
+        """
+        Full-text search of message text for every word in ``query``, best
+        match first.
+
+        :param dict params:
+            Filters such as ``messageset`` and ``lang``, and ``page`` and
+            ``page_size`` for pagination.
+
+        :returns: ``{"count", "next", "previous", "results"}`` where each
+            result is a message with a ``rank``.
+        """
+        params = dict(params or {}, q=query)
+        return self.call('message', 'get', obj='search/', params=params)
+
+    def get_message_segment_totals(self, params=None):
+        """
+        Count the SMS segments needed to send messages, for estimating cost.
+
+        :param dict params:
+            Filters such as ``messageset``, ``lang`` and ``encoding``.
+
+        :returns: ``{"messages", "segments", "encodings"}`` where
+            ``encodings`` has the message and segment counts of each
+            encoding used.
+        """
+        return self.call('message', 'get', obj='segment_totals/',
+                         params=params)
+
     def get_message(self, message_id):
         return self.call('message', 'get', obj=message_id)
 
+    def render_message(self, message_id, variables):
+        """
+        Fill in the ``{{ name }}`` placeholders of a message's text once for
+        each dict in ``variables``.
+
+        :returns: ``{"placeholders": [...], "results": [...]}`` with a
+            ``{"text": ...}`` result per dict, or ``{"error": ...}`` if it
+            was missing a placeholder.
+        """
+        return self.call('message', 'post', obj='%s/render/' % message_id,
+                         data={'variables': list(variables)})
+
     def get_message_content(self, message_id):
         return self.call('message', 'get',
                          obj='%s/content' % message_id)
@@ -87,9 +405,16 @@ class ContentStoreApiClient(object):
         return self.call('message', 'put', obj=message_id,
                          data=message)
 
+    def patch_message(self, message_id, fields):
+        return self.call('message', 'patch', obj=message_id,
+                         data=fields)
+
     def delete_message(self, message_id):
         return self.call('message', 'delete', obj=message_id)
 
+    def iter_schedules(self, params=None, page_size=1000):
+        return self.iter_objects('schedule', params, page_size)
+
     def get_schedules(self, params=None):
         return self.call('schedule', 'get', params=params)
 
@@ -103,35 +428,57 @@ class ContentStoreApiClient(object):
         return self.call('schedule', 'put', obj=schedule_id,
                          data=schedule)
 
+    def patch_schedule(self, schedule_id, fields):
+        return self.call('schedule', 'patch', obj=schedule_id,
+                         data=fields)
+
     def delete_schedule(self, schedule_id):
         return self.call('schedule', 'delete', obj=schedule_id)
 
+    def iter_binarycontents(self, params=None, page_size=1000):
+        return self.iter_objects('binarycontent', params, page_size)
+
     def get_binarycontents(self, params=None):
         return self.call('binarycontent', 'get', params=params)
 
     def get_binarycontent(self, binarycontent_id):
         return self.call('binarycontent', 'get', obj=binarycontent_id)
 
-    def create_binarycontent(self, binarycontent):
-        post_data = {
-            "content": binarycontent
-        }
-        url = '%s/binarycontent/' % (self.api_url.rstrip('/'),)
-        result = self.session.post(url, data=post_data,
-                                   format='multipart')
-        result.raise_for_status()
-        return result.json()
-
-    def update_binarycontent(self, binarycontent_id, binarycontent):
-        post_data = {
-            "content": binarycontent
-        }
-        url = '%s/binarycontent/%s/' % (self.api_url.rstrip('/'),
-                                        binarycontent_id)
-        result = self.session.put(url, data=post_data,
-                                  format='multipart')
+    def upload(self, method, path, fileobj, progress=None):
+        body = MultipartUpload('content', fileobj, progress=progress)
+        url = '%s/%s' % (self.api_url.rstrip('/'), path)
+        result = self.session.request(
+            method, url, data=body,
+            headers={'Content-Type': body.content_type})
         result.raise_for_status()
-        return result.json()
+        return decode_body(result)
+
+    def create_binarycontent(self, binarycontent, progress=None,
+                             skip_existing=False):
+        """
+        Upload a file as new binary content. The file is streamed, so it's
+        never held in memory whole.
+
+        :param binarycontent:
+            A seekable file object opened in binary mode.
+        :param progress:
+            Called with ``(bytes_sent, total_bytes)`` as the upload goes.
+        :param bool skip_existing:
+            Hash the file first, and return the binary content the server
+            already has with the same checksum instead of uploading it.
+        """
+        if skip_existing:
+            existing = self.get_binarycontents(
+                {'checksum': file_checksum(binarycontent)})
+            if existing:
+                return existing[0]
+        return self.upload('post', 'binarycontent/', binarycontent,
+                           progress=progress)
+
+    def update_binarycontent(self, binarycontent_id, binarycontent,
+                             progress=None):
+        return self.upload('put', 'binarycontent/%s/' % (binarycontent_id,),
+                           binarycontent, progress=progress)
 
     def delete_binarycontent(self, binarycontent_id):
         return self.call('binarycontent', 'delete', obj=binarycontent_id)
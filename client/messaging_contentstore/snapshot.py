@@ -0,0 +1,157 @@
+"""
+Read-only access to content store snapshots.
+
+Snapshots are SQLite files written by the server's ``export_snapshot``
+management command. They let senders answer content lookups locally
+instead of calling the HTTP API for every message.
+"""
+import sqlite3
+
+
+SNAPSHOT_FORMAT = 1
+
+
+class SnapshotError(Exception):
+
+    """
+    Raised when a file isn't a snapshot this reader understands.
+    """
+
+
+class ContentStoreSnapshot(object):
+
+    """
+    Lookups against a content store snapshot, returning the same dicts the
+    HTTP API does. Missing objects raise :class:`KeyError`.
+
+    :param str path:
+        The snapshot file.
+
+    :param bool preload:
+        Load the whole snapshot into memory when opened, so lookups are
+        dict accesses. Otherwise every lookup is an indexed SQLite query.
+        Defaults to ``True``.
+    """
+
+    TABLES = ('schedule', 'messageset', 'binarycontent', 'message')
+
+    def __init__(self, path, preload=True):
+        self.path = path
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        try:
+            meta = dict(self.db.execute('SELECT key, value FROM meta'))
+        except sqlite3.DatabaseError as err:
+            raise SnapshotError("%s is not a snapshot: %s" % (path, err))
+        if int(meta.get('format', 0)) != SNAPSHOT_FORMAT:
+            raise SnapshotError("Unsupported snapshot format %r." % (
+                meta.get('format'),))
+        self.created_at = meta['created_at']
+        self.cursor = int(meta['cursor'])
+        self.preloaded = preload
+        if preload:
+            self._load()
+
+    def _load(self):
+        self._objects = {}
+        for table in self.TABLES:
+            self._objects[table] = dict(
+                (row['id'], dict(row))
+                for row in self.db.execute('SELECT * FROM %s' % table))
+        self._tracks = {}
+        for message in sorted(self._objects['message'].values(),
+                              key=lambda m: (m['sequence_number'], m['id'])):
+            key = (message['messageset'], message['lang'],
+                   message['sequence_number'])
+            self._tracks.setdefault(key, message)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _get(self, table, object_id):
+        if self.preloaded:
+            return dict(self._objects[table][object_id])
+        row = self.db.execute(
+            'SELECT * FROM %s WHERE id = ?' % table, (object_id,)).fetchone()
+        if row is None:
+            raise KeyError(object_id)
+        return dict(row)
+
+    def _all(self, table, where='', params=(), order='id'):
+        return [dict(row) for row in self.db.execute(
+            'SELECT * FROM %s %s ORDER BY %s' % (table, where, order),
+            params)]
+
+    def get_schedule(self, schedule_id):
+        return self._get('schedule', schedule_id)
+
+    def get_schedules(self):
+        return self._all('schedule')
+
+    def get_messageset(self, messageset_id):
+        return self._get('messageset', messageset_id)
+
+    def get_messagesets(self):
+        return self._all('messageset')
+
+    def get_binarycontent(self, binarycontent_id):
+        return self._get('binarycontent', binarycontent_id)
+
+    def get_message(self, message_id):
+        return self._get('message', message_id)
+
+    def get_messages(self, messageset_id=None, lang=None):
+        where, params = [], []
+        if messageset_id is not None:
+            where.append('messageset = ?')
+            params.append(messageset_id)
+        if lang is not None:
+            where.append('lang = ?')
+            params.append(lang)
+        return self._all(
+            'message', 'WHERE ' + ' AND '.join(where) if where else '',
+            params, order='sequence_number, id')
+
+    def get_message_content(self, message_id):
+        """
+        A message with its binary content inlined, as
+        ``/message/<id>/content`` returns it.
+        """
+        message = self.get_message(message_id)
+        if message['binary_content'] is not None:
+            message['binary_content'] = self.get_binarycontent(
+                message['binary_content'])
+        return message
+
+    def get_track_message(self, messageset_id, lang, sequence_number):
+        """
+        The message at ``sequence_number`` in one language track of a
+        message set.
+        """
+        if self.preloaded:
+            return dict(self._tracks[
+                (messageset_id, lang, sequence_number)])
+        row = self.db.execute(
+            'SELECT * FROM message WHERE messageset = ? AND lang = ? AND '
+            'sequence_number = ? ORDER BY id LIMIT 1',
+            (messageset_id, lang, sequence_number)).fetchone()
+        if row is None:
+            raise KeyError((messageset_id, lang, sequence_number))
+        return dict(row)
+
+    def get_messageset_messages(self, messageset_id):
+        """
+        A message set with its messages and their binary content inlined,
+        as ``/messageset/<id>/messages`` returns it.
+        """
+        messageset = self.get_messageset(messageset_id)
+        messageset['messages'] = [
+            self.get_message_content(message['id'])
+            for message in self.get_messages(messageset_id)]
+        return messageset
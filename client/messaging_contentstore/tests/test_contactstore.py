@@ -2,7 +2,12 @@
 Tests for messaging_contentstore.contentstore.
 """
 
-from unittest import TestCase
+import hashlib
+import io
+import json
+import threading
+import zlib
+from unittest import TestCase, skipIf
 
 from requests import HTTPError
 from requests.adapters import HTTPAdapter
@@ -10,7 +15,9 @@ from requests_testadapter import TestSession, Resp, TestAdapter
 
 from verified_fake.fake_contentstore import Request, FakeContentStoreApi
 
-from client.messaging_contentstore.contentstore import ContentStoreApiClient
+from client.messaging_contentstore.contentstore import (
+    ContentStoreApiClient, msgpack)
+from client.messaging_contentstore.upload import MultipartUpload
 
 
 class FakeContentStoreApiAdapter(HTTPAdapter):
@@ -126,6 +133,190 @@ class TestContentStoreApiClient(TestCase):
         self.assertEqual(
             contentstore.api_url, "http://testserver/contentstore")
 
+    def test_accept_encoding(self):
+        self.assertTrue(
+            "gzip" in self.client.session.headers["Accept-Encoding"])
+
+    def test_compressed_response(self):
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        body = compressor.compress(json.dumps([{"id": 1}]).encode("utf-8"))
+        self.session.mount("http://gzip.example.com/", TestAdapter(
+            body + compressor.flush(), headers={"Content-Encoding": "gzip"}))
+        client = ContentStoreApiClient(
+            self.AUTH_TOKEN, api_url="http://gzip.example.com/contentstore",
+            session=self.session)
+        self.assertEqual(client.get_messagesets(), [{"id": 1}])
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_wire_format(self):
+        client = ContentStoreApiClient(
+            self.AUTH_TOKEN, api_url=self.API_URL, session=self.session,
+            wire_format="msgpack")
+        message = client.create_message({
+            "messageset": 1,
+            "sequence_number": 1,
+            "lang": "zul_ZA",
+            "text_content": u"Sawubona \u263a"
+        })
+        self.assertEqual(client.get_message(message["id"])["text_content"],
+                         u"Sawubona \u263a")
+
+    def test_unknown_wire_format(self):
+        self.assertRaises(ValueError, ContentStoreApiClient, self.AUTH_TOKEN,
+                          wire_format="xml")
+
+    def test_batch(self):
+        doomed = [self.make_existing_messageset({
+            u"short_name": u"Set %s" % i,
+            u"default_schedule": 1
+        }) for i in range(3)]
+        with self.client.batch(max_workers=4) as batch:
+            for hour in range(10):
+                batch.create_schedule({
+                    "minute": "0", "hour": str(hour), "day_of_week": "*",
+                    "day_of_month": "*", "month_of_year": "*"})
+            batch.delete_message(999)
+            for messageset in doomed:
+                batch.delete_messageset(messageset["id"])
+            self.assertRaises(AttributeError, getattr, batch, "get_messages")
+        results = batch.results
+        self.assertEqual(len(results), 14)
+        self.assertEqual([r.result["hour"] for r in results[:10]],
+                         [str(hour) for hour in range(10)])
+        self.assertEqual([r.error for r in results[:10]], [None] * 10)
+        self.assertEqual(results[10].result, None)
+        self.assertEqual(results[10].error.response.status_code, 404)
+        self.assertEqual([r.error for r in results[11:]], [None] * 3)
+        self.assertEqual(len(self.client.get_schedules()), 10)
+        self.assertEqual(self.client.get_messagesets(), [])
+
+    def test_batch_missing_messageset(self):
+        kept = self.make_existing_messageset({
+            u"short_name": u"Kept", u"default_schedule": 1})
+        doomed = self.make_existing_messageset({
+            u"short_name": u"Doomed", u"default_schedule": 1})
+        with self.client.batch() as batch:
+            batch.delete_messageset(999)
+            batch.delete_messageset(doomed["id"])
+        missing, deleted = batch.results
+        self.assertEqual(missing.error.response.status_code, 404)
+        self.assertEqual(deleted, (None, None))
+        self.assertEqual(self.client.get_messagesets(), [kept])
+
+    def test_batch_bulk_delete_fails(self):
+        doomed = self.make_existing_messageset({
+            u"short_name": u"Doomed", u"default_schedule": 1})
+        client = self.make_client()
+
+        def delete_messagesets(ids):
+            raise HTTPError("bulk delete unavailable")
+        client.delete_messagesets = delete_messagesets
+        with client.batch() as batch:
+            batch.delete_messageset(doomed["id"])
+            batch.delete_messageset(999)
+        deleted, missing = batch.results
+        self.assertEqual(deleted.error, None)
+        self.assertEqual(missing.error.response.status_code, 404)
+        self.assertEqual(self.client.get_messagesets(), [])
+
+    def test_batch_session_per_worker(self):
+        batch = self.client.batch()
+        clients = []
+        thread = threading.Thread(
+            target=lambda: clients.append(batch._worker_client()))
+        thread.start()
+        thread.join()
+        [client] = clients
+        self.assertTrue(client.session is not self.session)
+        self.assertEqual(client.session.headers, self.session.headers)
+        self.assertEqual(client.session.adapters, self.session.adapters)
+        self.assertTrue(batch._worker_client() is not client)
+
+    def test_iter_messages(self):
+        expected = sorted(self.make_existing_message({
+            u"messageset": 1,
+            u"sequence_number": i,
+            u"lang": u"eng_ZA",
+            u"text_content": u"Message %s" % i,
+        })[u"id"] for i in range(25))
+        messages = self.client.iter_messages(page_size=10)
+        self.assertEqual([m["id"] for m in messages], expected)
+
+        messages = self.client.iter_messages(page_size=10)
+        self.assertEqual(next(messages)["id"], expected[0])
+        messages.close()
+
+    def test_iter_prefetches_with_own_session(self):
+        for i in range(25):
+            self.make_existing_message({
+                u"messageset": 1, u"sequence_number": i,
+                u"lang": u"eng_ZA", u"text_content": u"Message %s" % i})
+        session_get = self.session.get
+        calls = []
+
+        def get(*args, **kwargs):
+            calls.append(threading.current_thread())
+            return session_get(*args, **kwargs)
+        self.session.get = get
+        messages = list(self.client.iter_messages(page_size=10))
+        self.assertEqual(len(messages), 25)
+        # Only the first page is fetched through the caller's session.
+        self.assertEqual(calls, [threading.current_thread()])
+
+    def test_iter_messagesets_empty(self):
+        self.assertEqual(list(self.client.iter_messagesets()), [])
+
+    def test_multipart_upload(self):
+        fileobj = io.BytesIO(b"\x00\x01" * 1000)
+        fileobj.name = "/tmp/audio.mp3"
+        full = MultipartUpload("content", fileobj).read()
+        fileobj.seek(0)
+        progress = []
+        upload = MultipartUpload("content", fileobj,
+                                 progress=lambda *a: progress.append(a))
+        body = b"".join(iter(lambda: upload.read(100), b""))
+        self.assertEqual(len(body), len(upload))
+        self.assertEqual(progress[-1], (len(body), len(body)))
+        self.assertTrue(len(progress) > 20)
+        self.assertEqual(body.split(b"\r\n\r\n", 1)[1].split(b"\r\n--")[0],
+                         b"\x00\x01" * 1000)
+        self.assertTrue(b'filename="audio.mp3"' in body)
+        self.assertTrue(b"Content-Type: audio/mpeg" in body)
+        self.assertEqual(len(full), len(body))
+
+    def test_create_binarycontent(self):
+        fileobj = io.BytesIO(b"ID3 some audio")
+        fileobj.name = "audio.mp3"
+        progress = []
+        binarycontent = self.client.create_binarycontent(
+            fileobj, progress=lambda *a: progress.append(a))
+        self.assertEqual(binarycontent["content"], "/media/audio.mp3")
+        self.assertEqual(binarycontent["checksum"],
+                         hashlib.sha256(b"ID3 some audio").hexdigest())
+        sent, total = progress[-1]
+        self.assertEqual(sent, total)
+
+        fileobj.seek(0)
+        self.assertEqual(self.client.create_binarycontent(
+            fileobj, skip_existing=True), binarycontent)
+        self.assertEqual(len(self.binary_content_data), 1)
+        fileobj = io.BytesIO(b"ID3 other audio")
+        fileobj.name = "other.mp3"
+        self.client.create_binarycontent(fileobj, skip_existing=True)
+        self.assertEqual(len(self.binary_content_data), 2)
+
+    def test_update_binarycontent(self):
+        fileobj = io.BytesIO(b"ID3 some audio")
+        fileobj.name = "audio.mp3"
+        binarycontent = self.client.create_binarycontent(fileobj)
+        fileobj = io.BytesIO(b"ID3 new audio")
+        fileobj.name = "new.mp3"
+        updated = self.client.update_binarycontent(
+            binarycontent["id"], fileobj)
+        self.assertEqual(updated["content"], "/media/new.mp3")
+        self.assertEqual(updated["checksum"],
+                         hashlib.sha256(b"ID3 new audio").hexdigest())
+
     def test_auth_failure(self):
         contentstore = self.make_client(auth_token="bogus_token")
         self.assert_http_error(403, contentstore.get_messagesets)
@@ -230,6 +421,48 @@ class TestContentStoreApiClient(TestCase):
         self.assertEqual(message["lang"],
                          new_message["lang"])
 
+    def test_update_message(self):
+        existing = self.make_existing_message({
+            "messageset": 1,
+            "sequence_number": 2,
+            "lang": "afr_ZA",
+            "text_content": "Message two"
+        })
+        message = self.client.update_message(existing["id"], {
+            "messageset": 1,
+            "sequence_number": 3,
+            "lang": "afr_ZA",
+            "text_content": "Message three"
+        })
+        self.assertEqual(message["sequence_number"], 3)
+        self.assertEqual(message["text_content"], "Message three")
+        self.assert_http_error(400, self.client.update_message,
+                               existing["id"], {"text_content": "Partial"})
+
+    def test_patch_message(self):
+        existing = self.make_existing_message({
+            "messageset": 1,
+            "sequence_number": 2,
+            "lang": "afr_ZA",
+            "text_content": "Message two"
+        })
+        message = self.client.patch_message(
+            existing["id"], {"text_content": "Message two, edited"})
+        self.assertEqual(message["text_content"], "Message two, edited")
+        self.assertEqual(message["sequence_number"], 2)
+        self.assertEqual(message["lang"], "afr_ZA")
+
+    def test_patch_in_batch(self):
+        existing = [self.make_existing_schedule({
+            "minute": "0", "hour": str(hour), "day_of_week": "*",
+            "day_of_month": "*", "month_of_year": "*",
+        }) for hour in range(3)]
+        with self.client.batch() as batch:
+            for schedule in existing:
+                batch.patch_schedule(schedule["id"], {"minute": "30"})
+        self.assertEqual([r.result["minute"] for r in batch.results],
+                         ["30"] * 3)
+
     def test_get_schedule(self):
         expected_schedule = self.make_existing_schedule({
             "minute": "1",
@@ -260,3 +493,268 @@ class TestContentStoreApiClient(TestCase):
                          new_schedule["day_of_month"])
         self.assertEqual(schedule["month_of_year"],
                          new_schedule["month_of_year"])
+
+    def test_get_messageset_bundles(self):
+        messageset = self.make_existing_messageset({
+            u"short_name": u"Full Set",
+            u"default_schedule": 1
+        })
+        for lang, seq in [("afr_ZA", 2), ("afr_ZA", 1), ("eng_ZA", 1)]:
+            self.make_existing_message({
+                "messageset": messageset["id"],
+                "sequence_number": seq,
+                "lang": lang,
+                "text_content": "%s %s" % (lang, seq)
+            })
+        bundles = self.client.get_messageset_bundles(messageset["id"])
+        self.assertEqual(bundles, [
+            {u"lang": u"afr_ZA", u"version": 1},
+            {u"lang": u"eng_ZA", u"version": 1},
+        ])
+        bundle = self.client.get_messageset_bundle(messageset["id"], "afr_ZA")
+        self.assertEqual(bundle["lang"], "afr_ZA")
+        self.assertEqual([m["text_content"] for m in bundle["messages"]],
+                         ["afr_ZA 1", "afr_ZA 2"])
+        self.assert_http_error(404, self.client.get_messageset_bundle,
+                               messageset["id"], "zul_ZA")
+
+    def test_get_messageset_timeline(self):
+        weekly = self.make_existing_schedule({
+            u"minute": u"0", u"hour": u"9", u"day_of_week": u"1,4"})
+        daily = self.make_existing_schedule({
+            u"minute": u"0", u"hour": u"8"})
+        second = self.make_existing_messageset({
+            u"short_name": u"Second", u"default_schedule": daily["id"]})
+        first = self.make_existing_messageset({
+            u"short_name": u"First", u"default_schedule": weekly["id"],
+            u"next_set": second["id"]})
+        for messageset, number in [(first, 1), (first, 2), (second, 1)]:
+            self.make_existing_message({
+                u"messageset": messageset["id"], u"sequence_number": number,
+                u"lang": u"eng_ZA", u"text_content": u"Hi"})
+        result = self.client.get_messageset_timeline(
+            first["id"], u"2015-06-01T12:00:00+02:00", u"eng_ZA")
+        self.assertEqual(result["sends"], [
+            {u"messageset": first["id"], u"sequence_number": 1,
+             u"send_at": u"2015-06-04T09:00:00Z"},
+            {u"messageset": first["id"], u"sequence_number": 2,
+             u"send_at": u"2015-06-08T09:00:00Z"},
+            {u"messageset": second["id"], u"sequence_number": 1,
+             u"send_at": u"2015-06-09T08:00:00Z"},
+        ])
+        self.assertEqual(result["finishes_at"], u"2015-06-09T08:00:00Z")
+        result = self.client.get_messageset_timeline(
+            first["id"], u"2015-06-01T12:00:00Z", u"afr_ZA", start_sequence=2)
+        self.assertEqual(result["sends"], [])
+        self.assert_http_error(
+            400, self.client.get_messageset_timeline, first["id"], u"soon",
+            u"eng_ZA")
+
+    def test_publish_messageset(self):
+        messageset = self.make_existing_messageset({
+            u"short_name": u"Full Set",
+            u"default_schedule": 1
+        })
+        message = self.make_existing_message({
+            "messageset": messageset["id"],
+            "sequence_number": 1,
+            "lang": "eng_ZA",
+            "text_content": "Version one"
+        })
+        result = self.client.publish_messageset(messageset["id"])
+        self.assertEqual(result["version"], 1)
+        self.assertEqual(result["langs"], ["eng_ZA"])
+        self.message_data[message["id"]]["text_content"] = "Version two"
+        self.client.publish_messageset(messageset["id"])
+
+        versions = self.client.get_messageset_versions(messageset["id"])
+        self.assertEqual([v["version"] for v in versions], [1, 2])
+        version = self.client.get_messageset_version(messageset["id"], 1)
+        self.assertEqual(
+            version["tracks"]["eng_ZA"][0]["text_content"], "Version one")
+        track = self.client.get_messageset_version(
+            messageset["id"], 2, lang="eng_ZA")
+        self.assertEqual(track["messages"][0]["text_content"], "Version two")
+        self.assert_http_error(404, self.client.get_messageset_version,
+                               messageset["id"], 3)
+        self.assert_http_error(404, self.client.get_messageset_version,
+                               messageset["id"], 1, lang="zul_ZA")
+
+    def test_clone_messageset_track(self):
+        messageset = self.make_existing_messageset({
+            u"short_name": u"Full Set",
+            u"default_schedule": 1
+        })
+        for seq in [1, 2]:
+            self.make_existing_message({
+                "messageset": messageset["id"],
+                "sequence_number": seq,
+                "lang": "eng_ZA",
+                "text_content": "Message %s" % seq
+            })
+        result = self.client.clone_messageset_track(
+            messageset["id"], "eng_ZA", "afr_ZA")
+        self.assertEqual(result, {u"count": 2})
+        bundle = self.client.get_messageset_bundle(messageset["id"], "afr_ZA")
+        self.assertEqual([m["text_content"] for m in bundle["messages"]],
+                         ["Message 1", "Message 2"])
+        self.assert_http_error(400, self.client.clone_messageset_track,
+                               messageset["id"], "eng_ZA", "afr_ZA")
+
+    def test_clone_messageset(self):
+        messageset = self.make_existing_messageset({
+            u"short_name": u"Full Set",
+            u"default_schedule": 1
+        })
+        self.make_existing_message({
+            "messageset": messageset["id"],
+            "sequence_number": 1,
+            "lang": "eng_ZA",
+            "text_content": "Message 1"
+        })
+        [clone] = self.client.clone_messageset(messageset["id"], " v2")
+        self.assertEqual(clone["short_name"], u"Full Set v2")
+        self.assertNotEqual(clone["id"], messageset["id"])
+        bundle = self.client.get_messageset_bundle(clone["id"], "eng_ZA")
+        self.assertEqual([m["text_content"] for m in bundle["messages"]],
+                         ["Message 1"])
+
+    def test_resequence_messageset_track(self):
+        messageset = self.make_existing_messageset({
+            u"short_name": u"Full Set",
+            u"default_schedule": 1
+        })
+        messages = [self.make_existing_message({
+            "messageset": messageset["id"],
+            "sequence_number": seq,
+            "lang": "eng_ZA",
+            "text_content": "Message %s" % seq
+        }) for seq in [1, 2, 3]]
+        result = self.client.resequence_messageset_track(
+            messageset["id"], "eng_ZA", start=2, shift=1)
+        self.assertEqual(result, {u"count": 2})
+        self.assertEqual(
+            [self.client.get_message(m["id"])["sequence_number"]
+             for m in messages], [1, 3, 4])
+        result = self.client.resequence_messageset_track(
+            messageset["id"], "eng_ZA",
+            order=[m["id"] for m in reversed(messages)])
+        self.assertEqual(result, {u"count": 3})
+        bundle = self.client.get_messageset_bundle(messageset["id"], "eng_ZA")
+        self.assertEqual([m["text_content"] for m in bundle["messages"]],
+                         ["Message 3", "Message 2", "Message 1"])
+        self.assert_http_error(400, self.client.resequence_messageset_track,
+                               messageset["id"], "eng_ZA", order=[])
+
+    def test_delete_messagesets(self):
+        last = self.make_existing_messageset({
+            u"short_name": u"Last Set",
+            u"default_schedule": 1
+        })
+        first = self.make_existing_messageset({
+            u"short_name": u"First Set",
+            u"default_schedule": 1,
+            u"next_set": last["id"]
+        })
+        self.make_existing_message({
+            "messageset": first["id"],
+            "sequence_number": 1,
+            "lang": "eng_ZA",
+            "text_content": "Message 1"
+        })
+        result = self.client.delete_messagesets([last["id"]])
+        self.assertEqual(result, {u"messagesets": 2, u"messages": 1,
+                                  u"missing": []})
+        self.assertEqual(self.client.get_messagesets(), [])
+        self.assertEqual(self.client.get_messages(), [])
+
+    def test_search_messages(self):
+        messageset = self.make_existing_messageset({
+            u"short_name": u"Full Set",
+            u"default_schedule": 1
+        })
+        for seq, lang, text in [(1, "eng_ZA", "Drink clean water"),
+                                (2, "eng_ZA", "Water, more water"),
+                                (3, "eng_ZA", "Visit the clinic"),
+                                (1, "afr_ZA", "Drink skoon water")]:
+            self.make_existing_message({
+                "messageset": messageset["id"],
+                "sequence_number": seq,
+                "lang": lang,
+                "text_content": text
+            })
+        results = self.client.search_messages("water")
+        self.assertEqual(results["count"], 3)
+        self.assertEqual(results["results"][0]["text_content"],
+                         "Water, more water")
+        results = self.client.search_messages(
+            "water", params={"lang": "afr_ZA"})
+        self.assertEqual([r["text_content"] for r in results["results"]],
+                         ["Drink skoon water"])
+        results = self.client.search_messages(
+            "water", params={"page_size": 2, "page": 2})
+        self.assertEqual(len(results["results"]), 1)
+        self.assertEqual(results["next"], None)
+
+    def test_render_message(self):
+        message = self.make_existing_message({
+            "messageset": 1,
+            "sequence_number": 1,
+            "lang": "eng_ZA",
+            "text_content": "Hi {{ name }}, see you at {{clinic}}."
+        })
+        result = self.client.render_message(message["id"], [
+            {"name": "Thandi", "clinic": "Khayelitsha"},
+            {"name": "Sipho"},
+        ])
+        self.assertEqual(result["placeholders"], ["name", "clinic"])
+        self.assertEqual(result["results"][0],
+                         {"text": "Hi Thandi, see you at Khayelitsha."})
+        self.assertEqual(result["results"][1],
+                         {"error": "Missing variable clinic."})
+
+    def test_get_message_segment_totals(self):
+        for seq, lang, text in [(1, "eng_ZA", "x" * 161),
+                                (2, "eng_ZA", "Hi {{ name }}"),
+                                (1, "zul_ZA", u"Sawubona \u263a")]:
+            self.make_existing_message({
+                "messageset": 1,
+                "sequence_number": seq,
+                "lang": lang,
+                "text_content": text
+            })
+        self.assertEqual(self.client.get_message_segment_totals(), {
+            u"messages": 3,
+            u"segments": 4,
+            u"encodings": {
+                u"gsm7": {u"messages": 2, u"segments": 3},
+                u"ucs2": {u"messages": 1, u"segments": 1},
+            },
+        })
+        totals = self.client.get_message_segment_totals({"lang": "eng_ZA"})
+        self.assertEqual(totals["segments"], 3)
+
+    def test_sync(self):
+        mirror = {}
+        messageset = self.client.create_messageset({
+            u"short_name": u"Full Set",
+            u"default_schedule": 1
+        })
+        message = self.client.create_message({
+            "messageset": messageset["id"],
+            "sequence_number": 1,
+            "lang": "afr_ZA",
+            "text_content": "Message one"
+        })
+        cursor = self.client.sync(mirror, limit=1)
+        self.assertEqual(cursor, 2)
+        self.assertEqual(mirror, {
+            "messageset": {messageset["id"]: messageset},
+            "message": {message["id"]: message},
+        })
+
+        self.client.delete_messageset(messageset["id"])
+        cursor = self.client.sync(mirror, since=cursor)
+        self.assertEqual(cursor, 3)
+        self.assertEqual(mirror["messageset"], {})
+        self.assertEqual(self.client.sync(mirror, since=cursor), 3)
@@ -0,0 +1,94 @@
+"""
+Streaming file uploads, so binary content is sent without reading the
+whole file into memory.
+"""
+import hashlib
+import mimetypes
+import os
+import uuid
+
+CHUNK_SIZE = 64 * 1024
+
+
+def file_checksum(fileobj, chunk_size=CHUNK_SIZE):
+    """
+    The SHA-256 hex digest of ``fileobj`` from its current position, as the
+    server records it for binary content. The position is restored after.
+    """
+    start = fileobj.tell()
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: fileobj.read(chunk_size), b''):
+        digest.update(chunk)
+    fileobj.seek(start)
+    return digest.hexdigest()
+
+
+class MultipartUpload(object):
+
+    """
+    A ``multipart/form-data`` request body holding one file field, read
+    from ``fileobj`` a block at a time as the body is sent.
+
+    :param str field:
+        The form field name.
+    :param fileobj:
+        A seekable file object opened in binary mode.
+    :param progress:
+        Called with ``(bytes_sent, total_bytes)`` after each block.
+    """
+
+    def __init__(self, field, fileobj, filename=None, content_type=None,
+                 progress=None):
+        if filename is None:
+            filename = os.path.basename(getattr(fileobj, 'name', '') or '')
+        filename = filename or field
+        if content_type is None:
+            content_type = (mimetypes.guess_type(filename)[0] or
+                            'application/octet-stream')
+        boundary = uuid.uuid4().hex
+        self.content_type = 'multipart/form-data; boundary=%s' % (boundary,)
+        self.parts = [
+            ('--%s\r\nContent-Disposition: form-data; name="%s"; '
+             'filename="%s"\r\nContent-Type: %s\r\n\r\n' % (
+                 boundary, field, filename, content_type)).encode('utf-8'),
+            fileobj,
+            ('\r\n--%s--\r\n' % (boundary,)).encode('utf-8'),
+        ]
+        start = fileobj.tell()
+        fileobj.seek(0, os.SEEK_END)
+        self.len = (len(self.parts[0]) + fileobj.tell() - start +
+                    len(self.parts[2]))
+        fileobj.seek(start)
+        self.progress = progress
+        self.sent = 0
+        self.part = 0
+        self.offset = 0
+
+    def __len__(self):
+        return self.len
+
+    def __iter__(self):
+        return iter(lambda: self.read(CHUNK_SIZE), b'')
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.len
+        chunks = []
+        while size > 0 and self.part < len(self.parts):
+            part = self.parts[self.part]
+            if isinstance(part, bytes):
+                chunk = part[self.offset:self.offset + size]
+                self.offset += len(chunk)
+            else:
+                chunk = part.read(size)
+            if not chunk:
+                self.part += 1
+                self.offset = 0
+                continue
+            chunks.append(chunk)
+            size -= len(chunk)
+        data = b''.join(chunks)
+        self.sent += len(data)
+        if data and self.progress is not None:
+            self.progress(self.sent, self.len)
+        return data
@@ -0,0 +1,21 @@
+from django.apps import AppConfig, apps
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_save, post_delete
+
+
+class ContentStoreConfig(AppConfig):
+
+    name = 'contentstore'
+    verbose_name = 'Content Store'
+
+    def ready(self):
+        if apps.is_installed('rest_framework.authtoken'):
+            from rest_framework.authtoken.models import Token
+            from .authentication import (invalidate_saved_token,
+                                         invalidate_user_tokens)
+            post_save.connect(invalidate_saved_token, sender=Token,
+                              dispatch_uid='contentstore.token.save')
+            post_delete.connect(invalidate_saved_token, sender=Token,
+                                dispatch_uid='contentstore.token.delete')
+            post_save.connect(invalidate_user_tokens, sender=get_user_model(),
+                              dispatch_uid='contentstore.token.user')
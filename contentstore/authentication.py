@@ -0,0 +1,60 @@
+"""
+Token authentication that keeps recently used tokens in the cache.
+
+``CachedTokenAuthentication`` saves the token and user lookup on most
+requests. Cached tokens expire after ``CONTENTSTORE_TOKEN_CACHE_SECONDS``
+(60 by default) and are dropped as soon as the token is changed or
+deleted, or its user is saved (for example, deactivated) or deleted.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.utils.encoding import force_bytes
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+DEFAULT_CACHE_SECONDS = 60
+
+
+def _cache_key(key):
+    # Token keys are credentials, so keep them out of the cache's key space.
+    return 'contentstore:token:%s' % (
+        hashlib.sha256(force_bytes(key)).hexdigest(),)
+
+
+def invalidate_token(key):
+    default_cache.delete(_cache_key(key))
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+
+    """
+    ``TokenAuthentication`` serving tokens from the cache when it can.
+    """
+
+    cache = default_cache
+
+    def authenticate_credentials(self, key):
+        cache_key = _cache_key(key)
+        token = self.cache.get(cache_key)
+        if token is None:
+            user, token = super(
+                CachedTokenAuthentication, self).authenticate_credentials(key)
+            self.cache.set(cache_key, token, getattr(
+                settings, 'CONTENTSTORE_TOKEN_CACHE_SECONDS',
+                DEFAULT_CACHE_SECONDS))
+        elif not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+        return (token.user, token)
+
+
+def invalidate_saved_token(sender, instance, **kwargs):
+    invalidate_token(instance.key)
+
+
+def invalidate_user_tokens(sender, instance, **kwargs):
+    for key in Token.objects.filter(user_id=instance.pk).values_list(
+            'key', flat=True):
+        invalidate_token(key)
@@ -0,0 +1,655 @@
+"""
+Set-based bulk operations on content: streaming CSV or NDJSON import and
+export for the ``import_content`` and ``export_content`` management
+commands, and cloning of message sets and language tracks.
+
+Bulk writes bypass model signals, so the change log and message set
+bundles are updated explicitly.
+"""
+import csv
+import json
+import operator
+from collections import Counter, OrderedDict
+from functools import reduce
+from itertools import islice
+
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.management.color import no_style
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, IntegerField, Max, Q, Value, When
+from django.utils import six, timezone
+from django.utils.encoding import filepath_to_uri
+from rest_framework.exceptions import ValidationError
+
+from .models import (Schedule, MessageSet, Message, BinaryContent,
+                     MessageSetBundle, MessageSetVersion, Change)
+
+
+FORMATS = ('csv', 'ndjson')
+
+COLUMNS = OrderedDict([
+    ('schedule', (Schedule, ('minute', 'hour', 'day_of_week',
+                             'day_of_month', 'month_of_year'))),
+    ('messageset', (MessageSet, ('short_name', 'notes', 'next_set',
+                                 'default_schedule'))),
+    ('message', (Message, ('messageset', 'sequence_number', 'lang',
+                           'text_content', 'binary_content'))),
+])
+
+# Columns that tell the rows just inserted apart from rows other
+# transactions insert at the same time, where the database can't report
+# the ids it assigned.
+NATURAL_KEYS = {
+    Schedule: COLUMNS['schedule'][1],
+    MessageSet: ('short_name',),
+    Message: ('messageset', 'sequence_number', 'lang'),
+}
+
+# Invalid rows kept for reporting; the rest are only counted.
+MAX_ERRORS = 100
+
+
+class RowError(Exception):
+
+    """
+    A row that can't be imported, with its line number and errors.
+    """
+
+    def __init__(self, line, errors):
+        super(RowError, self).__init__(line, errors)
+        self.line = line
+        self.errors = errors
+
+    def __str__(self):
+        return 'line %s: %s' % (self.line, '; '.join(
+            '%s: %s' % (field, ' '.join(six.text_type(e) for e in errors))
+            for field, errors in sorted(self.errors.items())))
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def read_rows(stream, format):
+    """
+        Yields ``(line, row)`` for each row in ``stream``. Rows that can't
+        be parsed raise ``ValueError`` with their line number.
+    """
+    if format == 'ndjson':
+        for line, text in enumerate(stream, 1):
+            if isinstance(text, bytes):
+                text = text.decode('utf-8')
+            if text.strip():
+                try:
+                    row = json.loads(text)
+                except ValueError as err:
+                    raise ValueError('line %s: %s' % (line, err))
+                yield line, row
+    else:
+        reader = csv.DictReader(stream)
+        # The header is line 1.
+        line = 1
+        while True:
+            line += 1
+            try:
+                row = next(reader)
+            except StopIteration:
+                return
+            except csv.Error as err:
+                raise ValueError('line %s: %s' % (line, err))
+            if six.PY2:
+                row = dict((key.decode('utf-8'), value.decode('utf-8'))
+                           for key, value in row.items())
+            yield line, row
+
+
+def write_rows(stream, format, fields, rows):
+    """
+        Writes ``rows`` of values in ``fields`` order to ``stream``,
+        returning how many were written.
+    """
+    count = 0
+    if format == 'ndjson':
+        for row in rows:
+            stream.write(json.dumps(dict(zip(fields, row))) + '\n')
+            count += 1
+        return count
+    writer = csv.writer(stream)
+    writer.writerow(fields)
+    for row in rows:
+        row = ['' if value is None else value for value in row]
+        if six.PY2:
+            row = [value.encode('utf-8')
+                   if isinstance(value, six.text_type) else value
+                   for value in row]
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def _allocate_ids(model, count):
+    """
+        Takes ``count`` ids from the primary key sequence on PostgreSQL, so
+        rows can be bulk created knowing their ids. Returns ``None`` on other
+        databases.
+    """
+    if connection.vendor != 'postgresql' or not count:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+            'FROM generate_series(1, %s)',
+            [model._meta.db_table, model._meta.pk.column, count])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def natural_key(instance):
+    return tuple(getattr(instance, instance._meta.get_field(name).attname)
+                 for name in NATURAL_KEYS[type(instance)])
+
+
+def find_inserted(queryset, last, keys):
+    """
+        The ids of rows in ``queryset`` after id ``last`` whose natural keys
+        are in ``keys``, at most one per key given, so rows other
+        transactions insert meanwhile aren't taken for the ones just
+        inserted.
+    """
+    wanted = Counter(keys)
+    ids = []
+    rows = queryset.filter(pk__gt=last).order_by('pk').values_list(
+        'pk', *NATURAL_KEYS[queryset.model])
+    for row in rows.iterator():
+        if wanted[row[1:]] > 0:
+            wanted[row[1:]] -= 1
+            ids.append(row[0])
+    return ids
+
+
+def export_rows(name):
+    """
+        The fields and a row iterator for exporting ``name`` objects.
+    """
+    model, columns = COLUMNS[name]
+    fields = ('id',) + columns
+    return fields, model.objects.order_by('id').values_list(
+        *fields).iterator()
+
+
+class Importer(object):
+
+    """
+    Validates and bulk creates rows of one kind of content.
+
+    :param str name:
+        One of the keys of ``COLUMNS``.
+    :param bool keep_ids:
+        Create objects with the ``id`` given in each row instead of
+        letting the database assign one.
+    :param int max_errors:
+        How many invalid rows to keep for reporting. ``error_count``
+        counts them all.
+
+    Rows are held a chunk at a time. What's kept across chunks is every
+    value of a unique column (message set short names), so duplicates
+    within the file are caught; with ``keep_ids`` the ids of models that
+    refer to themselves (message sets, through ``next_set``), so rows can
+    point at earlier ones; and each message track touched.
+    """
+
+    def __init__(self, name, keep_ids=False, max_errors=MAX_ERRORS):
+        self.model, self.columns = COLUMNS[name]
+        self.keep_ids = keep_ids
+        self.max_errors = max_errors
+        self.fields = [self.model._meta.get_field(column)
+                       for column in self.columns]
+        self.foreign_keys = [f for f in self.fields if f.rel is not None]
+        self.unique = [f for f in self.fields if f.unique]
+        self.seen = dict((f.name, set()) for f in self.unique)
+        self.self_referencing = any(f.rel.to is self.model
+                                    for f in self.foreign_keys)
+        self.tracks = set()
+        self.imported_ids = set()
+        self.error_count = 0
+
+    def build(self, line, row):
+        values = {}
+        errors = {}
+        fields = list(self.fields)
+        if self.keep_ids:
+            fields.insert(0, self.model._meta.pk)
+        for field in fields:
+            value = row.get(field.name)
+            if value == '' and field.null:
+                value = None
+            if field.rel is not None and value is not None:
+                # ForeignKey.to_python doesn't coerce to the target type.
+                to_python = field.rel.get_related_field().to_python
+            else:
+                to_python = field.to_python
+            try:
+                values[field.attname] = to_python(value)
+            except DjangoValidationError as err:
+                errors[field.name] = err.messages
+        instance = self.model(**values)
+        if not errors:
+            try:
+                instance.full_clean(
+                    exclude=[f.name for f in self.foreign_keys],
+                    validate_unique=False)
+            except DjangoValidationError as err:
+                errors.update(err.message_dict)
+            except ValidationError as err:
+                errors['non_field_errors'] = err.detail
+        if errors:
+            raise RowError(line, errors)
+        return instance
+
+    def validate_chunk(self, rows):
+        """
+            Returns the instances for a chunk of ``(line, row)`` pairs and
+            the errors found, checking references and uniqueness with one
+            query per field for the whole chunk.
+        """
+        instances, errors = [], []
+        for line, row in rows:
+            try:
+                instances.append((line, self.build(line, row)))
+            except RowError as err:
+                errors.append(err)
+        for field in self.foreign_keys:
+            ids = set(getattr(i, field.attname) for line, i in instances)
+            ids.discard(None)
+            existing = set(field.rel.to._default_manager.filter(
+                pk__in=ids).values_list('pk', flat=True))
+            if field.rel.to is self.model:
+                # Rows may point at other rows of the same import.
+                existing |= self.imported_ids | set(
+                    i.pk for line, i in instances)
+            for line, instance in instances:
+                value = getattr(instance, field.attname)
+                if value is not None and value not in existing:
+                    errors.append(RowError(line, {field.name: [
+                        'Invalid pk "%s" - object does not exist.' % (
+                            value,)]}))
+        for field in self.unique:
+            values = set(getattr(i, field.attname) for line, i in instances)
+            taken = set(self.model._default_manager.filter(**{
+                '%s__in' % field.name: values}).values_list(
+                field.name, flat=True)) | self.seen[field.name]
+            for line, instance in instances:
+                value = getattr(instance, field.attname)
+                if value in taken:
+                    errors.append(RowError(line, {field.name: [
+                        'This field must be unique.']}))
+                taken.add(value)
+            self.seen[field.name] |= values
+        failed = set(err.line for err in errors)
+        return [i for line, i in instances if line not in failed], errors
+
+    def insert(self, instances):
+        if not self.keep_ids:
+            for instance, pk in zip(instances, _allocate_ids(
+                    self.model, len(instances)) or ()):
+                instance.pk = pk
+        if all(i.pk is not None for i in instances):
+            self.model.objects.bulk_create(instances)
+            ids = [i.pk for i in instances]
+        else:
+            # bulk_create doesn't return ids, so pick the new rows out by
+            # their natural keys.
+            last = self.model.objects.aggregate(last=Max('id'))['last'] or 0
+            self.model.objects.bulk_create(instances)
+            ids = find_inserted(self.model.objects.all(), last,
+                                [natural_key(i) for i in instances])
+        Change.objects.record(self.model, ids, Change.CREATED)
+        if self.keep_ids and self.self_referencing:
+            self.imported_ids.update(ids)
+        if self.model is Message:
+            self.tracks.update((i.messageset_id, i.lang) for i in instances)
+
+    def finish(self):
+        if self.keep_ids:
+            with connection.cursor() as cursor:
+                for sql in connection.ops.sequence_reset_sql(
+                        no_style(), [self.model]):
+                    cursor.execute(sql)
+        for messageset_id, lang in self.tracks:
+            MessageSetBundle.objects.mark_stale(messageset_id, lang)
+
+    def run(self, rows, chunk_size=1000, dry_run=False, progress=None):
+        """
+            Imports ``(line, row)`` pairs, returning the number of rows
+            imported (or that would be, for a dry run) and the first
+            ``max_errors`` errors found. Nothing is written if any row
+            fails.
+        """
+        count = 0
+        errors = []
+        with transaction.atomic():
+            for chunk in chunked(rows, chunk_size):
+                instances, chunk_errors = self.validate_chunk(chunk)
+                self.error_count += len(chunk_errors)
+                errors.extend(
+                    chunk_errors[:self.max_errors - len(errors)])
+                if not dry_run and not self.error_count:
+                    self.insert(instances)
+                count += len(instances)
+                if progress is not None:
+                    progress(count, self.error_count)
+            if not dry_run and not self.error_count:
+                self.finish()
+            else:
+                transaction.set_rollback(True)
+        return count, errors
+
+
+def _copy_messages(source_id, target_id, lang=None, to_lang=None):
+    """
+        Copies the messages of a message set, or of one of its language
+        tracks, into another with a single ``INSERT ... SELECT``. Returns
+        the new ids on PostgreSQL, and ``None`` elsewhere.
+    """
+    qn = connection.ops.quote_name
+    table = qn(Message._meta.db_table)
+    overrides = {'messageset': '%s', 'created_at': '%s', 'updated_at': '%s'}
+    if to_lang is not None:
+        overrides['lang'] = '%s'
+    columns, selects, params = [], [], []
+    now = timezone.now()
+    values = {'messageset': target_id, 'created_at': now, 'updated_at': now,
+              'lang': to_lang}
+    for field in Message._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        columns.append(qn(field.column))
+        if field.name in overrides:
+            selects.append('%s')
+            params.append(field.get_db_prep_save(values[field.name],
+                                                 connection))
+        else:
+            selects.append(qn(field.column))
+    where = '%s = %%s' % qn(Message._meta.get_field('messageset').column)
+    params.append(source_id)
+    if lang is not None:
+        where += ' AND %s = %%s' % qn(Message._meta.get_field('lang').column)
+        params.append(lang)
+    sql = 'INSERT INTO %s (%s) SELECT %s FROM %s WHERE %s' % (
+        table, ', '.join(columns), ', '.join(selects), table, where)
+    returning = connection.vendor == 'postgresql'
+    if returning:
+        sql += ' RETURNING %s' % qn(Message._meta.pk.column)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        if returning:
+            return [row[0] for row in cursor.fetchall()]
+
+
+def _copy_and_record_messages(source_id, target_id, lang=None,
+                              to_lang=None):
+    """
+        Copies messages with :func:`_copy_messages` and records the copies
+        in the change log and their tracks' bundles. Where the database
+        can't report the new ids, the copies are picked out by natural key,
+        so messages others add to the target meanwhile aren't recorded.
+    """
+    source = Message.objects.filter(messageset_id=source_id)
+    if lang is not None:
+        source = source.filter(lang=lang)
+    keys = [(target_id, sequence_number, to_lang or message_lang)
+            for sequence_number, message_lang in source.values_list(
+                'sequence_number', 'lang')]
+    last = Message.objects.aggregate(last=Max('id'))['last'] or 0
+    ids = _copy_messages(source_id, target_id, lang, to_lang)
+    if ids is None:
+        ids = find_inserted(Message.objects.filter(messageset_id=target_id),
+                            last, keys)
+    Change.objects.record(Message, ids, Change.CREATED)
+    for track_lang in set(key[2] for key in keys):
+        MessageSetBundle.objects.mark_stale(target_id, track_lang)
+
+
+def clone_track(messageset, lang, to_lang, to_messageset=None):
+    """
+        Copies every message of the ``lang`` track of ``messageset`` into
+        the ``to_lang`` track of ``to_messageset`` (by default the same
+        message set), which must be empty. Returns the number of messages
+        copied.
+    """
+    if to_messageset is None:
+        to_messageset = messageset
+    if (to_messageset, to_lang) == (messageset, lang):
+        raise ValidationError({'to_lang': [
+            'Cannot clone a track onto itself.']})
+    with transaction.atomic():
+        if Message.objects.filter(messageset=to_messageset,
+                                  lang=to_lang).exists():
+            raise ValidationError({'to_lang': [
+                'The %s track of %s already has messages.' % (
+                    to_lang, to_messageset.short_name)]})
+        _copy_and_record_messages(messageset.pk, to_messageset.pk, lang,
+                                  to_lang)
+        return Message.objects.filter(messageset=to_messageset,
+                                      lang=to_lang).count()
+
+
+def messageset_chain(messageset):
+    """
+        ``messageset`` followed by the sets reached through ``next_set``,
+        stopping before any set is repeated.
+    """
+    chain = [messageset]
+    seen = set([messageset.pk])
+    while chain[-1].next_set_id is not None:
+        if chain[-1].next_set_id in seen:
+            break
+        chain.append(chain[-1].next_set)
+        seen.add(chain[-1].pk)
+    return chain
+
+
+def clone_messagesets(messageset, short_name_suffix, include_next_sets=False):
+    """
+        Copies ``messageset`` and all of its messages, naming the copy with
+        ``short_name_suffix`` appended. With ``include_next_sets`` the whole
+        ``next_set`` chain is copied and the copies are linked to each
+        other. Returns a dict mapping original ids to the copies.
+    """
+    if include_next_sets:
+        originals = messageset_chain(messageset)
+    else:
+        originals = [messageset]
+    max_length = MessageSet._meta.get_field('short_name').max_length
+    names = [o.short_name + short_name_suffix for o in originals]
+    errors = ['%r is longer than %s characters.' % (name, max_length)
+              for name in names if len(name) > max_length]
+    if errors:
+        raise ValidationError({'short_name_suffix': errors})
+
+    try:
+        with transaction.atomic():
+            # Checked in the transaction, so the names are only free if no
+            # other clone has taken them yet.
+            errors = _taken_names(names)
+            if errors:
+                raise ValidationError({'short_name_suffix': errors})
+            clones = {}
+            for original, name in zip(originals, names):
+                clones[original.pk] = MessageSet.objects.create(
+                    short_name=name, notes=original.notes,
+                    default_schedule_id=original.default_schedule_id,
+                    next_set_id=original.next_set_id)
+            for original in originals:
+                clone = clones[original.pk]
+                if original.next_set_id in clones:
+                    clone.next_set = clones[original.next_set_id]
+                    clone.save()
+                _copy_and_record_messages(original.pk, clone.pk)
+    except IntegrityError:
+        # Another clone took one of the names after they were checked.
+        errors = _taken_names(names) or ['A name is already taken.']
+        raise ValidationError({'short_name_suffix': errors})
+    return clones
+
+
+def _taken_names(names):
+    taken = MessageSet.objects.filter(short_name__in=names).values_list(
+        'short_name', flat=True)
+    return ['%r is already taken.' % (name,) for name in taken]
+
+
+def resequence_track(messageset, lang, start=None, shift=None, order=None):
+    """
+        Renumbers the ``lang`` track of ``messageset`` with one ``UPDATE``.
+        Either moves every message from sequence number ``start`` on by
+        ``shift``, or numbers the message ids in ``order`` from 1, in which
+        case ``order`` must list the whole track. Returns the number of
+        messages changed.
+    """
+    track = Message.objects.filter(messageset=messageset, lang=lang)
+    with transaction.atomic():
+        ids = list(track.select_for_update().values_list('pk', flat=True))
+        if order is not None:
+            if sorted(order) != sorted(ids):
+                raise ValidationError({'order': [
+                    'Must list every message in the track exactly once.']})
+            changed = track.filter(pk__in=order)
+            sequence_number = Case(*[
+                When(pk=pk, then=Value(i)) for i, pk in enumerate(order, 1)
+            ], output_field=IntegerField())
+        else:
+            changed = track.filter(sequence_number__gte=start)
+            sequence_number = F('sequence_number') + shift
+        ids = list(changed.values_list('pk', flat=True))
+        if not ids:
+            return 0
+        changed.update(sequence_number=sequence_number,
+                       updated_at=timezone.now())
+        Change.objects.record(Message, ids, Change.UPDATED)
+        MessageSetBundle.objects.mark_stale(messageset.pk, lang)
+    return len(ids)
+
+
+def _cascaded_messageset_ids(ids):
+    # The ORM cascades deletes through next_set, so do the same.
+    ids = set(ids)
+    new = ids
+    while new:
+        new = set(MessageSet.objects.filter(next_set_id__in=new).exclude(
+            pk__in=ids).values_list('pk', flat=True))
+        ids |= new
+    return ids
+
+
+def delete_messagesets(ids):
+    """
+        Deletes the message sets with ``ids``, any sets whose ``next_set``
+        is one of them, their messages, bundles and published versions with
+        a handful of set-based queries. Returns the number of message sets
+        and messages deleted, and the sorted ``ids`` that didn't exist.
+    """
+    with transaction.atomic():
+        found = list(MessageSet.objects.select_for_update().filter(
+            pk__in=ids).values_list('pk', flat=True))
+        missing = sorted(set(ids) - set(found))
+        ids = _cascaded_messageset_ids(found)
+        if not ids:
+            return 0, 0, missing
+        messages = Message.objects.filter(messageset_id__in=ids)
+        message_ids = list(messages.values_list('pk', flat=True))
+        Change.objects.record(Message, message_ids, Change.DELETED)
+        Change.objects.record(MessageSet, ids, Change.DELETED)
+        MessageSetBundle.objects.filter(messageset_id__in=ids).delete()
+        MessageSetVersion.objects.filter(messageset_id__in=ids).delete()
+        messages._raw_delete(messages.db)
+        messagesets = MessageSet.objects.filter(pk__in=ids)
+        messagesets.update(next_set=None)
+        messagesets._raw_delete(messagesets.db)
+    return len(ids), len(message_ids), missing
+
+
+def _file_size(storage, name):
+    try:
+        return storage.size(name)
+    except (OSError, NotImplementedError):
+        return 0
+
+
+def _linked_from_bundles(rows, chunk_size=100):
+    # Bundles link binary content by URL, which ends with the file name
+    # wherever the file is served from. Stale bundles count too, until a
+    # rebuild drops the link.
+    urls = dict(('/%s"' % filepath_to_uri(name), pk) for pk, name in rows
+                if name)
+    linked = set()
+    pending = iter(urls)
+    while True:
+        chunk = list(islice(pending, chunk_size))
+        if not chunk:
+            return linked
+        bundles = MessageSetBundle.objects.filter(reduce(
+            operator.or_, (Q(content__contains=url) for url in chunk)))
+        for content in bundles.values_list('content', flat=True).iterator():
+            linked.update(urls[url] for url in chunk if url in content)
+
+
+def collect_binary_content(older_than, batch_size=1000, dry_run=False,
+                           progress=None):
+    """
+        Deletes ``BinaryContent`` created before ``older_than`` that no
+        message, published version or bundle uses, and its stored file, a
+        batch at a time. Recent rows are kept since uploads come before the
+        messages that use them. Returns the number of rows deleted and the
+        bytes freed.
+    """
+    storage = BinaryContent._meta.get_field('content').storage
+    unused = BinaryContent.objects.filter(
+        created_at__lt=older_than, message__isnull=True,
+        versions__isnull=True).order_by('pk')
+    count = freed = 0
+    last = 0
+    while True:
+        candidates = list(unused.filter(pk__gt=last).values_list(
+            'pk', flat=True)[:batch_size])
+        if not candidates:
+            break
+        last = candidates[-1]
+        with transaction.atomic():
+            # Lock the rows before checking whether they're used. Once
+            # locked, no message can start using them, so any still unused
+            # after the lock can go.
+            locked = list(BinaryContent.objects.select_for_update().filter(
+                pk__in=candidates).values_list('pk', 'content'))
+            used = set(Message.objects.filter(
+                binary_content_id__in=candidates).values_list(
+                'binary_content_id', flat=True))
+            links = MessageSetVersion.binary_contents.through.objects
+            used.update(links.filter(
+                binarycontent_id__in=candidates).values_list(
+                'binarycontent_id', flat=True))
+            used.update(_linked_from_bundles(locked))
+            batch = [(pk, name) for pk, name in locked if pk not in used]
+            ids = [pk for pk, name in batch]
+            if not dry_run and ids:
+                Change.objects.record(BinaryContent, ids, Change.DELETED)
+                deleted = BinaryContent.objects.filter(pk__in=ids)
+                deleted._raw_delete(deleted.db)
+        names = set(name for pk, name in batch if name)
+        # Files are removed after the rows that point at them are gone, and
+        # kept if some other row still refers to them.
+        names -= set(BinaryContent.objects.filter(
+            content__in=names).exclude(pk__in=ids).values_list(
+            'content', flat=True))
+        for name in names:
+            freed += _file_size(storage, name)
+            if not dry_run:
+                storage.delete(name)
+        count += len(batch)
+        if progress is not None:
+            progress(count, freed)
+    return count, freed
@@ -0,0 +1,163 @@
+"""
+Response compression for the contentstore API.
+
+``CompressionMiddleware`` compresses JSON and text responses of at least
+``CONTENTSTORE_COMPRESS_MIN_LENGTH`` bytes (1024 by default) with the best
+encoding the client accepts: Brotli when the optional ``brotli`` package is
+installed, otherwise gzip. Message text repeats a lot within and across
+languages, so large message set responses usually shrink several times
+over. Add it first in ``MIDDLEWARE_CLASSES`` so it sees the final response::
+
+    MIDDLEWARE_CLASSES = (
+        'contentstore.compression.CompressionMiddleware',
+        ...
+    )
+
+When ``CONTENTSTORE_COMPRESS_CACHE_SECONDS`` is set, compressed bodies are
+kept in the cache keyed by a hash of the uncompressed body, so repeated
+responses such as bundles and published versions are only compressed once,
+at a higher level.
+"""
+import hashlib
+import zlib
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+DEFAULT_MIN_LENGTH = 1024
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+# Levels for bodies compressed per response, and for cached bodies which
+# are compressed once and served many times.
+LEVELS = {'br': 5, 'gzip': 6}
+CACHED_LEVELS = {'br': 9, 'gzip': 9}
+
+
+def _gzip(data, level):
+    # zlib's gzip container leaves out the timestamp, so equal bodies
+    # compress to equal bytes.
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _brotli(data, level):
+    return brotli.compress(data, mode=brotli.MODE_TEXT, quality=level)
+
+
+def available_encodings():
+    """
+        The encodings this server can produce, most preferred first.
+    """
+    if brotli is not None:
+        return ('br', 'gzip')
+    return ('gzip',)
+
+
+def compress(data, encoding, level=None):
+    if level is None:
+        level = LEVELS[encoding]
+    if encoding == 'br':
+        return _brotli(data, level)
+    return _gzip(data, level)
+
+
+def parse_accept_encoding(header):
+    """
+        Maps each coding in an ``Accept-Encoding`` header to its quality.
+    """
+    accepted = {}
+    for item in header.split(','):
+        parts = item.strip().split(';')
+        coding = parts[0].strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in parts[1:]:
+            name, _, value = param.strip().partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def choose_encoding(header, encodings=None):
+    """
+        The preferred encoding of ``encodings`` that the client accepts,
+        or ``None`` if it only accepts the uncompressed body.
+    """
+    if encodings is None:
+        encodings = available_encodings()
+    accepted = parse_accept_encoding(header or '')
+    best, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compressible(response):
+    if response.streaming or response.status_code != 200:
+        return False
+    if response.has_header('Content-Encoding'):
+        return False
+    content_type = response.get('Content-Type', '')
+    if not content_type.startswith(COMPRESSIBLE_TYPES):
+        return False
+    min_length = getattr(settings, 'CONTENTSTORE_COMPRESS_MIN_LENGTH',
+                         DEFAULT_MIN_LENGTH)
+    return len(response.content) >= min_length
+
+
+class CompressionMiddleware(object):
+
+    """
+    Compresses responses for clients that send a matching
+    ``Accept-Encoding``.
+    """
+
+    cache = default_cache
+    cache_format = 'contentstore:compressed:%s:%s'
+
+    def process_response(self, request, response):
+        if not _compressible(response):
+            return response
+        patch_vary_headers(response, ('Accept-Encoding',))
+        encoding = choose_encoding(request.META.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            return response
+        body = self.compress(response.content, encoding)
+        if len(body) >= len(response.content):
+            return response
+        response.content = body
+        response['Content-Length'] = str(len(body))
+        response['Content-Encoding'] = encoding
+        etag = response.get('ETag')
+        if etag and not etag.startswith('W/'):
+            # The compressed body is a different representation, so it can
+            # only match the uncompressed one weakly.
+            response['ETag'] = 'W/' + etag
+        return response
+
+    def compress(self, content, encoding):
+        timeout = getattr(settings, 'CONTENTSTORE_COMPRESS_CACHE_SECONDS',
+                          None)
+        if not timeout:
+            return compress(content, encoding)
+        key = self.cache_format % (
+            encoding, hashlib.sha1(content).hexdigest())
+        body = self.cache.get(key)
+        if body is None:
+            body = compress(content, encoding, CACHED_LEVELS[encoding])
+            self.cache.set(key, body, timeout)
+        return body
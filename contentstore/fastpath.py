@@ -0,0 +1,156 @@
+"""
+Fast read path that builds response dicts straight from ``.values()`` rows
+instead of instantiating model objects and running every DRF field.
+
+A ``ValuesPlan`` is derived from a bound serializer, so it honours sparse
+fieldsets and produces the same output as the serializer would. Serializers
+using field types the plan doesn't understand raise ``UnsupportedSerializer``
+and callers fall back to the regular serializer.
+"""
+from collections import defaultdict
+
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import PrimaryKeyRelatedField
+
+from . import signing
+
+
+PLAIN_FIELDS = (serializers.CharField, serializers.IntegerField,
+                serializers.BooleanField, serializers.FloatField,
+                serializers.ReadOnlyField, PrimaryKeyRelatedField)
+
+
+class UnsupportedSerializer(Exception):
+
+    """
+    Raised when a serializer can't be rendered from ``.values()`` rows.
+    """
+
+
+def format_datetime(value):
+    """
+        Matches ``DateTimeField.to_representation`` for ISO 8601 output.
+    """
+    value = value.isoformat()
+    if value.endswith('+00:00'):
+        value = value[:-6] + 'Z'
+    return value
+
+
+def file_url(storage, name, request=None, sign=True):
+    """
+        Matches ``FileField.to_representation`` with ``use_url`` enabled,
+        signing the URL when ``sign`` is set and signed URLs are enabled.
+    """
+    if not name:
+        return None
+    if sign and signing.get_lifetime():
+        url = signing.signed_url(name)
+    else:
+        url = storage.url(name)
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def _converter(field, model_field, request):
+    if isinstance(field, serializers.DateTimeField):
+        if field.format is None:
+            return None
+        if field.format.lower() == ISO_8601:
+            return format_datetime
+        return lambda value: value.strftime(field.format)
+    if isinstance(field, serializers.FileField):
+        if not field.use_url:
+            return None
+        storage = model_field.storage
+        return lambda name: file_url(storage, name, request)
+    if isinstance(field, PLAIN_FIELDS):
+        return None
+    raise UnsupportedSerializer(
+        "Can't render %s from values." % (type(field).__name__,))
+
+
+class ValuesPlan(object):
+
+    """
+    The ``.values()`` lookups and per-field conversions needed to render
+    ``serializer`` for rows of ``model``.
+    """
+
+    def __init__(self, serializer, model, prefix=''):
+        self.model = model
+        self.pk = prefix + model._meta.pk.name
+        self.lookups = [self.pk]
+        self.fields = []
+        self.nested = []
+        self.lists = []
+        request = serializer.context.get('request', None)
+        for field in serializer.fields.values():
+            if field.write_only:
+                continue
+            if field.source == '*' or '.' in field.source:
+                raise UnsupportedSerializer(
+                    "Can't render source %r from values." % (field.source,))
+            lookup = prefix + field.source
+            if isinstance(field, serializers.ListSerializer):
+                if prefix:
+                    raise UnsupportedSerializer(
+                        "Can't render lists nested in related objects.")
+                rel = model._meta.get_field(field.source)
+                self.lists.append((field.field_name, rel.field.name,
+                                   ValuesPlan(field.child, rel.related_model)))
+            elif isinstance(field, serializers.BaseSerializer):
+                rel_model = model._meta.get_field(field.source).rel.to
+                plan = ValuesPlan(field, rel_model, prefix=lookup + '__')
+                self._add_lookup(lookup)
+                self.lookups.extend(plan.lookups)
+                self.nested.append((field.field_name, lookup, plan))
+            else:
+                model_field = model._meta.get_field(field.source)
+                self._add_lookup(lookup)
+                self.fields.append((field.field_name, lookup,
+                                    _converter(field, model_field, request)))
+
+    def _add_lookup(self, lookup):
+        if lookup not in self.lookups:
+            self.lookups.append(lookup)
+
+    def build(self, row):
+        data = {}
+        for key, lookup, convert in self.fields:
+            value = row[lookup]
+            if value is not None and convert is not None:
+                value = convert(value)
+            data[key] = value
+        for key, lookup, plan in self.nested:
+            data[key] = None if row[lookup] is None else plan.build(row)
+        return data
+
+    def rows(self, queryset, extra=()):
+        """
+            Returns ``(row, data)`` pairs for ``queryset``. Lookups in
+            ``extra`` are fetched into ``row`` without being rendered.
+        """
+        lookups = self.lookups + [l for l in extra if l not in self.lookups]
+        rows = list(queryset.prefetch_related(None).values(*lookups))
+        results = [self.build(row) for row in rows]
+        for key, fk, plan in self.lists:
+            grouped = defaultdict(list)
+            children = plan.model._default_manager.filter(
+                **{'%s__in' % fk: [row[self.pk] for row in rows]})
+            for child_row, child in plan.rows(children, extra=[fk]):
+                grouped[child_row[fk]].append(child)
+            for row, data in zip(rows, results):
+                data[key] = grouped[row[self.pk]]
+        return list(zip(rows, results))
+
+    def serialize(self, queryset):
+        return [data for row, data in self.rows(queryset)]
+
+
+def serialize_values(queryset, serializer):
+    """
+        Renders ``queryset`` the way ``serializer`` would, from values rows.
+    """
+    return ValuesPlan(serializer, queryset.model).serialize(queryset)
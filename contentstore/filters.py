@@ -0,0 +1,20 @@
+import django_filters
+
+from .models import Message
+
+
+class MessageFilter(django_filters.FilterSet):
+
+    """
+    Filters for the message list, including segment ranges such as
+    ``?min_segments=2`` for every message that needs more than one SMS.
+    """
+    min_segments = django_filters.NumberFilter(
+        name='segments', lookup_type='gte')
+    max_segments = django_filters.NumberFilter(
+        name='segments', lookup_type='lte')
+
+    class Meta:
+        model = Message
+        fields = ('messageset', 'sequence_number', 'lang', 'encoding',
+                  'segments', 'min_segments', 'max_segments')
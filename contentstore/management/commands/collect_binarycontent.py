@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from contentstore.bulk import collect_binary_content
+
+
+class Command(BaseCommand):
+
+    help = ("Delete binary content that no message, published version or "
+            "bundle uses, along with its stored files, and report the space "
+            "freed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=float, default=24,
+                            help=('Only collect content uploaded more than '
+                                  'this many hours ago.'))
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows checked and deleted per batch.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report what would be deleted.')
+
+    def handle(self, *args, **options):
+        verb = 'found' if options['dry_run'] else 'deleted'
+
+        def progress(count, freed):
+            self.stderr.write('%s unused binary contents %s, %s bytes' % (
+                count, verb, freed))
+
+        count, freed = collect_binary_content(
+            timezone.now() - timedelta(hours=options['older_than']),
+            batch_size=options['batch_size'], dry_run=options['dry_run'],
+            progress=progress)
+        self.stdout.write('%s unused binary contents %s, %s bytes %s.' % (
+            count, verb, freed,
+            'reclaimable' if options['dry_run'] else 'freed'))
@@ -0,0 +1,43 @@
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+
+from contentstore.bulk import COLUMNS, FORMATS, export_rows, write_rows
+
+
+class Command(BaseCommand):
+
+    help = ("Stream schedules, message sets or messages out of the content "
+            "store as CSV or NDJSON, in a form import_content accepts.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=list(COLUMNS.keys()))
+        parser.add_argument('path', nargs='?', default='-',
+                            help='File to write, or - for stdout.')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='Defaults to the file extension, or csv.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format']
+        if format is None:
+            format = path.rsplit('.', 1)[-1].lower()
+            if format not in FORMATS:
+                format = 'csv'
+        if format not in FORMATS:
+            raise CommandError('Unknown format %r.' % format)
+
+        if path == '-':
+            stream = self.stdout
+        elif six.PY2:
+            stream = open(path, 'wb')
+        else:
+            stream = io.open(path, 'w', encoding='utf-8', newline='')
+        try:
+            fields, rows = export_rows(options['model'])
+            count = write_rows(stream, format, fields, rows)
+        finally:
+            if path != '-':
+                stream.close()
+        self.stderr.write('%s %s rows exported.' % (count, options['model']))
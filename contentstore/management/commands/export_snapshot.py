@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import tempfile
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from contentstore.fastpath import format_datetime
+from contentstore.models import (Schedule, MessageSet, Message, BinaryContent,
+                                 Change)
+
+SNAPSHOT_FORMAT = 1
+
+SCHEMA = """
+CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE schedule (
+    id INTEGER PRIMARY KEY, minute TEXT, hour TEXT, day_of_week TEXT,
+    day_of_month TEXT, month_of_year TEXT);
+CREATE TABLE messageset (
+    id INTEGER PRIMARY KEY, short_name TEXT, notes TEXT, next_set INTEGER,
+    default_schedule INTEGER, created_at TEXT, updated_at TEXT);
+CREATE TABLE binarycontent (
+    id INTEGER PRIMARY KEY, content TEXT, checksum TEXT);
+CREATE TABLE message (
+    id INTEGER PRIMARY KEY, messageset INTEGER, sequence_number INTEGER,
+    lang TEXT, text_content TEXT, binary_content INTEGER, encoding TEXT,
+    segments INTEGER, created_at TEXT, updated_at TEXT);
+"""
+
+INDEXES = """
+CREATE INDEX message_track ON message (messageset, lang, sequence_number);
+"""
+
+
+def _datetimes(row, *positions):
+    row = list(row)
+    for position in positions:
+        if row[position] is not None:
+            row[position] = format_datetime(row[position])
+    return row
+
+
+class Command(BaseCommand):
+
+    help = ("Export the whole content store to a read-optimised SQLite "
+            "snapshot for messaging_contentstore.ContentStoreSnapshot.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Where to write the snapshot.')
+        parser.add_argument(
+            '--chunk-size', type=int, default=1000,
+            help='Rows written per batch (default: 1000).')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        self.chunk_size = options['chunk_size']
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(path)), suffix='.tmp')
+        os.close(fd)
+        try:
+            db = sqlite3.connect(tmp_path)
+            db.executescript(SCHEMA)
+            # Record the settled change feed position first, so a mirror
+            # synced from it afterwards can't miss anything written during
+            # the export, or still in flight before it. Replaying changes the
+            # snapshot already has is harmless.
+            cursor = Change.objects.settled_cursor()
+            self.write_meta(db, cursor)
+            counts = self.write_content(db)
+            db.executescript(INDEXES)
+            db.commit()
+            db.execute('VACUUM')
+            db.close()
+            os.rename(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.stdout.write('Exported %s to %s' % (', '.join(
+            '%s %s' % (count, table) for table, count in counts), path))
+
+    def write_meta(self, db, cursor):
+        db.executemany('INSERT INTO meta VALUES (?, ?)', [
+            ('format', str(SNAPSHOT_FORMAT)),
+            ('created_at', format_datetime(timezone.now())),
+            ('cursor', str(cursor or 0)),
+        ])
+
+    def write_rows(self, db, table, rows):
+        count = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.chunk_size:
+                count += self.insert(db, table, batch)
+                batch = []
+        if batch:
+            count += self.insert(db, table, batch)
+        return (table, count)
+
+    def insert(self, db, table, batch):
+        db.executemany('INSERT INTO %s VALUES (%s)' % (
+            table, ', '.join('?' * len(batch[0]))), batch)
+        return len(batch)
+
+    def write_content(self, db):
+        storage = BinaryContent._meta.get_field('content').storage
+        return [
+            self.write_rows(db, 'schedule', (
+                row for row in Schedule.objects.order_by('id').values_list(
+                    'id', 'minute', 'hour', 'day_of_week', 'day_of_month',
+                    'month_of_year').iterator())),
+            self.write_rows(db, 'messageset', (
+                _datetimes(row, 5, 6)
+                for row in MessageSet.objects.order_by('id').values_list(
+                    'id', 'short_name', 'notes', 'next_set',
+                    'default_schedule', 'created_at',
+                    'updated_at').iterator())),
+            # Snapshots outlive signed URLs, so they get plain storage URLs.
+            self.write_rows(db, 'binarycontent', (
+                (pk, storage.url(name) if name else None, checksum)
+                for pk, name, checksum in BinaryContent.objects.order_by(
+                    'id').values_list(
+                    'id', 'content', 'checksum').iterator())),
+            self.write_rows(db, 'message', (
+                _datetimes(row, 8, 9)
+                for row in Message.objects.order_by(
+                    'messageset', 'lang', 'sequence_number').values_list(
+                    'id', 'messageset', 'sequence_number', 'lang',
+                    'text_content', 'binary_content', 'encoding', 'segments',
+                    'created_at', 'updated_at').iterator())),
+        ]
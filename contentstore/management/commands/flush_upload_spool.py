@@ -0,0 +1,34 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from contentstore.models import BinaryContent
+from contentstore.storage import SpooledStorage, flush_spool
+
+
+class Command(BaseCommand):
+
+    help = ("Move uploaded binary content from the local spool to the final "
+            "storage backend.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=float, default=5,
+                            help=('Only move files written more than this '
+                                  'many seconds ago.'))
+        parser.add_argument('--interval', type=float, default=None,
+                            help=('Keep running, checking the spool every '
+                                  'this many seconds.'))
+
+    def handle(self, *args, **options):
+        storage = BinaryContent._meta.get_field('content').storage
+        if not isinstance(storage, SpooledStorage):
+            raise CommandError(
+                'Binary content is not stored with a SpooledStorage.')
+        while True:
+            count, moved = flush_spool(storage, min_age=options['min_age'])
+            if count or options['interval'] is None:
+                self.stdout.write('%s spooled files moved, %s bytes.' % (
+                    count, moved))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,65 @@
+import io
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import six
+
+from contentstore.bulk import COLUMNS, FORMATS, Importer, read_rows
+
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+
+    help = ("Stream schedules, message sets or messages into the content "
+            "store from a CSV or NDJSON file.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('model', choices=list(COLUMNS.keys()))
+        parser.add_argument('path', help='File to import, or - for stdin.')
+        parser.add_argument('--format', choices=FORMATS, default=None,
+                            help='Defaults to the file extension.')
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Rows validated and inserted per batch.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only validate the file.')
+        parser.add_argument('--keep-ids', action='store_true',
+                            help='Create objects with the ids in the file.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if format not in FORMATS:
+            raise CommandError('Unknown format %r, use --format.' % format)
+
+        if path == '-':
+            stream = sys.stdin
+        elif six.PY2 or format == 'ndjson':
+            stream = open(path, 'rb')
+        else:
+            stream = io.open(path, 'r', encoding='utf-8', newline='')
+
+        def progress(count, errors):
+            self.stderr.write('%s rows %s, %s errors' % (
+                count, 'validated' if options['dry_run'] else 'imported',
+                errors))
+
+        importer = Importer(options['model'], keep_ids=options['keep_ids'])
+        try:
+            count, errors = importer.run(
+                read_rows(stream, format), chunk_size=options['chunk_size'],
+                dry_run=options['dry_run'], progress=progress)
+        except ValueError as err:
+            raise CommandError('Could not read %s: %s' % (path, err))
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        for error in errors[:MAX_REPORTED_ERRORS]:
+            self.stderr.write(str(error))
+        if importer.error_count:
+            raise CommandError('%s invalid rows, nothing imported.' % (
+                importer.error_count,))
+        self.stdout.write('%s %s rows %s.' % (
+            count, options['model'],
+            'valid' if options['dry_run'] else 'imported'))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from contentstore.models import MessageSetBundle
+
+
+class Command(BaseCommand):
+
+    help = "Recompile message set bundles whose tracks have changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=float, default=5,
+                            help=('Only rebuild bundles marked stale more '
+                                  'than this many seconds ago.'))
+        parser.add_argument('--interval', type=float, default=None,
+                            help=('Keep running, checking for stale bundles '
+                                  'every this many seconds.'))
+
+    def handle(self, *args, **options):
+        while True:
+            count = MessageSetBundle.objects.rebuild_stale(
+                min_age=options['min_age'])
+            if count or options['interval'] is None:
+                self.stdout.write('%s bundles rebuilt.' % (count,))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentstore', '0004_auto_20150520_1238'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSetBundle',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('lang', models.CharField(max_length=6)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('content', models.TextField()),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('messageset', models.ForeignKey(related_name='bundles', to='contentstore.MessageSet')),
+            ],
+            options={
+                'ordering': ['lang'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='messagesetbundle',
+            unique_together=set([('messageset', 'lang')]),
+        ),
+    ]
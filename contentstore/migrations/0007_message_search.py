@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from contentstore.search import install_index, uninstall_index
+
+
+def create_search_index(apps, schema_editor):
+    install_index(schema_editor.connection)
+
+
+def drop_search_index(apps, schema_editor):
+    uninstall_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentstore', '0006_change'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
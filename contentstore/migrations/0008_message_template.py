@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from contentstore.search import install_index
+from contentstore.templating import compile_template, TemplateError
+
+
+def compile_messages(apps, schema_editor):
+    Message = apps.get_model('contentstore', 'Message')
+    messages = Message.objects.exclude(text_content=None).exclude(
+        text_content='')
+    for pk, text in messages.values_list('id', 'text_content').iterator():
+        try:
+            compiled, names = compile_template(text)
+        except TemplateError:
+            # Left uncompiled until the text is fixed.
+            continue
+        Message.objects.filter(pk=pk).update(
+            compiled_text=compiled, placeholders=','.join(names))
+
+
+def reinstall_search_index(apps, schema_editor):
+    # Adding columns rebuilds the table on SQLite, dropping its triggers.
+    install_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentstore', '0007_message_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='compiled_text',
+            field=models.TextField(null=True, editable=False),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='placeholders',
+            field=models.TextField(default=b'', editable=False, blank=True),
+        ),
+        migrations.RunPython(reinstall_search_index,
+                             migrations.RunPython.noop),
+        migrations.RunPython(compile_messages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from contentstore.search import install_index
+from contentstore.sms import count_segments
+from contentstore.templating import PLACEHOLDER
+
+
+def count_message_segments(apps, schema_editor):
+    Message = apps.get_model('contentstore', 'Message')
+    messages = Message.objects.exclude(text_content=None).exclude(
+        text_content='')
+    for pk, text in messages.values_list('id', 'text_content').iterator():
+        encoding, segments = count_segments(PLACEHOLDER.sub('', text))
+        Message.objects.filter(pk=pk).update(
+            encoding=encoding, segments=segments)
+
+
+def reinstall_search_index(apps, schema_editor):
+    # Adding columns rebuilds the table on SQLite, dropping its triggers.
+    install_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentstore', '0008_message_template'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='encoding',
+            field=models.CharField(default=b'', max_length=4, editable=False,
+                                   blank=True, choices=[(b'gsm7', b'GSM-7'),
+                                                        (b'ucs2', b'UCS-2')]),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='segments',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(reinstall_search_index,
+                             migrations.RunPython.noop),
+        migrations.RunPython(count_message_segments,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentstore', '0009_message_segments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MessageSetVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('number', models.PositiveIntegerField()),
+                ('content', models.TextField()),
+                ('published_at', models.DateTimeField(auto_now_add=True)),
+                ('messageset', models.ForeignKey(related_name='versions', to='contentstore.MessageSet')),
+            ],
+            options={
+                'ordering': ['number'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='messagesetversion',
+            unique_together=set([('messageset', 'number')]),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from contentstore.models import file_checksum
+
+
+def checksum_binary_content(apps, schema_editor):
+    BinaryContent = apps.get_model('contentstore', 'BinaryContent')
+    storage = BinaryContent._meta.get_field('content').storage
+    names = BinaryContent.objects.exclude(content='').values_list(
+        'id', 'content')
+    for pk, name in names.iterator():
+        try:
+            with storage.open(name) as content:
+                checksum = file_checksum(content)
+        except (IOError, OSError):
+            # Missing files are left without a checksum.
+            continue
+        BinaryContent.objects.filter(pk=pk).update(checksum=checksum)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentstore', '0010_messagesetversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='binarycontent',
+            name='checksum',
+            field=models.CharField(default=b'', max_length=64, editable=False,
+                                   db_index=True, blank=True),
+        ),
+        migrations.RunPython(checksum_binary_content,
+                             migrations.RunPython.noop),
+    ]
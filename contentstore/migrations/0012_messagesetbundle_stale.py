@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+def add_missing_bundles(apps, schema_editor):
+    # Reads no longer build missing bundles, so every track needs one for
+    # the rebuild_bundles worker to compile.
+    Message = apps.get_model('contentstore', 'Message')
+    MessageSetBundle = apps.get_model('contentstore', 'MessageSetBundle')
+    existing = set(MessageSetBundle.objects.values_list(
+        'messageset_id', 'lang'))
+    tracks = Message.objects.values_list('messageset_id', 'lang').distinct()
+    MessageSetBundle.objects.bulk_create([
+        MessageSetBundle(messageset_id=messageset_id, lang=lang,
+                         content='[]', stale=True)
+        for messageset_id, lang in tracks
+        if lang and (messageset_id, lang) not in existing])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentstore', '0011_binarycontent_checksum'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagesetbundle',
+            name='stale',
+            field=models.BooleanField(default=False, db_index=True),
+        ),
+        migrations.RunPython(add_missing_bundles,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+
+from django.db import models, migrations
+
+
+def record_version_binary_contents(apps, schema_editor):
+    # Versions published before this link binary content only by URL.
+    BinaryContent = apps.get_model('contentstore', 'BinaryContent')
+    MessageSetVersion = apps.get_model('contentstore', 'MessageSetVersion')
+    Link = MessageSetVersion.binary_contents.through
+    storage = BinaryContent._meta.get_field('content').storage
+    ids = dict((storage.url(name), pk) for pk, name in
+               BinaryContent.objects.values_list('pk', 'content') if name)
+    for pk, content in MessageSetVersion.objects.values_list(
+            'pk', 'content').iterator():
+        urls = set(message['binary_content']
+                   for messages in json.loads(content).values()
+                   for message in messages if message['binary_content'])
+        Link.objects.bulk_create([
+            Link(messagesetversion_id=pk, binarycontent_id=ids[url])
+            for url in urls if url in ids])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contentstore', '0013_change_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='messagesetversion',
+            name='binary_contents',
+            field=models.ManyToManyField(related_name='versions', to='contentstore.BinaryContent', blank=True),
+        ),
+        migrations.RunPython(record_version_binary_contents,
+                             migrations.RunPython.noop),
+    ]
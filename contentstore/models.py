@@ -1,8 +1,17 @@
+import hashlib
+import json
 import os.path
-from django.db import models
+from collections import OrderedDict
+from django.conf import settings
+from django.db import models, router, transaction
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
 from rest_framework.serializers import ValidationError
+from .sms import count_segments, ENCODING_CHOICES
+from .templating import compile_template, PLACEHOLDER, TemplateError
 from django.utils.translation import ugettext_lazy as _
-from datetime import datetime
+from datetime import datetime, timedelta
 
 
 class Schedule(models.Model):
@@ -59,6 +68,16 @@ class MessageSet(models.Model):
         return u"%s" % self.short_name
 
 
+def file_checksum(content):
+    """
+        The SHA-256 hex digest of a file, read in chunks.
+    """
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
 def generate_new_filename(instance, filename):
     ext = os.path.splitext(filename)[-1]  # get file extension
     return "%s%s" % (datetime.now().strftime("%Y%m%d%H%M%S%f"), ext)
@@ -72,9 +91,21 @@ class BinaryContent(models.Model):
 
     content = models.FileField(upload_to=generate_new_filename,
                                max_length=100)
+    # SHA-256 of the file, so clients can skip uploading files already held
+    checksum = models.CharField(max_length=64, blank=True, default='',
+                                db_index=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        if self.content and not self.content._committed:
+            # A new upload, which is hashed before it's stored.
+            self.checksum = file_checksum(self.content)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = list(update_fields) + ['checksum']
+        super(BinaryContent, self).save(*args, **kwargs)
+
     def __unicode__(self):
         return u"%s" % (self.content.path.split('/')[-1])
 
@@ -93,6 +124,13 @@ class Message(models.Model):
     binary_content = models.ForeignKey(BinaryContent,
                                        related_name='message',
                                        null=True)
+    # text_content compiled for rendering, see contentstore.templating
+    compiled_text = models.TextField(null=True, editable=False)
+    placeholders = models.TextField(blank=True, default='', editable=False)
+    # SMS encoding and segment count of text_content, see contentstore.sms
+    encoding = models.CharField(max_length=4, blank=True, default='',
+                                choices=ENCODING_CHOICES, editable=False)
+    segments = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -101,14 +139,424 @@ class Message(models.Model):
 
     def clean(self):
         # Don't allow messages to have neither a text or binary content
-        if any([self.text_content, self.binary_content]) is False:
+        if any([self.text_content, self.binary_content_id]) is False:
             raise ValidationError(
                 _('Messages must have text or file attached'))
+        self.compile_text()
+        self.count_segments()
+
+    def compile_text(self):
+        if not self.text_content:
+            self.compiled_text, self.placeholders = None, ''
+            return
+        try:
+            compiled, names = compile_template(self.text_content)
+        except TemplateError as err:
+            raise ValidationError({'text_content': [str(err)]})
+        self.compiled_text, self.placeholders = compiled, ','.join(names)
+
+    def count_segments(self):
+        if not self.text_content:
+            self.encoding, self.segments = '', 0
+            return
+        # Placeholders are filled in per recipient, so only count the
+        # text around them.
+        self.encoding, self.segments = count_segments(
+            PLACEHOLDER.sub('', self.text_content))
 
     def save(self, *args, **kwargs):
         self.clean()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'text_content' in update_fields:
+            # clean() recomputed these from the new text.
+            kwargs['update_fields'] = list(update_fields) + [
+                'compiled_text', 'placeholders', 'encoding', 'segments']
         super(Message, self).save(*args, **kwargs)
 
     def __unicode__(self):
         return _("Message %s in %s from %s") % (
             self.sequence_number, self.lang, self.messageset.short_name)
+
+
+class MessageSetBundleManager(models.Manager):
+
+    def build_messages(self, messageset_id, lang, using=None):
+        """
+            The ordered messages of one language track, with binary content
+            resolved to its URL.
+        """
+        storage = BinaryContent._meta.get_field('content').storage
+        rows = Message.objects.db_manager(using).filter(
+            messageset_id=messageset_id, lang=lang).order_by(
+            'sequence_number', 'id').values_list(
+            'id', 'sequence_number', 'text_content', 'binary_content__content')
+        return [{
+            'id': pk,
+            'sequence_number': sequence_number,
+            'text_content': text_content,
+            'binary_content': storage.url(name) if name else None,
+        } for pk, sequence_number, text_content, name in rows]
+
+    def mark_stale(self, messageset_id, lang, create=True):
+        """
+            Flags the bundle for one language track as out of date and bumps
+            its version, without recompiling it. This is a single ``UPDATE``
+            however long the track is, so editing a track a message at a time
+            stays linear. Reads build stale bundles from the messages until
+            :meth:`rebuild_stale` catches up. A missing bundle is created,
+            unless ``create`` is false because the track lost messages.
+        """
+        if messageset_id is None or not lang:
+            return
+        bundles = self.filter(messageset_id=messageset_id, lang=lang)
+        changes = {'stale': True, 'version': models.F('version') + 1,
+                   'updated_at': timezone.now()}
+        if not bundles.update(**changes) and create:
+            bundle, created = self.get_or_create(
+                messageset_id=messageset_id, lang=lang,
+                defaults={'stale': True, 'content': '[]'})
+            if not created:
+                bundles.update(**changes)
+
+    def rebuild_stale(self, min_age=0):
+        """
+            Recompiles bundles marked stale at least ``min_age`` seconds ago,
+            so a burst of edits to a track is compiled once. Returns how many
+            were rebuilt.
+        """
+        cutoff = timezone.now() - timedelta(seconds=min_age)
+        tracks = self.filter(stale=True, updated_at__lte=cutoff).values_list(
+            'messageset_id', 'lang')
+        count = 0
+        for messageset_id, lang in tracks.iterator():
+            self.rebuild(messageset_id, lang)
+            count += 1
+        return count
+
+    def rebuild(self, messageset_id, lang):
+        """
+            Recompiles the bundle for one language track. A stale bundle
+            keeps the version it was given when marked, since every write
+            to the track marks it again, others are bumped only if the
+            content changed. Returns ``None`` and drops the bundle once the
+            track has no messages left.
+
+            The bundle row is locked before the track is read, so writes to
+            the track wait for the rebuild. The bundle is only saved if its
+            version is still the one seen before reading, and is otherwise
+            left stale for the next rebuild.
+        """
+        with transaction.atomic():
+            bundle = self.select_for_update().filter(
+                messageset_id=messageset_id, lang=lang).first()
+            # Read the track from the database being written to, not a
+            # replica.
+            messages = self.build_messages(messageset_id, lang,
+                                           using=router.db_for_write(Message))
+            content = json.dumps(messages, separators=(',', ':'))
+            if not messages:
+                if bundle is not None:
+                    bundle.delete()
+                return None
+            if bundle is None:
+                return self.create(messageset_id=messageset_id, lang=lang,
+                                   version=1, content=content)
+            if bundle.stale or bundle.content != content:
+                version = bundle.version + (0 if bundle.stale else 1)
+                updated_at = timezone.now()
+                if self.filter(pk=bundle.pk, version=bundle.version).update(
+                        content=content, stale=False, version=version,
+                        updated_at=updated_at):
+                    bundle.content = content
+                    bundle.stale = False
+                    bundle.version = version
+                    bundle.updated_at = updated_at
+                else:
+                    bundle = self.get(pk=bundle.pk)
+            return bundle
+
+
+class MessageSetBundle(models.Model):
+
+    """
+        Precompiled copy of one language track of a message set, versioned so
+        clients can cheaply check whether their copy is current.
+    """
+    messageset = models.ForeignKey(MessageSet, related_name='bundles')
+    lang = models.CharField(max_length=6)
+    version = models.PositiveIntegerField(default=1)
+    content = models.TextField()
+    # Set when the track changed after ``content`` was compiled.
+    stale = models.BooleanField(default=False, db_index=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = MessageSetBundleManager()
+
+    class Meta:
+        unique_together = ('messageset', 'lang')
+        ordering = ['lang']
+
+    @property
+    def etag(self):
+        return '"%s-%s-%s"' % (self.messageset_id, self.lang, self.version)
+
+    def get_content(self):
+        """
+            The track's messages as JSON, compiled from the messages without
+            saving if the bundle is stale. ``None`` if the track has no
+            messages left.
+        """
+        if not self.stale:
+            return self.content
+        messages = MessageSetBundle.objects.build_messages(
+            self.messageset_id, self.lang, using=self._state.db)
+        if not messages:
+            return None
+        return json.dumps(messages, separators=(',', ':'))
+
+    def render(self):
+        """
+            The bundle as a JSON document, without decoding the stored
+            messages. ``None`` if the track has no messages left.
+        """
+        content = self.get_content()
+        if content is None:
+            return None
+        return '{"messageset":%s,"lang":%s,"version":%s,"messages":%s}' % (
+            self.messageset_id, json.dumps(self.lang), self.version, content)
+
+    def __unicode__(self):
+        return u"%s %s v%s" % (self.messageset_id, self.lang, self.version)
+
+
+class MessageSetVersionManager(models.Manager):
+
+    def publish(self, messageset_id):
+        """
+            Snapshots every language track of a message set as its next
+            published version, recording the binary content it links to so
+            it isn't collected while the version is served.
+        """
+        using = router.db_for_write(MessageSetVersion)
+        with transaction.atomic(using=using):
+            # Lock the set so concurrent publishes get distinct numbers.
+            MessageSet.objects.db_manager(using).select_for_update().get(
+                pk=messageset_id)
+            langs = Message.objects.db_manager(using).filter(
+                messageset_id=messageset_id).order_by('lang').values_list(
+                'lang', flat=True).distinct()
+            tracks = OrderedDict(
+                (lang, MessageSetBundle.objects.build_messages(
+                    messageset_id, lang, using=using))
+                for lang in langs)
+            latest = self.db_manager(using).filter(
+                messageset_id=messageset_id).aggregate(
+                number=models.Max('number'))['number']
+            version = self.db_manager(using).create(
+                messageset_id=messageset_id, number=(latest or 0) + 1,
+                content=json.dumps(tracks, separators=(',', ':')))
+            version.binary_contents.add(*Message.objects.db_manager(
+                using).filter(messageset_id=messageset_id,
+                              binary_content__isnull=False).values_list(
+                'binary_content_id', flat=True).distinct())
+            return version
+
+
+class MessageSetVersion(models.Model):
+
+    """
+        Immutable snapshot of every language track of a message set, taken
+        when it's published. Senders pin to a version number so edits to
+        the live messages don't change what they send mid-run.
+    """
+    messageset = models.ForeignKey(MessageSet, related_name='versions')
+    number = models.PositiveIntegerField()
+    # Language tracks as a JSON object of message lists, keyed by lang
+    content = models.TextField()
+    # Binary content the snapshot links to, kept by collect_binarycontent
+    binary_contents = models.ManyToManyField(
+        BinaryContent, related_name='versions', blank=True)
+    published_at = models.DateTimeField(auto_now_add=True)
+
+    objects = MessageSetVersionManager()
+
+    class Meta:
+        unique_together = ('messageset', 'number')
+        ordering = ['number']
+
+    @property
+    def etag(self):
+        return '"%s-v%s"' % (self.messageset_id, self.number)
+
+    @property
+    def langs(self):
+        return list(json.loads(self.content,
+                               object_pairs_hook=OrderedDict))
+
+    def save(self, *args, **kwargs):
+        if self.pk is not None:
+            raise ValueError("Published versions can't be changed.")
+        super(MessageSetVersion, self).save(*args, **kwargs)
+
+    def render(self, lang=None):
+        """
+            The version as a JSON document with every track, or just the
+            track for ``lang`` in the same shape as a bundle. Returns
+            ``None`` if the version has no such track.
+        """
+        if lang is None:
+            return '{"messageset":%s,"version":%s,"tracks":%s}' % (
+                self.messageset_id, self.number, self.content)
+        messages = json.loads(self.content).get(lang)
+        if messages is None:
+            return None
+        return '{"messageset":%s,"version":%s,"lang":%s,"messages":%s}' % (
+            self.messageset_id, self.number, json.dumps(lang),
+            json.dumps(messages, separators=(',', ':')))
+
+    def __unicode__(self):
+        return u"%s v%s" % (self.messageset_id, self.number)
+
+
+class ChangeManager(models.Manager):
+
+    def _serializer_class(self, model):
+        from .serializers import (ScheduleSerializer, MessageSetSerializer,
+                                  MessageSerializer, BinaryContentSerializer)
+        return {
+            Schedule: ScheduleSerializer,
+            MessageSet: MessageSetSerializer,
+            Message: MessageSerializer,
+            BinaryContent: BinaryContentSerializer,
+        }[model]
+
+    def snapshot(self, instance):
+        """
+            The object as the API renders it, with plain file URLs: signed
+            ones would expire while the change is kept, so the change feed
+            signs them as it serves them.
+        """
+        serializer_class = self._serializer_class(type(instance))
+        return json.dumps(
+            serializer_class(instance, context={'sign_urls': False}).data)
+
+    def settled_cursor(self):
+        """
+            The cursor up to which the log is complete. Ids are handed out
+            when a change is written but rows only show up once their
+            transaction commits, so the newest rows can overtake an older
+            one that is still in flight. Only changes written more than
+            ``CONTENTSTORE_CHANGES_SETTLE_SECONDS`` ago, and older than
+            every newer visible change, are treated as settled. Changes
+            from transactions that take longer than that to commit can be
+            missed.
+        """
+        cutoff = timezone.now() - timedelta(seconds=getattr(
+            settings, 'CONTENTSTORE_CHANGES_SETTLE_SECONDS', 10))
+        fresh = self.filter(created_at__gt=cutoff).aggregate(
+            first=models.Min('id'))['first']
+        if fresh is not None:
+            return fresh - 1
+        return self.aggregate(last=models.Max('id'))['last'] or 0
+
+    def record(self, model, object_ids, action):
+        """
+            Appends a change for each of ``object_ids``, for paths that
+            bypass model signals. Creates and updates carry a snapshot of
+            the object as the API renders it; deletes are tombstones.
+        """
+        object_ids = list(object_ids)
+        snapshots = {}
+        if action != Change.DELETED:
+            for instance in model._default_manager.filter(pk__in=object_ids):
+                snapshots[instance.pk] = self.snapshot(instance)
+        return self.bulk_create([
+            Change(model=model._meta.model_name, object_id=object_id,
+                   action=action, data=snapshots.get(object_id))
+            for object_id in object_ids])
+
+
+class Change(models.Model):
+
+    """
+        Append-only log of changes to content. The primary key doubles as
+        the cursor clients sync from.
+    """
+    CREATED = 'created'
+    UPDATED = 'updated'
+    DELETED = 'deleted'
+    ACTION_CHOICES = (
+        (CREATED, _('Created')),
+        (UPDATED, _('Updated')),
+        (DELETED, _('Deleted')),
+    )
+
+    model = models.CharField(max_length=20)
+    object_id = models.IntegerField()
+    action = models.CharField(max_length=7, choices=ACTION_CHOICES)
+    data = models.TextField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    objects = ChangeManager()
+
+    class Meta:
+        ordering = ['id']
+
+    def __unicode__(self):
+        return u"%s %s %s" % (self.action, self.model, self.object_id)
+
+
+def record_saved_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    Change.objects.create(
+        model=sender._meta.model_name, object_id=instance.pk,
+        action=Change.CREATED if created else Change.UPDATED,
+        data=Change.objects.snapshot(instance))
+
+
+def record_deleted_change(sender, instance, **kwargs):
+    Change.objects.create(
+        model=sender._meta.model_name, object_id=instance.pk,
+        action=Change.DELETED)
+
+
+for changed_model in (Schedule, MessageSet, Message, BinaryContent):
+    post_save.connect(record_saved_change, sender=changed_model,
+                      dispatch_uid='contentstore.change.save.%s' % (
+                          changed_model._meta.model_name,))
+    post_delete.connect(record_deleted_change, sender=changed_model,
+                        dispatch_uid='contentstore.change.delete.%s' % (
+                            changed_model._meta.model_name,))
+
+
+@receiver(post_init, sender=Message)
+def remember_message_track(sender, instance, **kwargs):
+    instance._bundle_track = (instance.messageset_id, instance.lang)
+
+
+@receiver(post_save, sender=Message)
+def mark_message_bundles_stale(sender, instance, **kwargs):
+    tracks = set([instance._bundle_track,
+                  (instance.messageset_id, instance.lang)])
+    for messageset_id, lang in tracks:
+        MessageSetBundle.objects.mark_stale(
+            messageset_id, lang,
+            create=(messageset_id, lang) == (instance.messageset_id,
+                                             instance.lang))
+    instance._bundle_track = (instance.messageset_id, instance.lang)
+
+
+@receiver(post_delete, sender=Message)
+def mark_deleted_message_bundle_stale(sender, instance, **kwargs):
+    MessageSetBundle.objects.mark_stale(instance.messageset_id, instance.lang,
+                                        create=False)
+
+
+@receiver(post_save, sender=BinaryContent)
+def mark_binary_content_bundles_stale(sender, instance, created, **kwargs):
+    if created:
+        return
+    tracks = instance.message.values_list('messageset_id', 'lang').distinct()
+    for messageset_id, lang in tracks:
+        MessageSetBundle.objects.mark_stale(messageset_id, lang)
@@ -0,0 +1,21 @@
+from django.utils import six
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser
+
+from .renderers import msgpack, MSGPACK_MEDIA_TYPE
+
+
+class MessagePackParser(BaseParser):
+
+    """
+    Parses ``application/msgpack`` request bodies. Needs the optional
+    ``msgpack`` package.
+    """
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        try:
+            return msgpack.unpackb(stream.read(), raw=False)
+        except Exception as exc:
+            raise ParseError('MessagePack parse error - %s' %
+                             six.text_type(exc))
@@ -0,0 +1,69 @@
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import ujson
+except ImportError:  # pragma: no cover
+    ujson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = 'application/msgpack'
+
+
+class FastJSONRenderer(JSONRenderer):
+
+    """
+    JSON renderer for responses built by the values fast path.
+
+    Those responses only hold plain dicts, lists, strings and numbers, so
+    they can skip DRF's encoder hooks and use ``ujson`` when it's installed.
+    Anything else, including pretty printed output, goes through the
+    regular ``JSONRenderer``.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        view = renderer_context.get('view', None)
+        if (data is None or not getattr(view, 'values_rendered', False) or
+                self.get_indent(accepted_media_type,
+                                renderer_context) is not None):
+            return super(FastJSONRenderer, self).render(
+                data, accepted_media_type, renderer_context)
+
+        if ujson is not None:
+            ret = ujson.dumps(data, ensure_ascii=self.ensure_ascii,
+                              escape_forward_slashes=False)
+        else:
+            ret = json.dumps(data, ensure_ascii=self.ensure_ascii,
+                             check_circular=False, separators=(',', ':'))
+        if not isinstance(ret, bytes):
+            ret = ret.encode('utf-8')
+        # Keep the output a strict javascript subset, as JSONRenderer does.
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(
+            b'\xe2\x80\xa9', b'\\u2029')
+
+
+class MessagePackRenderer(BaseRenderer):
+
+    """
+    Renders responses as MessagePack, for clients that send
+    ``Accept: application/msgpack``. Needs the optional ``msgpack`` package.
+    """
+    media_type = MSGPACK_MEDIA_TYPE
+    format = 'msgpack'
+    charset = None
+    render_style = 'binary'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        # Anything MessagePack can't represent (dates, decimals, lazy
+        # strings) is converted as it would be for JSON.
+        return msgpack.packb(data, use_bin_type=True,
+                             default=JSONEncoder().default)
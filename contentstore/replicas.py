@@ -0,0 +1,108 @@
+"""
+Routing of contentstore reads to read replicas.
+
+``ReadReplicaRouter`` sends reads of contentstore models to one of the
+database aliases in ``CONTENTSTORE_READ_REPLICAS``, but only once a view
+has picked one with ``set_read_database``, as the API viewsets do for safe
+requests. Clients are pinned to the primary database for
+``CONTENTSTORE_REPLICA_PIN_SECONDS`` after a write, so they read their own
+writes despite replication lag. Pins are kept in the default cache, which
+needs to be shared between processes for them to work across workers.
+"""
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+APP_LABEL = 'contentstore'
+DEFAULT_PIN_SECONDS = 10
+
+_state = threading.local()
+
+
+def get_replicas():
+    return list(getattr(settings, 'CONTENTSTORE_READ_REPLICAS', ()))
+
+
+def _pin_key(client):
+    return 'contentstore:replica-pin:%s' % (client,)
+
+
+def pin(client):
+    """
+        Sends reads from ``client`` to the primary database for a while.
+    """
+    cache.set(_pin_key(client), True, getattr(
+        settings, 'CONTENTSTORE_REPLICA_PIN_SECONDS', DEFAULT_PIN_SECONDS))
+
+
+def is_pinned(client):
+    return cache.get(_pin_key(client)) is not None
+
+
+def get_read_database():
+    """
+        The replica alias reads are currently routed to, if any.
+    """
+    return getattr(_state, 'alias', None)
+
+
+def set_read_database(alias):
+    """
+        Routes contentstore reads to the replica ``alias`` from now on in
+        this thread. ``None`` routes them to the primary database.
+    """
+    _state.alias = alias
+
+
+@contextmanager
+def use_replica(alias):
+    """
+        Routes contentstore reads to ``alias`` inside the block only.
+    """
+    previous = get_read_database()
+    set_read_database(alias)
+    try:
+        yield
+    finally:
+        set_read_database(previous)
+
+
+def choose_replica(client=None):
+    """
+        A replica to read from for ``client``, or ``None`` when there are
+        none configured or the client has written recently.
+    """
+    replicas = get_replicas()
+    if not replicas or (client is not None and is_pinned(client)):
+        return None
+    return random.choice(replicas)
+
+
+class ReadReplicaRouter(object):
+
+    """
+    Database router sending contentstore reads to the replica chosen with
+    ``set_read_database`` and all contentstore writes to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label == APP_LABEL:
+            return get_read_database()
+        return None
+
+    def db_for_write(self, model, **hints):
+        if model._meta.app_label == APP_LABEL:
+            # Without this, saving an object read from a replica would
+            # write to the replica.
+            return DEFAULT_DB_ALIAS
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = set([DEFAULT_DB_ALIAS] + get_replicas())
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
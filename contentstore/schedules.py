@@ -0,0 +1,169 @@
+"""
+Evaluates ``Schedule`` crontab fields to project when subscribers will be
+sent each message of a message set, following ``next_set`` to the end of
+the programme.
+
+Fields follow celery's ``crontab``: ``*``, numbers, ``a-b`` ranges, ``/n``
+steps and comma separated lists, with weekdays numbered from Sunday as 0
+or named. A day has to match both ``day_of_month`` and ``day_of_week``,
+and times are in UTC.
+"""
+from datetime import datetime, timedelta
+
+from django.utils import timezone
+
+from .models import MessageSet, Message
+
+WEEKDAYS = ('sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat')
+MONTHS = ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep',
+          'oct', 'nov', 'dec')
+# How far ahead to look for a schedule's next run before deciding it has
+# none, long enough for e.g. the 29th of February falling on a Monday.
+HORIZON = timedelta(days=366 * 30)
+# Upper bound on the sends in one timeline.
+MAX_SENDS = 10000
+
+
+class ScheduleError(ValueError):
+
+    """
+    Raised for crontab fields that can't be parsed, or schedules that never
+    run.
+    """
+
+
+def _parse_value(value, low, names):
+    if value in names:
+        return names.index(value) + low
+    try:
+        return int(value)
+    except ValueError:
+        raise ScheduleError("Invalid crontab value %r." % (value,))
+
+
+def parse_field(value, low, high, names=()):
+    """
+        The set of numbers from ``low`` to ``high`` a crontab field matches.
+    """
+    values = set()
+    for part in (value or '*').lower().split(','):
+        part, _, step = part.strip().partition('/')
+        step = _parse_value(step, 0, ()) if step else 1
+        if part == '*':
+            start, end = low, high
+        elif '-' in part:
+            start, end = [_parse_value(v, low, names)
+                          for v in part.split('-', 1)]
+        else:
+            start = _parse_value(part, low, names)
+            end = high if step > 1 else start
+        if step < 1 or not low <= start <= end <= high:
+            raise ScheduleError("Invalid crontab field %r." % (value,))
+        values.update(range(start, end + 1, step))
+    return frozenset(values)
+
+
+class Crontab(object):
+
+    """
+    The times a ``Schedule`` runs, to the minute.
+    """
+
+    def __init__(self, minute='*', hour='*', day_of_week='*',
+                 day_of_month='*', month_of_year='*'):
+        self.minutes = sorted(parse_field(minute, 0, 59))
+        self.hours = parse_field(hour, 0, 23)
+        # Sunday is 7 as well as 0, as in cron.
+        self.days_of_week = frozenset(
+            day % 7 for day in parse_field(day_of_week, 0, 7, WEEKDAYS))
+        self.days_of_month = parse_field(day_of_month, 1, 31)
+        self.months = parse_field(month_of_year, 1, 12, MONTHS)
+
+    @classmethod
+    def from_schedule(cls, schedule):
+        return cls(schedule.minute, schedule.hour, schedule.day_of_week,
+                   schedule.day_of_month, schedule.month_of_year)
+
+    def _runs_on(self, when):
+        return (when.month in self.months and
+                when.day in self.days_of_month and
+                when.isoweekday() % 7 in self.days_of_week)
+
+    def next_run(self, when):
+        """
+            The first time at or after ``when`` that the schedule runs.
+        """
+        limit = when + HORIZON
+        if when.second or when.microsecond:
+            when = when.replace(second=0, microsecond=0) + timedelta(
+                minutes=1)
+        while when < limit:
+            if not self._runs_on(when):
+                when = datetime.combine(
+                    when.date() + timedelta(days=1),
+                    datetime.min.time()).replace(tzinfo=when.tzinfo)
+                continue
+            if when.hour in self.hours:
+                for minute in self.minutes:
+                    if minute >= when.minute:
+                        return when.replace(minute=minute)
+            when = when.replace(minute=0) + timedelta(hours=1)
+        raise ScheduleError("The schedule never runs.")
+
+
+def _programme(messageset_id, lang):
+    """
+        The message sets reached from ``messageset_id`` through
+        ``next_set``, stopping before the chain loops, each with its
+        schedule and the sequence numbers it sends in ``lang``.
+    """
+    sets = []
+    seen = set()
+    while messageset_id is not None and messageset_id not in seen:
+        seen.add(messageset_id)
+        messageset = MessageSet.objects.select_related(
+            'default_schedule').get(pk=messageset_id)
+        sets.append(messageset)
+        messageset_id = messageset.next_set_id
+    messages = Message.objects.filter(messageset__in=sets, lang=lang)
+    numbers = {}
+    for messageset_id, number in messages.order_by(
+            'sequence_number').values_list(
+            'messageset', 'sequence_number').distinct():
+        numbers.setdefault(messageset_id, []).append(number)
+    return [(s, Crontab.from_schedule(s.default_schedule),
+             numbers.get(s.pk, [])) for s in sets]
+
+
+def send_timeline(messageset_id, first_run, lang, start_sequence=1):
+    """
+        When each message is sent to a subscriber in ``lang`` who gets
+        message ``start_sequence`` of the message set at ``first_run``, a
+        time its schedule runs. Each later message goes out on the next run
+        of its set's schedule, and a ``next_set`` starts on the first run of
+        its schedule after the set before it finished. Only ``lang``'s
+        messages count, since no subscriber gets another track's.
+
+        :returns: A list of ``(messageset_id, sequence_number, send_at)``.
+    """
+    sends = []
+    when = first_run
+    for i, (messageset, crontab, numbers) in enumerate(
+            _programme(messageset_id, lang)):
+        if i == 0:
+            numbers = [n for n in numbers if n >= start_sequence]
+        for number in numbers:
+            if len(sends) == MAX_SENDS:
+                return sends
+            when = crontab.next_run(when)
+            sends.append((messageset.pk, number, when))
+            when += timedelta(minutes=1)
+    return sends
+
+
+def next_run(schedule, start):
+    """
+        The first time ``schedule`` runs at or after ``start``.
+    """
+    start = timezone.localtime(start, timezone.utc)
+    return Crontab.from_schedule(schedule).next_run(start)
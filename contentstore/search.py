@@ -0,0 +1,133 @@
+"""
+Full-text search over message ``text_content``.
+
+On SQLite the messages are indexed in an FTS5 table kept in sync by
+triggers, so every write path (including bulk inserts and raw deletes)
+updates it. On PostgreSQL an expression index over the ``tsvector`` of the
+text serves the query directly. Other databases, or SQLite builds without
+FTS5, fall back to an unranked substring match.
+"""
+import re
+
+from django.db import connections, OperationalError
+
+from .models import Message
+
+FTS_TABLE = 'contentstore_message_fts'
+TS_CONFIG = 'simple'
+
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5("
+    "text_content, content='{table}', content_rowid='id')",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} "
+    "BEGIN INSERT INTO {fts}(rowid, text_content) "
+    "VALUES (new.id, new.text_content); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} "
+    "BEGIN INSERT INTO {fts}({fts}, rowid, text_content) "
+    "VALUES ('delete', old.id, old.text_content); END",
+    "CREATE TRIGGER IF NOT EXISTS {fts}_update "
+    "AFTER UPDATE OF text_content ON {table} "
+    "BEGIN INSERT INTO {fts}({fts}, rowid, text_content) "
+    "VALUES ('delete', old.id, old.text_content); "
+    "INSERT INTO {fts}(rowid, text_content) "
+    "VALUES (new.id, new.text_content); END",
+    "INSERT INTO {fts}({fts}) VALUES ('rebuild')",
+]
+
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS {fts}_insert",
+    "DROP TRIGGER IF EXISTS {fts}_delete",
+    "DROP TRIGGER IF EXISTS {fts}_update",
+    "DROP TABLE IF EXISTS {fts}",
+]
+
+TSVECTOR = "to_tsvector('{config}', COALESCE({column}, ''))"
+
+POSTGRES_INDEX = [
+    "CREATE INDEX {fts}_tsv ON {table} USING gin (%s)" % (TSVECTOR,),
+]
+
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS {fts}_tsv",
+]
+
+
+def _execute(connection, statements):
+    table = Message._meta.db_table
+    with connection.cursor() as cursor:
+        for sql in statements:
+            cursor.execute(sql.format(fts=FTS_TABLE, table=table,
+                                      config=TS_CONFIG,
+                                      column='text_content'))
+
+
+def install_index(connection):
+    """
+        Creates the full-text index and fills it from existing messages.
+        On SQLite it's safe to run again, which is needed after migrations
+        that rebuild the message table since that drops the triggers.
+    """
+    if connection.vendor == 'sqlite':
+        try:
+            _execute(connection, SQLITE_INDEX)
+        except OperationalError:
+            # Built without FTS5, searches fall back to substring matches.
+            pass
+    elif connection.vendor == 'postgresql':
+        _execute(connection, POSTGRES_INDEX)
+
+
+def uninstall_index(connection):
+    if connection.vendor == 'sqlite':
+        _execute(connection, SQLITE_DROP)
+    elif connection.vendor == 'postgresql':
+        _execute(connection, POSTGRES_DROP)
+
+
+def _has_fts_table(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s",
+                       [FTS_TABLE])
+        return cursor.fetchone() is not None
+
+
+def fts_query(text):
+    """
+        Turns free text into an FTS5 query matching every word, so user
+        input can't use (or break on) the query syntax.
+    """
+    words = re.findall(r'\w+', text, re.UNICODE)
+    return ' '.join('"%s"' % (word,) for word in words)
+
+
+def search_messages(queryset, text):
+    """
+        Narrows a ``Message`` queryset to messages matching ``text`` and
+        orders it best match first, annotating each with a ``rank`` (higher
+        is better). Returns an empty queryset if ``text`` has no words.
+    """
+    connection = connections[queryset.db]
+    table = connection.ops.quote_name(Message._meta.db_table)
+    column = '%s.%s' % (table, connection.ops.quote_name('text_content'))
+    if connection.vendor == 'sqlite' and _has_fts_table(connection):
+        query = fts_query(text)
+        if not query:
+            return queryset.none()
+        # bm25 scores better matches lower, so negate it.
+        return queryset.extra(
+            tables=[FTS_TABLE],
+            where=['%s.rowid = %s.id' % (FTS_TABLE, table),
+                   '%s MATCH %%s' % (FTS_TABLE,)],
+            params=[query],
+            select={'rank': '-bm25(%s)' % (FTS_TABLE,)}).order_by(
+            '-rank', 'id')
+    if connection.vendor == 'postgresql':
+        tsvector = TSVECTOR.format(config=TS_CONFIG, column=column)
+        tsquery = "plainto_tsquery('%s', %%s)" % (TS_CONFIG,)
+        return queryset.extra(
+            where=['%s @@ %s' % (tsvector, tsquery)],
+            params=[text],
+            select={'rank': 'ts_rank(%s, %s)' % (tsvector, tsquery)},
+            select_params=[text]).order_by('-rank', 'id')
+    return queryset.filter(text_content__icontains=text).extra(
+        select={'rank': '0'}).order_by('id')
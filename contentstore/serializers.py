@@ -1,9 +1,156 @@
 from .models import Schedule, MessageSet, Message, BinaryContent
 
+from django.db.models import FileField, Prefetch
 from rest_framework import serializers
+from rest_framework.permissions import SAFE_METHODS
+from .fastpath import file_url
 
 
-class ScheduleSerializer(serializers.ModelSerializer):
+def parse_fieldset(value):
+    """
+        Turns a comma separated ``fields`` or ``omit`` value into a set of
+        field names, dropping empty entries.
+    """
+    if not value:
+        return set()
+    if isinstance(value, (list, tuple, set, frozenset)):
+        value = ','.join(value)
+    return set(name.strip() for name in value.split(',') if name.strip())
+
+
+def _rendered_columns(serializer, model):
+    columns = set(f.name for f in model._meta.concrete_fields)
+    return [field.source for field in serializer.fields.values()
+            if field.source in columns]
+
+
+def narrow_queryset(queryset, serializer, include=()):
+    """
+        Restricts ``queryset`` to the columns and relations that
+        ``serializer`` will actually render. Nested serializers are
+        loaded with ``select_related`` or a narrowed ``Prefetch``.
+    """
+    model = queryset.model
+    only = [model._meta.pk.name] + list(include)
+    only.extend(_rendered_columns(serializer, model))
+    for field in serializer.fields.values():
+        if isinstance(field, serializers.ListSerializer):
+            rel = model._meta.get_field(field.source)
+            child_queryset = narrow_queryset(
+                rel.related_model._default_manager.all(), field.child,
+                include=[rel.field.name])
+            queryset = queryset.prefetch_related(
+                Prefetch(field.source, queryset=child_queryset))
+        elif isinstance(field, serializers.BaseSerializer):
+            rel_model = model._meta.get_field(field.source).rel.to
+            queryset = queryset.select_related(field.source)
+            only.extend('%s__%s' % (field.source, column)
+                        for column in _rendered_columns(field, rel_model))
+    return queryset.only(*only)
+
+
+class SparseFieldsetMixin(object):
+
+    """
+        Lets the rendered fields be narrowed with ``fields`` and ``omit``,
+        given either as keyword arguments or as query parameters on safe
+        requests. Nested fields are addressed with dotted names, e.g.
+        ``?fields=id,messages.text_content``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._sparse_fields = parse_fieldset(kwargs.pop('fields', None))
+        self._sparse_omit = parse_fieldset(kwargs.pop('omit', None))
+        super(SparseFieldsetMixin, self).__init__(*args, **kwargs)
+
+    def _sparse_path(self):
+        path = []
+        node = self
+        while node.parent is not None:
+            if node.field_name:
+                path.insert(0, node.field_name)
+            node = node.parent
+        return path
+
+    def _sparse_fieldsets(self):
+        fields = set(self._sparse_fields)
+        omit = set(self._sparse_omit)
+        request = self.context.get('request', None)
+        if request is not None and request.method in SAFE_METHODS:
+            params = getattr(request, 'query_params', request.GET)
+            fields |= parse_fieldset(params.get('fields'))
+            omit |= parse_fieldset(params.get('omit'))
+        path = self._sparse_path()
+        if path:
+            prefix = '.'.join(path) + '.'
+            fields = set(f[len(prefix):] for f in fields
+                         if f.startswith(prefix))
+            omit = set(f[len(prefix):] for f in omit if f.startswith(prefix))
+        fields = set(f.split('.')[0] for f in fields)
+        omit = set(f for f in omit if '.' not in f)
+        return fields, omit
+
+    def get_fields(self):
+        fields = super(SparseFieldsetMixin, self).get_fields()
+        only, omit = self._sparse_fieldsets()
+        for name in list(fields.keys()):
+            if (only and name not in only) or name in omit:
+                fields.pop(name)
+        return fields
+
+
+class ChangedFieldsMixin(object):
+
+    """
+        Saves updates with ``update_fields``, writing only the columns whose
+        values changed (and ``auto_now`` timestamps). Updates that change
+        nothing aren't saved at all, so they don't touch the row or add to
+        the change log.
+    """
+
+    def _has_changed(self, instance, field, value):
+        if isinstance(field, FileField):
+            return True
+        if field.is_relation:
+            return getattr(instance, field.attname) != (
+                None if value is None else value.pk)
+        return getattr(instance, field.name) != value
+
+    def update(self, instance, validated_data):
+        serializers.raise_errors_on_nested_writes(
+            'update', self, validated_data)
+        opts = instance._meta
+        changed = [
+            name for name, value in validated_data.items()
+            if self._has_changed(instance, opts.get_field(name), value)]
+        if not changed:
+            return instance
+        for name in changed:
+            setattr(instance, name, validated_data[name])
+        changed.extend(field.name for field in opts.concrete_fields
+                       if getattr(field, 'auto_now', False))
+        instance.save(update_fields=changed)
+        return instance
+
+
+class ContentFileField(serializers.FileField):
+
+    """
+        A ``FileField`` rendering signed URLs when they're enabled, see
+        :mod:`contentstore.signing`, unless the ``sign_urls`` context is
+        false.
+    """
+
+    def to_representation(self, value):
+        if not self.use_url:
+            return super(ContentFileField, self).to_representation(value)
+        return file_url(value.storage, value.name,
+                        self.context.get('request', None),
+                        sign=self.context.get('sign_urls', True))
+
+
+class ScheduleSerializer(SparseFieldsetMixin, ChangedFieldsMixin,
+                         serializers.ModelSerializer):
 
     class Meta:
         model = Schedule
@@ -11,7 +158,8 @@ class ScheduleSerializer(serializers.ModelSerializer):
                   'month_of_year')
 
 
-class MessageSetSerializer(serializers.ModelSerializer):
+class MessageSetSerializer(SparseFieldsetMixin, ChangedFieldsMixin,
+                           serializers.ModelSerializer):
 
     class Meta:
         model = MessageSet
@@ -19,22 +167,28 @@ class MessageSetSerializer(serializers.ModelSerializer):
                   'created_at', 'updated_at')
 
 
-class BinaryContentSerializer(serializers.ModelSerializer):
+class BinaryContentSerializer(SparseFieldsetMixin, ChangedFieldsMixin,
+                              serializers.ModelSerializer):
+    serializer_field_mapping = dict(
+        serializers.ModelSerializer.serializer_field_mapping,
+        **{FileField: ContentFileField})
 
     class Meta:
         model = BinaryContent
-        fields = ('id', 'content')
+        fields = ('id', 'content', 'checksum')
 
 
-class MessageSerializer(serializers.ModelSerializer):
+class MessageSerializer(SparseFieldsetMixin, ChangedFieldsMixin,
+                        serializers.ModelSerializer):
 
     class Meta:
         model = Message
         fields = ('id', 'messageset', 'sequence_number', 'lang',
-                  'text_content', 'binary_content', 'created_at', 'updated_at')
+                  'text_content', 'binary_content', 'encoding', 'segments',
+                  'created_at', 'updated_at')
 
 
-class MessageListSerializer(serializers.ModelSerializer):
+class MessageListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
 
     """
         Only used for get views, because binary relational serializer is not
@@ -45,13 +199,74 @@ class MessageListSerializer(serializers.ModelSerializer):
     class Meta:
         model = Message
         fields = ('id', 'messageset', 'sequence_number', 'lang',
-                  'text_content', 'binary_content', 'created_at', 'updated_at')
+                  'text_content', 'binary_content', 'encoding', 'segments',
+                  'created_at', 'updated_at')
 
 
-class MessageSetMessagesSerializer(serializers.ModelSerializer):
+class MessageSetMessagesSerializer(SparseFieldsetMixin,
+                                   serializers.ModelSerializer):
     messages = MessageListSerializer(many=True, read_only=True)
 
     class Meta:
         model = MessageSet
         fields = ('id', 'short_name', 'notes', 'next_set', 'default_schedule',
                   'messages', 'created_at', 'updated_at')
+
+
+class TrackCloneSerializer(serializers.Serializer):
+
+    """
+        Request body for cloning a single language track.
+    """
+    lang = serializers.CharField(max_length=6)
+    to_lang = serializers.CharField(max_length=6)
+    to_messageset = serializers.PrimaryKeyRelatedField(
+        queryset=MessageSet.objects.all(), required=False, allow_null=True)
+
+
+class MessageSetCloneSerializer(serializers.Serializer):
+
+    """
+        Request body for cloning a whole message set.
+    """
+    short_name_suffix = serializers.CharField(trim_whitespace=False)
+    include_next_sets = serializers.BooleanField(default=False)
+
+
+class TrackResequenceSerializer(serializers.Serializer):
+
+    """
+        Request body for renumbering a language track, either shifting
+        messages from ``start`` on by ``shift`` or numbering the message
+        ids in ``order`` from 1.
+    """
+    lang = serializers.CharField(max_length=6)
+    start = serializers.IntegerField(required=False)
+    shift = serializers.IntegerField(required=False)
+    order = serializers.ListField(child=serializers.IntegerField(),
+                                  required=False)
+
+    def validate(self, attrs):
+        shifting = 'start' in attrs and 'shift' in attrs
+        if shifting == ('order' in attrs):
+            raise serializers.ValidationError(
+                'Give either start and shift, or order.')
+        return attrs
+
+
+class MessageSetDeleteSerializer(serializers.Serializer):
+
+    """
+        Request body for deleting message sets in bulk.
+    """
+    ids = serializers.ListField(child=serializers.IntegerField())
+
+
+class TimelineSerializer(serializers.Serializer):
+
+    """
+        Query parameters for projecting a subscriber's send timeline.
+    """
+    start = serializers.DateTimeField()
+    start_sequence = serializers.IntegerField(min_value=1, default=1)
+    lang = serializers.CharField(max_length=6)
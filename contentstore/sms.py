@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+SMS encoding and segment counts for message text.
+
+Text that fits the GSM 03.38 alphabet is sent as GSM-7, where characters
+from the extension table take two septets, in segments of 160 septets or
+153 when the message is split. Anything else is sent as UCS-2 in segments
+of 70 UTF-16 code units, or 67 when split. Characters are never split
+across segments.
+"""
+
+GSM7 = 'gsm7'
+UCS2 = 'ucs2'
+
+ENCODING_CHOICES = (
+    (GSM7, 'GSM-7'),
+    (UCS2, 'UCS-2'),
+)
+
+GSM7_BASIC = frozenset(
+    u"@£$¥èéùìòÇ\nØø\r"
+    u"ÅåΔ_ΦΓΛΩΠΨΣΘ"
+    u"ΞÆæßÉ !\"#¤%&'()*+,-./0123456789:;<=>?"
+    u"¡ABCDEFGHIJKLMNOPQRSTUVWXYZÄÖÑÜ§"
+    u"¿abcdefghijklmnopqrstuvwxyzäöñüà")
+
+GSM7_EXTENDED = frozenset(u"\f^{}\\[~]|€")
+
+# (single segment, per segment when split) for each encoding
+SEGMENT_SIZES = {
+    GSM7: (160, 153),
+    UCS2: (70, 67),
+}
+
+
+def _sizes(text):
+    if all(c in GSM7_BASIC or c in GSM7_EXTENDED for c in text):
+        return GSM7, [2 if c in GSM7_EXTENDED else 1 for c in text]
+    return UCS2, [len(c.encode('utf-16-le')) // 2 for c in text]
+
+
+def count_segments(text):
+    """
+        Returns the encoding ``text`` would be sent with and the number of
+        SMS segments it takes, which is 0 for empty text.
+    """
+    encoding, sizes = _sizes(text)
+    single, split = SEGMENT_SIZES[encoding]
+    if sum(sizes) <= single:
+        return encoding, 1 if sizes else 0
+    segments, used = 1, 0
+    for size in sizes:
+        if used + size > split:
+            segments += 1
+            used = 0
+        used += size
+    return encoding, segments
@@ -0,0 +1,115 @@
+"""
+Upload spooling, so requests that upload binary content only wait for the
+file to reach local disk. A background worker (``manage.py
+flush_upload_spool``) then moves spooled files to the final storage backend.
+"""
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import (FileSystemStorage, Storage,
+                                       get_storage_class)
+from django.core.urlresolvers import reverse
+from django.utils import six
+from django.utils.deconstruct import deconstructible
+
+
+@deconstructible
+class SpooledStorage(Storage):
+
+    """
+    Saves files to the local ``CONTENTSTORE_SPOOL_DIR`` until
+    :func:`flush_spool` moves them to the storage named by
+    ``CONTENTSTORE_SPOOL_BACKEND`` (the file system storage by default).
+    Files are read from wherever they are at the time. URLs for spooled
+    files point at the ``spooled`` view, which serves them from the spool
+    until they're moved and redirects to the backend after, and URLs for
+    moved files point at the backend.
+    """
+
+    def __init__(self, backend=None, location=None):
+        if backend is None:
+            backend = getattr(settings, 'CONTENTSTORE_SPOOL_BACKEND', None)
+        if backend is None or isinstance(backend, six.string_types):
+            backend = get_storage_class(backend)()
+        if location is None:
+            location = settings.CONTENTSTORE_SPOOL_DIR
+        self.backend = backend
+        self.spool = FileSystemStorage(location=location)
+
+    def _open(self, name, mode='rb'):
+        if self.spool.exists(name):
+            return self.spool.open(name, mode)
+        return self.backend.open(name, mode)
+
+    def _save(self, name, content):
+        return self.spool.save(name, content)
+
+    def get_available_name(self, name, max_length=None):
+        # Spooled files keep their name in the backend, so it has to be
+        # free in both.
+        while True:
+            name = self.spool.get_available_name(name, max_length=max_length)
+            if not self.backend.exists(name):
+                return name
+            name = self.backend.get_available_name(
+                name, max_length=max_length)
+            if not self.spool.exists(name):
+                return name
+
+    def delete(self, name):
+        self.spool.delete(name)
+        self.backend.delete(name)
+
+    def exists(self, name):
+        return self.spool.exists(name) or self.backend.exists(name)
+
+    def listdir(self, path):
+        return self.backend.listdir(path)
+
+    def size(self, name):
+        if self.spool.exists(name):
+            return self.spool.size(name)
+        return self.backend.size(name)
+
+    def url(self, name):
+        if self.spool.exists(name):
+            # The backend has nothing to serve until the file is moved.
+            return reverse('contentstore-spooled', kwargs={'name': name})
+        return self.backend.url(name)
+
+    def spooled(self, min_age=0):
+        """
+            Names of the spooled files last written at least ``min_age``
+            seconds ago, which are safe to move.
+        """
+        cutoff = time.time() - min_age
+        root = self.spool.location
+        for path, dirs, files in os.walk(root):
+            for filename in sorted(files):
+                full = os.path.join(path, filename)
+                if os.path.getmtime(full) <= cutoff:
+                    yield os.path.relpath(full, root).replace(os.sep, '/')
+
+
+def flush_spool(storage, min_age=5, progress=None):
+    """
+        Moves the files ``storage`` has spooled to its backend, skipping
+        files written less than ``min_age`` seconds ago in case they're
+        still being written. Returns the number of files and bytes moved.
+    """
+    count = moved = 0
+    for name in storage.spooled(min_age):
+        with storage.spool.open(name) as content:
+            size = content.size
+            saved = storage.backend.save(name, content)
+        if saved != name:
+            # URLs already handed out use the spooled name.
+            storage.backend.delete(saved)
+            raise IOError("%s was stored as %s." % (name, saved))
+        storage.spool.delete(name)
+        count += 1
+        moved += size
+        if progress is not None:
+            progress(count, moved)
+    return count, moved
@@ -0,0 +1,61 @@
+"""
+Placeholders in message text, written as ``{{ name }}``.
+
+Templates are checked and compiled when a message is saved, into a
+``str.format`` string with any other braces escaped, so rendering a message
+for many recipients doesn't parse the text again.
+"""
+import re
+
+PLACEHOLDER = re.compile(r'{{\s*(.*?)\s*}}')
+NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class TemplateError(ValueError):
+
+    """
+    Raised for text with malformed placeholders.
+    """
+
+
+def _escape(literal):
+    if '{{' in literal or '}}' in literal:
+        raise TemplateError('Placeholders must look like {{ name }}.')
+    return literal.replace('{', '{{').replace('}', '}}')
+
+
+def compile_template(text):
+    """
+        Returns the format string for ``text`` and the names of its
+        placeholders in order of first use.
+    """
+    parts = []
+    names = []
+    pos = 0
+    for match in PLACEHOLDER.finditer(text):
+        name = match.group(1)
+        if not NAME.match(name):
+            raise TemplateError(
+                'Invalid placeholder name %r, use letters, digits and '
+                'underscores.' % (name,))
+        parts.append(_escape(text[pos:match.start()]))
+        parts.append('{%s}' % (name,))
+        if name not in names:
+            names.append(name)
+        pos = match.end()
+    parts.append(_escape(text[pos:]))
+    return ''.join(parts), names
+
+
+def render_many(compiled, variable_sets):
+    """
+        Renders a compiled template once for each dict of variables,
+        returning ``{"text": ...}`` or ``{"error": ...}`` for each.
+    """
+    results = []
+    for variables in variable_sets:
+        try:
+            results.append({'text': compiled.format(**variables)})
+        except KeyError as err:
+            results.append({'error': 'Missing variable %s.' % (err.args[0],)})
+    return results
@@ -167,6 +167,32 @@ class ContentStoreApiTestMixin(object):
         d = self.get_message(message_id)
         self.assertEqual(d["text_content"], "Message one updated")
 
+    def test_message_segments(self):
+        schedule = self.make_schedule()
+        messageset = self.make_messageset(default_schedule=schedule.id,
+                                          short_name="Full Set")
+        post_data = {
+            "messageset": messageset.id,
+            "sequence_number": 1,
+            "lang": "eng_GB",
+            "text_content": "Hi {{ name }}" + "x" * 160,
+        }
+        response = self.client.post('/message/',
+                                    json.dumps(post_data),
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        message_id = json.loads(response.content)["id"]
+
+        d = self.get_message(message_id)
+        self.assertEqual((d["encoding"], d["segments"]), ("gsm7", 2))
+
+        response = self.client.patch('/message/%s/' % message_id,
+                                     json.dumps({"text_content": u"\u0101"}),
+                                     content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        d = self.get_message(message_id)
+        self.assertEqual((d["encoding"], d["segments"]), ("ucs2", 1))
+
     def test_get_message_text(self):
         schedule = self.make_schedule()
         messageset = self.make_messageset(default_schedule=schedule.id,
@@ -219,3 +245,28 @@ class ContentStoreApiTestMixin(object):
         self.assertEqual(messages[0]["id"], message1.id)
         self.assertEqual(messages[1]["id"], message2.id)
         self.assertEqual(messages[2]["id"], message3.id)
+
+    def test_get_messageset_timeline(self):
+        schedule = self.make_schedule(minute="30", hour="9",
+                                      day_of_week="mon,thu")
+        messageset = self.make_messageset(default_schedule=schedule.id,
+                                          short_name="Timeline Set")
+        for sequence_number in (1, 2, 3):
+            self.make_message(messageset=messageset,
+                              sequence_number=sequence_number)
+
+        response = self.client.get(
+            '/messageset/%s/timeline/?start=2015-06-04T11:30:00%%2B02:00'
+            '&start_sequence=2&lang=eng_GB' % messageset.id,
+            content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content = json.loads(response.content)
+        self.assertEqual(content["start_sequence"], 2)
+        self.assertEqual(
+            [(s["sequence_number"], s["send_at"]) for s in content["sends"]],
+            [(2, "2015-06-04T09:30:00Z"), (3, "2015-06-08T09:30:00Z")])
+        self.assertEqual(content["finishes_at"], "2015-06-08T09:30:00Z")
+
+        response = self.client.get('/messageset/%s/timeline/' % messageset.id,
+                                   content_type='application/json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,9 +1,29 @@
+import base64
+import hashlib
+import json
+import os
 import pkg_resources
+import shutil
+import tempfile
+import time
+import unittest
+import zlib
+from datetime import datetime, timedelta
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
 from django.contrib.auth.models import User
-from rest_framework.test import APIClient
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
 from rest_framework.authtoken.models import Token
-from django.utils import six
+from django.utils import six, timezone
+from django.utils.http import urlencode
 from django.conf import settings
 from rest_framework.settings import api_settings
 from rest_framework.compat import force_bytes_or_smart_bytes
@@ -12,10 +32,30 @@ from rest_framework.compat import force_bytes_or_smart_bytes
 from contentstore.tests.tests_messageset_mixin import ContentStoreApiTestMixin
 from contentstore.tests.tests_messageset_binary_mixin import (
     ContentStoreBinaryApiTestMixin)
-from contentstore.models import Schedule, MessageSet, Message, BinaryContent
+from contentstore.models import (Schedule, MessageSet, Message, BinaryContent,
+                                 MessageSetBundle, MessageSetVersion, Change)
 from contentstore.serializers import (ScheduleSerializer, MessageSetSerializer,
                                       MessageSerializer,
-                                      BinaryContentSerializer)
+                                      BinaryContentSerializer,
+                                      MessageListSerializer,
+                                      MessageSetMessagesSerializer)
+from contentstore import bulk
+from contentstore.bulk import clone_track, collect_binary_content, Importer
+from contentstore.compression import choose_encoding, parse_accept_encoding
+from contentstore import signing
+from contentstore.fastpath import serialize_values
+from contentstore.renderers import FastJSONRenderer, msgpack
+from contentstore.replicas import get_read_database
+from contentstore.schedules import (Crontab, ScheduleError, WEEKDAYS,
+                                    parse_field)
+from contentstore.sms import count_segments
+from contentstore.storage import SpooledStorage, flush_spool
+from contentstore.templating import compile_template, TemplateError
+from contentstore.throttling import SlidingWindowThrottle
+from contentstore.views import MessageViewSet
+from client.messaging_contentstore.upload import MultipartUpload
+from client.messaging_contentstore.snapshot import (ContentStoreSnapshot,
+                                                    SnapshotError)
 
 
 class TestContentStore(TestCase, ContentStoreApiTestMixin):
@@ -417,3 +457,2133 @@ class TestContentStoreBinary(TestCase, ContentStoreBinaryApiTestMixin):
         for binary_content in d:
             s.append(BinaryContentSerializer(binary_content).data)
         return s
+
+
+class ContentStoreServerTestCase(TestCase):
+
+    """
+    Base for tests of server-only features, which the fake doesn't mirror.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user('testuser',
+                                             'testuser@example.com',
+                                             'testpass')
+        token = Token.objects.create(user=self.user)
+        self.token = token.key
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + self.token)
+
+    def make_schedule(self, minute="0", hour="1", day_of_week="*",
+                      day_of_month="*", month_of_year="*"):
+        schedule, created = Schedule.objects.get_or_create(
+            minute=minute, hour=hour, day_of_week=day_of_week,
+            day_of_month=day_of_month, month_of_year=month_of_year)
+        return schedule
+
+    def make_messageset(self, short_name="new set", next_set=None,
+                        default_schedule=None):
+        if default_schedule is None:
+            default_schedule = self.make_schedule()
+        return MessageSet.objects.create(
+            short_name=short_name, next_set=next_set,
+            default_schedule=default_schedule)
+
+    def make_message(self, messageset, sequence_number=1, lang="eng_GB",
+                     text_content="Testing 1 2 3", binary_content=None):
+        return Message.objects.create(
+            messageset=messageset, sequence_number=sequence_number,
+            lang=lang, text_content=text_content,
+            binary_content=binary_content)
+
+    def make_binary_content(self):
+        simple_png = pkg_resources.resource_stream('contentstore', 'test.png')
+        self.client.post('/binarycontent/', {"content": simple_png},
+                         format='multipart')
+        return BinaryContent.objects.last()
+
+    def get_json(self, path, **kwargs):
+        response = self.client.get(path, **kwargs)
+        self.assertEqual(response.status_code, 200)
+        return json.loads(response.content)
+
+
+class TestSparseFieldsets(ContentStoreServerTestCase):
+
+    def test_fields_param(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset)
+        [message] = self.get_json('/message/?fields=id,text_content')
+        self.assertEqual(sorted(message.keys()), ['id', 'text_content'])
+        self.assertEqual(message["text_content"], "Testing 1 2 3")
+
+    def test_omit_param(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset)
+        [message] = self.get_json('/message/?omit=created_at,updated_at')
+        self.assertFalse("created_at" in message)
+        self.assertFalse("updated_at" in message)
+        self.assertEqual(message["lang"], "eng_GB")
+
+    def test_nested_fields(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset, sequence_number=2, text_content="two")
+        self.make_message(messageset, sequence_number=1, text_content="one")
+        content = self.get_json(
+            '/messageset/%s/messages?fields=id,messages.text_content' %
+            messageset.id)
+        self.assertEqual(content, {
+            "id": messageset.id,
+            "messages": [{"text_content": "one"}, {"text_content": "two"}],
+        })
+
+    def test_nested_omit(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset)
+        content = self.get_json(
+            '/messageset/%s/messages?omit=notes,messages.binary_content' %
+            messageset.id)
+        self.assertFalse("notes" in content)
+        self.assertEqual(content["short_name"], "new set")
+        [message] = content["messages"]
+        self.assertFalse("binary_content" in message)
+        self.assertEqual(message["text_content"], "Testing 1 2 3")
+
+    def test_queryset_narrowed(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset)
+        with CaptureQueriesContext(connection) as ctx:
+            self.get_json(
+                '/messageset/%s/messages?fields=id,messages.text_content' %
+                messageset.id)
+        sql = [q['sql'] for q in ctx.captured_queries
+               if 'contentstore_' in q['sql']]
+        self.assertEqual(len(sql), 2)
+        for query in sql:
+            self.assertFalse('created_at' in query)
+            self.assertFalse('short_name' in query)
+
+    def test_binary_content_joined(self):
+        messageset = self.make_messageset()
+        binary_content = self.make_binary_content()
+        for i in range(3):
+            self.make_message(messageset, sequence_number=i,
+                              binary_content=binary_content)
+        with CaptureQueriesContext(connection) as ctx:
+            content = self.get_json('/messageset/%s/messages' % messageset.id)
+        self.assertEqual(len(content["messages"]), 3)
+        self.assertEqual(
+            len([q for q in ctx.captured_queries
+                 if 'contentstore_' in q['sql']]), 2)
+
+    def test_fields_ignored_on_write(self):
+        schedule = self.make_schedule()
+        response = self.client.post(
+            '/messageset/?fields=id',
+            json.dumps({"short_name": "Full Set",
+                        "default_schedule": schedule.id}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["short_name"], "Full Set")
+
+    def test_serializer_kwargs(self):
+        schedule = self.make_schedule()
+        data = ScheduleSerializer(schedule, fields=['id', 'hour']).data
+        self.assertEqual(dict(data), {"id": schedule.id, "hour": "1"})
+
+
+class TestValuesFastPath(ContentStoreServerTestCase):
+
+    def make_request(self, path='/'):
+        return Request(APIRequestFactory().get(path))
+
+    def make_content(self):
+        messageset = self.make_messageset()
+        binary_content = self.make_binary_content()
+        self.make_message(messageset, sequence_number=2, text_content=None,
+                          binary_content=binary_content)
+        self.make_message(messageset, sequence_number=1,
+                          text_content=u"Molo \u2028 \xfc")
+        self.make_message(messageset, sequence_number=1, lang="afr_ZA")
+        return messageset
+
+    def assert_equivalent(self, serializer_class, queryset, path='/'):
+        context = {'request': self.make_request(path)}
+        expected = serializer_class(queryset, many=True, context=context).data
+        fast = serialize_values(queryset, serializer_class(context=context))
+        self.assertEqual(json.loads(json.dumps(fast)),
+                         json.loads(json.dumps(expected)))
+        return fast
+
+    def test_message_list_serializer(self):
+        self.make_content()
+        self.assert_equivalent(MessageListSerializer, Message.objects.all())
+
+    def test_messageset_messages_serializer(self):
+        self.make_content()
+        self.make_messageset(short_name="empty set")
+        [full, empty] = self.assert_equivalent(
+            MessageSetMessagesSerializer, MessageSet.objects.order_by('id'))
+        self.assertEqual(len(full["messages"]), 3)
+        self.assertEqual(empty["messages"], [])
+
+    def test_flat_serializers(self):
+        self.make_content()
+        self.assert_equivalent(MessageSerializer, Message.objects.all())
+        self.assert_equivalent(MessageSetSerializer, MessageSet.objects.all())
+        self.assert_equivalent(ScheduleSerializer, Schedule.objects.all())
+        self.assert_equivalent(BinaryContentSerializer,
+                               BinaryContent.objects.all())
+
+    def test_sparse_fieldsets(self):
+        self.make_content()
+        [messageset] = self.assert_equivalent(
+            MessageSetMessagesSerializer, MessageSet.objects.all(),
+            '/?fields=id,messages.binary_content.content')
+        self.assertEqual(sorted(messageset.keys()), ['id', 'messages'])
+        self.assertEqual(messageset["messages"][0], {"binary_content": None})
+
+    def test_endpoint_matches_serializer(self):
+        messageset = self.make_content()
+        path = '/messageset/%s/messages' % messageset.id
+        # The token was cached by the upload in make_content.
+        with self.assertNumQueries(2):
+            content = self.get_json(path)
+        expected = MessageSetMessagesSerializer(
+            messageset, context={'request': self.make_request(path)}).data
+        self.assertEqual(content, json.loads(json.dumps(expected)))
+
+    def test_retrieve_missing(self):
+        response = self.client.get('/messageset/999/messages')
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get('/message/bogus/content')
+        self.assertEqual(response.status_code, 404)
+
+    def test_list_filters(self):
+        self.make_content()
+        content = self.get_json('/message/?lang=afr_ZA')
+        self.assertEqual([m["lang"] for m in content], ["afr_ZA"])
+
+    def test_renderer(self):
+        data = [{"text_content": u"Molo \u2028 \xfc/"}]
+        view = MessageViewSet()
+        view.values_rendered = True
+        rendered = FastJSONRenderer().render(data, renderer_context={
+            'view': view})
+        self.assertEqual(json.loads(rendered.decode('utf-8')), data)
+        self.assertFalse(b'\xe2\x80\xa8' in rendered)
+        view.values_rendered = False
+        self.assertEqual(
+            FastJSONRenderer().render(data, renderer_context={'view': view}),
+            JSONRenderer().render(data))
+
+
+class TestMessageSetBundles(ContentStoreServerTestCase):
+
+    def get_bundle(self, messageset, lang="eng_GB"):
+        return MessageSetBundle.objects.get(messageset=messageset, lang=lang)
+
+    def writes(self, ctx):
+        return [q['sql'] for q in ctx.captured_queries
+                if 'INSERT INTO' in q['sql'] or 'UPDATE "' in q['sql']]
+
+    def test_bundle_marked_on_save(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset, sequence_number=2, text_content="two")
+        self.make_message(messageset, sequence_number=1, text_content="one")
+        bundle = self.get_bundle(messageset)
+        self.assertTrue(bundle.stale)
+        self.assertEqual(bundle.version, 2)
+        self.assertEqual(
+            [m["text_content"] for m in json.loads(bundle.get_content())],
+            ["one", "two"])
+
+    def test_save_costs_one_update(self):
+        messageset = self.make_messageset()
+        for number in range(1, 21):
+            message = self.make_message(messageset, sequence_number=number)
+        message.text_content = "Changed"
+        with CaptureQueriesContext(connection) as ctx:
+            message.save()
+        bundle_queries = [q['sql'] for q in ctx.captured_queries
+                          if 'contentstore_messagesetbundle' in q['sql']]
+        self.assertEqual(len(bundle_queries), 1)
+        self.assertTrue('UPDATE' in bundle_queries[0])
+        self.assertFalse(any('"contentstore_message"."text_content"' in
+                             q['sql'] and 'SELECT' in q['sql']
+                             for q in ctx.captured_queries))
+
+    def test_rebuild_stale(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset)
+        self.make_message(messageset, lang="afr_ZA")
+        message.text_content = "Changed"
+        message.save()
+        self.assertEqual(MessageSetBundle.objects.rebuild_stale(), 2)
+        bundle = self.get_bundle(messageset)
+        self.assertFalse(bundle.stale)
+        self.assertEqual(bundle.version, 2)
+        self.assertEqual(json.loads(bundle.content)[0]["text_content"],
+                         "Changed")
+        self.assertEqual(self.get_bundle(messageset, "afr_ZA").version, 1)
+        self.assertEqual(MessageSetBundle.objects.rebuild_stale(), 0)
+        MessageSetBundle.objects.rebuild(messageset.id, "eng_GB")
+        self.assertEqual(self.get_bundle(messageset).version, 2)
+
+    def test_rebuild_keeps_bundle_stale_after_concurrent_write(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset, text_content="Before")
+        manager = MessageSetBundle.objects
+        build_messages = manager.build_messages
+
+        def concurrent_build(*args, **kwargs):
+            # Another writer edits the track after it has been read.
+            messages = build_messages(*args, **kwargs)
+            self.make_message(messageset, sequence_number=2)
+            return messages
+        manager.build_messages = concurrent_build
+        try:
+            manager.rebuild(messageset.id, "eng_GB")
+        finally:
+            del manager.build_messages
+        bundle = self.get_bundle(messageset)
+        self.assertTrue(bundle.stale)
+        self.assertEqual(len(json.loads(bundle.get_content())), 2)
+        manager.rebuild(messageset.id, "eng_GB")
+        bundle = self.get_bundle(messageset)
+        self.assertFalse(bundle.stale)
+        self.assertEqual(len(json.loads(bundle.content)), 2)
+
+    def test_rebuild_stale_min_age(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset)
+        self.assertEqual(
+            MessageSetBundle.objects.rebuild_stale(min_age=60), 0)
+        call_command('rebuild_bundles', min_age=0, stdout=six.StringIO())
+        self.assertFalse(self.get_bundle(messageset).stale)
+
+    def test_lang_change_marks_both_tracks(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset)
+        message.lang = "afr_ZA"
+        message.save()
+        self.assertEqual(self.get_bundle(messageset).get_content(), None)
+        self.assertEqual(self.get_bundle(messageset, "afr_ZA").version, 1)
+        MessageSetBundle.objects.rebuild_stale()
+        self.assertFalse(MessageSetBundle.objects.filter(
+            messageset=messageset, lang="eng_GB").exists())
+
+    def test_delete_marks_stale(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset)
+        self.make_message(messageset, sequence_number=2)
+        message.delete()
+        bundle = self.get_bundle(messageset)
+        self.assertEqual(bundle.version, 3)
+        self.assertEqual(len(json.loads(bundle.get_content())), 1)
+
+    def test_binary_content_url(self):
+        messageset = self.make_messageset()
+        binary_content = self.make_binary_content()
+        self.make_message(messageset, binary_content=binary_content)
+        [message] = json.loads(self.get_bundle(messageset).get_content())
+        self.assertEqual(message["binary_content"], binary_content.content.url)
+
+    def test_list_versions(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset)
+        self.make_message(messageset, lang="afr_ZA")
+        message.lang = "xho_ZA"
+        message.save()
+        with CaptureQueriesContext(connection) as ctx:
+            content = self.get_json('/messageset/%s/bundles' % messageset.id)
+        self.assertEqual(content, [{"lang": "afr_ZA", "version": 1},
+                                   {"lang": "xho_ZA", "version": 1}])
+        self.assertEqual(self.writes(ctx), [])
+        response = self.client.get('/messageset/999/bundles')
+        self.assertEqual(response.status_code, 404)
+
+    def test_retrieve(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset)
+        path = '/messageset/%s/bundles/eng_GB' % messageset.id
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(path)
+        self.assertEqual(self.writes(ctx), [])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['ETag'], '"%s-eng_GB-1"' % messageset.id)
+        content = json.loads(response.content)
+        self.assertEqual(content["version"], 1)
+        self.assertEqual(content["messageset"], messageset.id)
+        self.assertEqual(content["messages"][0]["text_content"],
+                         "Testing 1 2 3")
+
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        MessageSetBundle.objects.rebuild_stale()
+        response = self.client.get(path)
+        self.assertEqual(response['ETag'], '"%s-eng_GB-1"' % messageset.id)
+
+        response = self.client.get('/messageset/%s/bundles/xho_ZA' %
+                                   messageset.id)
+        self.assertEqual(response.status_code, 404)
+
+
+class TestMessageSetVersions(ContentStoreServerTestCase):
+
+    def publish(self, messageset):
+        return self.client.post('/messageset/%s/publish/' % (messageset.id,))
+
+    def test_publish(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset, text_content="one")
+        self.make_message(messageset, lang="afr_ZA", text_content="een")
+        response = self.publish(messageset)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data["version"], 1)
+        self.assertEqual(response.data["langs"], ["afr_ZA", "eng_GB"])
+
+        message.text_content = "two"
+        message.save()
+        self.assertEqual(self.publish(messageset).data["version"], 2)
+        versions = MessageSetVersion.objects.filter(messageset=messageset)
+        self.assertEqual(
+            [json.loads(v.content)["eng_GB"][0]["text_content"]
+             for v in versions], ["one", "two"])
+        self.assertEqual(self.client.post(
+            '/messageset/999/publish/').status_code, 404)
+
+    def test_versions_immutable(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset)
+        version = MessageSetVersion.objects.publish(messageset.id)
+        version.content = "{}"
+        self.assertRaises(ValueError, version.save)
+
+    def test_list(self):
+        messageset = self.make_messageset()
+        self.assertEqual(
+            self.get_json('/messageset/%s/versions' % messageset.id), [])
+        self.make_message(messageset)
+        self.publish(messageset)
+        self.publish(messageset)
+        response = self.client.get('/messageset/%s/versions' % messageset.id)
+        self.assertEqual([v["version"] for v in response.data], [1, 2])
+        self.assertEqual(response['Cache-Control'],
+                         'max-age=0, must-revalidate')
+        response = self.client.get('/messageset/999/versions')
+        self.assertEqual(response.status_code, 404)
+
+    def test_retrieve(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset)
+        self.make_message(messageset, lang="afr_ZA")
+        self.publish(messageset)
+        message.text_content = "Changed"
+        message.save()
+
+        path = '/messageset/%s/versions/1' % messageset.id
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        # Versions need a token, so shared caches mustn't keep them.
+        self.assertEqual(response['Cache-Control'],
+                         'private, max-age=31536000, immutable')
+        self.assertEqual(response['ETag'], '"%s-v1"' % messageset.id)
+        content = json.loads(response.content)
+        self.assertEqual(content["version"], 1)
+        self.assertEqual(sorted(content["tracks"]), ["afr_ZA", "eng_GB"])
+        self.assertEqual(content["tracks"]["eng_GB"][0]["text_content"],
+                         "Testing 1 2 3")
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        self.assertEqual(response['Cache-Control'],
+                         'private, max-age=31536000, immutable')
+
+        response = self.client.get(path + '/eng_GB')
+        self.assertEqual(response['ETag'], '"%s-v1-eng_GB"' % messageset.id)
+        self.assertEqual(response['Cache-Control'],
+                         'private, max-age=31536000, immutable')
+        content = json.loads(response.content)
+        self.assertEqual(content["lang"], "eng_GB")
+        self.assertEqual(content["messages"][0]["text_content"],
+                         "Testing 1 2 3")
+
+        for path in ('/messageset/%s/versions/2' % messageset.id,
+                     '/messageset/%s/versions/1/xho_ZA' % messageset.id):
+            self.assertEqual(self.client.get(path).status_code, 404)
+
+    def test_deleted_with_messageset(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset)
+        self.publish(messageset)
+        self.client.delete('/messageset/%s/' % messageset.id)
+        self.assertFalse(MessageSetVersion.objects.exists())
+
+
+class TestChanges(ContentStoreServerTestCase):
+
+    def test_signals_record_changes(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset)
+        message.text_content = "Changed"
+        message.save()
+        message_id = message.id
+        message.delete()
+        changes = Change.objects.filter(model="message")
+        self.assertEqual([(c.action, c.object_id) for c in changes], [
+            (Change.CREATED, message_id),
+            (Change.UPDATED, message_id),
+            (Change.DELETED, message_id),
+        ])
+        self.assertEqual(json.loads(changes[1].data)["text_content"],
+                         "Changed")
+        self.assertEqual(changes[2].data, None)
+
+    def test_cascade_tombstones(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset)
+        expected = [('message', message.id), ('messageset', messageset.id)]
+        messageset.delete()
+        self.assertEqual(
+            sorted(Change.objects.filter(action=Change.DELETED).values_list(
+                'model', 'object_id')), expected)
+
+    def test_record(self):
+        schedule = self.make_schedule()
+        Change.objects.all().delete()
+        Change.objects.record(Schedule, [schedule.id], Change.UPDATED)
+        [change] = Change.objects.all()
+        self.assertEqual(json.loads(change.data)["hour"], "1")
+
+    def test_changes_endpoint(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset)
+        content = self.get_json('/changes/')
+        self.assertFalse(content["more"])
+        self.assertEqual(
+            [(c["model"], c["action"]) for c in content["changes"]],
+            [("schedule", "created"), ("messageset", "created"),
+             ("message", "created")])
+        self.assertEqual(content["changes"][2]["data"]["id"], message.id)
+        cursor = content["cursor"]
+
+        message.delete()
+        content = self.get_json('/changes/?since=%s' % cursor)
+        [tombstone] = content["changes"]
+        self.assertEqual(tombstone["action"], "deleted")
+        self.assertEqual(tombstone["data"], None)
+        self.assertEqual(content["cursor"], tombstone["id"])
+
+        content = self.get_json('/changes/?since=%s' % content["cursor"])
+        self.assertEqual(content["changes"], [])
+        self.assertEqual(content["cursor"], tombstone["id"])
+
+    def test_changes_paging(self):
+        self.make_messageset()
+        content = self.get_json('/changes/?limit=1')
+        self.assertTrue(content["more"])
+        self.assertEqual(len(content["changes"]), 1)
+        content = self.get_json('/changes/?limit=1&since=%s' %
+                                content["cursor"])
+        self.assertFalse(content["more"])
+        self.assertEqual(len(content["changes"]), 1)
+
+    @override_settings(CONTENTSTORE_CHANGES_SETTLE_SECONDS=60)
+    def test_unsettled_changes_held_back(self):
+        self.make_messageset()
+        first, second = Change.objects.all()
+        self.make_schedule(hour="2")
+        third = Change.objects.last()
+        old = timezone.now() - timedelta(seconds=120)
+        Change.objects.filter(pk__in=[first.pk, third.pk]).update(
+            created_at=old)
+        # The second change may have been written before a still open
+        # transaction, so neither it nor the third are listed yet.
+        self.assertEqual(Change.objects.settled_cursor(), second.pk - 1)
+        content = self.get_json('/changes/')
+        self.assertEqual([c["id"] for c in content["changes"]], [first.pk])
+        self.assertEqual(content["cursor"], first.pk)
+
+        Change.objects.filter(pk=second.pk).update(created_at=old)
+        self.assertEqual(Change.objects.settled_cursor(), third.pk)
+        content = self.get_json('/changes/?since=%s' % content["cursor"])
+        self.assertEqual([c["id"] for c in content["changes"]],
+                         [second.pk, third.pk])
+
+    def test_changes_bad_cursor(self):
+        response = self.client.get('/changes/?since=yesterday')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestKeysetPagination(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestKeysetPagination, self).setUp()
+        self.messageset = self.make_messageset()
+        self.messages = [
+            self.make_message(self.messageset, sequence_number=5 - i)
+            for i in range(5)]
+
+    def test_unpaginated_by_default(self):
+        content = self.get_json('/message/')
+        self.assertEqual(len(content), 5)
+
+    def test_pages(self):
+        ids = []
+        cursor = 0
+        while True:
+            content = self.get_json('/message/?limit=2&after=%s' % cursor)
+            ids.extend(m["id"] for m in content["results"])
+            cursor = content["cursor"]
+            if not content["more"]:
+                break
+        self.assertEqual(ids, sorted(m.id for m in self.messages))
+        self.assertEqual(cursor, ids[-1])
+
+    def test_page_queries(self):
+        self.get_json('/message/?limit=2')  # caches the token
+        with self.assertNumQueries(1):
+            content = self.get_json(
+                '/message/?limit=2&after=%s' % self.messages[2].id)
+        self.assertEqual([m["id"] for m in content["results"]],
+                         [m.id for m in self.messages[3:]])
+        self.assertFalse(content["more"])
+
+    def test_last_page(self):
+        content = self.get_json('/message/?limit=5')
+        self.assertFalse(content["more"])
+        content = self.get_json('/message/?limit=5&after=%s' %
+                                content["cursor"])
+        self.assertEqual(content["results"], [])
+        self.assertEqual(content["cursor"], self.messages[-1].id)
+
+    def test_filters_and_nested_lists(self):
+        self.make_message(self.messageset, lang="afr_ZA")
+        content = self.get_json('/message/?limit=10&lang=afr_ZA')
+        self.assertEqual([m["lang"] for m in content["results"]],
+                         ["afr_ZA"])
+        content = self.get_json('/messageset/%s/messages?limit=10' %
+                                (self.messageset.id,))
+        self.assertEqual(len(content["messages"]), 6)
+        content = self.get_json('/messageset/?limit=1')
+        self.assertEqual([s["id"] for s in content["results"]],
+                         [self.messageset.id])
+
+    def test_bad_params(self):
+        response = self.client.get('/message/?limit=many')
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get('/message/?limit=2&after=first')
+        self.assertEqual(response.status_code, 400)
+
+
+class TestChangedFieldUpdates(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestChangedFieldUpdates, self).setUp()
+        self.messageset = self.make_messageset()
+        self.message = self.make_message(self.messageset)
+
+    def patch(self, path, data, table='contentstore_message'):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(path, json.dumps(data),
+                                         content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        return [q['sql'] for q in queries.captured_queries
+                if 'UPDATE "%s"' % (table,) in q['sql']]
+
+    def test_only_changed_columns_written(self):
+        [update] = self.patch('/message/%s/' % self.message.id,
+                              {"sequence_number": 2, "lang": "eng_GB"})
+        self.assertTrue('"sequence_number"' in update)
+        self.assertTrue('"updated_at"' in update)
+        self.assertFalse('"lang"' in update)
+        self.assertFalse('"text_content"' in update)
+        self.assertEqual(Message.objects.get().sequence_number, 2)
+
+    def test_text_updates_derived_columns(self):
+        [update] = self.patch('/message/%s/' % self.message.id,
+                              {"text_content": u"Hi {{ name }} \u0101"})
+        for column in ('text_content', 'compiled_text', 'placeholders',
+                       'encoding', 'segments'):
+            self.assertTrue('"%s"' % column in update)
+        message = Message.objects.get()
+        self.assertEqual(message.placeholders, 'name')
+        self.assertEqual(message.encoding, 'ucs2')
+
+    def test_unchanged_update_not_saved(self):
+        changes = Change.objects.count()
+        updates = self.patch('/message/%s/' % self.message.id, {
+            "messageset": self.messageset.id, "lang": "eng_GB",
+            "text_content": "Testing 1 2 3"})
+        self.assertEqual(updates, [])
+        updates = self.patch('/messageset/%s/' % self.messageset.id,
+                             {"next_set": None}, 'contentstore_messageset')
+        self.assertEqual(updates, [])
+        self.assertEqual(Change.objects.count(), changes)
+
+    def test_put_still_validates(self):
+        response = self.client.put(
+            '/message/%s/' % self.message.id,
+            json.dumps({"text_content": "Only text"}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CONTENTSTORE_SIGNED_URL_SECONDS=3600)
+class TestSignedUrls(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestSignedUrls, self).setUp()
+        self.binary_content = self.make_binary_content()
+        self.name = self.binary_content.content.name
+
+    def download(self, url):
+        client = APIClient()  # No credentials, the signature is enough.
+        return client.get(url.replace('http://testserver', ''))
+
+    def test_serializers_sign_urls(self):
+        [content] = self.get_json('/binarycontent/')
+        url = content["content"]
+        self.assertTrue(url.startswith(
+            'http://testserver/download/%s?expires=' % (self.name,)))
+        self.assertTrue('&signature=' in url)
+        request = Request(APIRequestFactory().get('/'))
+        expected = BinaryContentSerializer(
+            self.binary_content, context={'request': request}).data
+        self.assertEqual(expected["content"], url)
+
+    def test_changes_keep_plain_urls(self):
+        storage = self.binary_content.content.storage
+        change = Change.objects.get(model='binarycontent')
+        self.assertEqual(json.loads(change.data)["content"],
+                         storage.url(self.name))
+        [served] = self.get_json('/changes/')["changes"]
+        self.assertTrue(served["data"]["content"].startswith(
+            'http://testserver/download/%s?expires=' % (self.name,)))
+        self.assertEqual(self.download(served["data"]["content"]).status_code,
+                         200)
+
+    def test_download(self):
+        [content] = self.get_json('/binarycontent/')
+        with self.assertNumQueries(0):
+            response = self.download(content["content"])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertTrue(response['Cache-Control'].startswith(
+            'public, max-age='))
+        max_age = int(response['Cache-Control'].split('=')[1])
+        self.assertTrue(3600 <= max_age <= 7200)
+        self.binary_content.content.open()
+        self.assertEqual(b''.join(response.streaming_content),
+                         self.binary_content.content.read())
+        self.binary_content.content.close()
+
+    def test_bad_signatures(self):
+        url = signing.signed_url(self.name)
+        self.assertEqual(self.download(url[:-1] + 'x').status_code, 403)
+        self.assertEqual(self.download(url.split('?')[0]).status_code, 403)
+        other = signing.signed_url('other.png').split('?')[1]
+        response = self.download('/download/%s?%s' % (self.name, other))
+        self.assertEqual(response.status_code, 403)
+
+    def test_expiry(self):
+        url = signing.signed_url(self.name, now=time.time() - 7200)
+        self.assertEqual(self.download(url).status_code, 403)
+        self.assertEqual(signing.signed_url(self.name, now=3600),
+                         signing.signed_url(self.name, now=7199))
+
+    def test_missing_file(self):
+        response = self.download(signing.signed_url('missing.png'))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(
+        CONTENTSTORE_SIGNED_URL_BASE='https://cdn.example.com/media/')
+    def test_cdn_base(self):
+        [content] = self.get_json('/binarycontent/')
+        self.assertTrue(content["content"].startswith(
+            'https://cdn.example.com/media/%s?expires=' % (self.name,)))
+
+
+class TestSnapshotExport(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestSnapshotExport, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, 'snapshot.db')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def export(self, preload=True):
+        call_command('export_snapshot', self.path, chunk_size=2,
+                     stdout=six.StringIO())
+        snapshot = ContentStoreSnapshot(self.path, preload=preload)
+        self.addCleanup(snapshot.close)
+        return snapshot
+
+    def make_content(self):
+        messageset = self.make_messageset()
+        binary_content = self.make_binary_content()
+        for seq in range(3):
+            self.make_message(messageset, sequence_number=seq,
+                              text_content="eng %s" % seq)
+            self.make_message(messageset, sequence_number=seq, lang="afr_ZA",
+                              text_content=None,
+                              binary_content=binary_content)
+        return messageset
+
+    def assert_lookups(self, snapshot, messageset):
+        for message in Message.objects.all():
+            self.assertEqual(snapshot.get_message(message.id),
+                             dict(MessageSerializer(message).data))
+        self.assertEqual(snapshot.get_messageset(messageset.id),
+                         dict(MessageSetSerializer(messageset).data))
+        self.assertEqual(
+            json.loads(json.dumps(
+                snapshot.get_messageset_messages(messageset.id))),
+            json.loads(json.dumps(
+                MessageSetMessagesSerializer(messageset).data)))
+        message = snapshot.get_track_message(messageset.id, "eng_GB", 2)
+        self.assertEqual(message["text_content"], "eng 2")
+        self.assertEqual(
+            [m["sequence_number"] for m in snapshot.get_messages(
+                messageset.id, "afr_ZA")], [0, 1, 2])
+        self.assertRaises(KeyError, snapshot.get_message, 999)
+        self.assertRaises(KeyError, snapshot.get_track_message,
+                          messageset.id, "eng_GB", 9)
+
+    def test_round_trip(self):
+        messageset = self.make_content()
+        snapshot = self.export()
+        self.assertEqual(snapshot.cursor, Change.objects.last().id)
+        self.assert_lookups(snapshot, messageset)
+        [schedule] = snapshot.get_schedules()
+        self.assertEqual(schedule,
+                         dict(ScheduleSerializer(Schedule.objects.get()).data))
+
+    def test_without_preload(self):
+        messageset = self.make_content()
+        self.assert_lookups(self.export(preload=False), messageset)
+
+    def test_not_a_snapshot(self):
+        with open(self.path, 'w') as f:
+            f.write('not a database')
+        self.assertRaises(SnapshotError, ContentStoreSnapshot, self.path)
+
+
+class TestBulkImportExport(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestBulkImportExport, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir, name)
+        with open(path, 'wb') as f:
+            f.write(content.encode('utf-8'))
+        return path
+
+    def import_content(self, *args, **kwargs):
+        stderr = six.StringIO()
+        call_command('import_content', *args, stdout=six.StringIO(),
+                     stderr=stderr, **kwargs)
+        return stderr.getvalue()
+
+    def test_import_messages_csv(self):
+        messageset = self.make_messageset()
+        path = self.write('messages.csv', u"\n".join([
+            u"messageset,sequence_number,lang,text_content,binary_content",
+        ] + [u"%s,%s,zul_ZA,Umlayezo \xe9 %s," % (messageset.id, i, i)
+             for i in range(5)]))
+        progress = self.import_content('message', path, chunk_size=2)
+        self.assertTrue('5 rows imported' in progress)
+        messages = Message.objects.filter(lang="zul_ZA")
+        self.assertEqual(messages.count(), 5)
+        self.assertEqual(messages[4].text_content, u"Umlayezo \xe9 4")
+        self.assertEqual(messages[4].binary_content, None)
+        self.assertEqual(
+            Change.objects.filter(model="message").count(), 5)
+        bundle = MessageSetBundle.objects.get(lang="zul_ZA")
+        self.assertEqual(len(json.loads(bundle.get_content())), 5)
+
+    def test_import_ndjson_keep_ids(self):
+        schedule = self.make_schedule()
+        rows = [
+            {"id": 20, "short_name": "second", "default_schedule": schedule.id,
+             "next_set": None},
+            {"id": 10, "short_name": "first", "default_schedule": schedule.id,
+             "next_set": 20, "notes": "Start here"},
+        ]
+        path = self.write('sets.ndjson',
+                          u"\n".join(json.dumps(row) for row in rows))
+        self.import_content('messageset', path, keep_ids=True)
+        first = MessageSet.objects.get(pk=10)
+        self.assertEqual(first.next_set_id, 20)
+        self.assertEqual(first.notes, "Start here")
+
+    def test_dry_run_reports_errors(self):
+        messageset = self.make_messageset(short_name="taken")
+        path = self.write('messages.csv', u"\n".join([
+            u"messageset,sequence_number,lang,text_content",
+            u"%s,1,eng_GB,Fine" % messageset.id,
+            u"%s,two,eng_GB,Bad sequence" % messageset.id,
+            u"999,3,eng_GB,Missing set",
+            u"%s,4,eng_GB," % messageset.id,
+        ]))
+        before = Message.objects.count()
+        with self.assertRaises(CommandError) as ctx:
+            self.import_content('message', path, dry_run=True)
+        self.assertTrue('3 invalid rows' in str(ctx.exception))
+        self.assertEqual(Message.objects.count(), before)
+
+    def test_invalid_rows_import_nothing(self):
+        path = self.write('sets.csv', u"\n".join([
+            u"short_name,default_schedule",
+            u"taken,%s" % self.make_schedule().id,
+            u"taken,%s" % self.make_schedule().id,
+        ]))
+        self.assertRaises(CommandError, self.import_content, 'messageset',
+                          path, chunk_size=1)
+        self.assertEqual(MessageSet.objects.count(), 0)
+
+    def test_malformed_csv(self):
+        path = self.write('sets.csv', u"\n".join([
+            u"short_name,default_schedule",
+            u"fine,%s" % self.make_schedule().id,
+            u"bro\x00ken,1",
+        ]))
+        try:
+            self.import_content('messageset', path)
+        except CommandError as err:
+            self.assertTrue('line 3:' in str(err))
+        else:
+            self.fail("CommandError not raised.")
+        self.assertEqual(MessageSet.objects.count(), 0)
+
+    def test_import_skips_concurrent_rows(self):
+        messageset = self.make_messageset()
+        manager = Message.objects
+        bulk_create = manager.bulk_create
+
+        def concurrent_bulk_create(instances):
+            # Another transaction inserts a message first.
+            self.make_message(messageset, sequence_number=99)
+            return bulk_create(instances)
+
+        manager.bulk_create = concurrent_bulk_create
+        try:
+            count, errors = Importer('message').run([(line, {
+                "messageset": str(messageset.id), "sequence_number": line,
+                "lang": "zul_ZA", "text_content": "Hi"})
+                for line in (1, 2)])
+        finally:
+            del manager.bulk_create
+        self.assertEqual(count, 2)
+        created = Change.objects.filter(model="message").values_list(
+            'object_id', flat=True)
+        self.assertEqual(
+            sorted(Message.objects.filter(pk__in=created).values_list(
+                'sequence_number', flat=True)), [1, 2, 99])
+        self.assertEqual(len(created), 3)
+
+    def test_errors_capped(self):
+        importer = Importer('message', max_errors=2)
+        count, errors = importer.run([(line, {
+            "messageset": "999", "sequence_number": line, "lang": "eng_GB"})
+            for line in range(1, 6)], chunk_size=2)
+        self.assertEqual(count, 0)
+        self.assertEqual([err.line for err in errors], [1, 2])
+        self.assertEqual(importer.error_count, 5)
+
+    def test_export_round_trip(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset, text_content=u"\xe9 one")
+        self.make_message(messageset, sequence_number=2)
+        for format in ('csv', 'ndjson'):
+            path = os.path.join(self.tmpdir, 'messages.%s' % format)
+            call_command('export_content', 'message', path,
+                         stderr=six.StringIO())
+            Message.objects.all().delete()
+            self.import_content('message', path)
+            self.assertEqual(
+                list(Message.objects.values_list(
+                    'messageset', 'sequence_number', 'lang',
+                    'text_content')),
+                [(messageset.id, 1, u"eng_GB", u"\xe9 one"),
+                 (messageset.id, 2, u"eng_GB", u"Testing 1 2 3")])
+
+
+class TestClone(ContentStoreServerTestCase):
+
+    def clone(self, messageset, **data):
+        return self.client.post('/messageset/%s/clone/' % (
+            messageset.id,), json.dumps(data), content_type='application/json')
+
+    def test_clone_track(self):
+        messageset = self.make_messageset()
+        binary_content = BinaryContent.objects.create(content='test.png')
+        for i in range(1, 4):
+            self.make_message(messageset, sequence_number=i,
+                              text_content="Message %s" % i,
+                              binary_content=binary_content)
+        self.make_message(messageset, lang="zul_ZA")
+        before = Change.objects.count()
+
+        response = self.clone(messageset, lang="eng_GB", to_lang="afr_ZA")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'count': 3})
+        clones = Message.objects.filter(lang="afr_ZA").order_by(
+            'sequence_number')
+        self.assertEqual(
+            [(m.messageset_id, m.sequence_number, m.text_content,
+              m.binary_content_id) for m in clones],
+            [(messageset.id, i, "Message %s" % i, binary_content.id)
+             for i in range(1, 4)])
+        self.assertEqual(Change.objects.count() - before, 3)
+        bundle = MessageSetBundle.objects.get(messageset=messageset,
+                                              lang="afr_ZA")
+        self.assertEqual(len(json.loads(bundle.get_content())), 3)
+
+        response = self.clone(messageset, lang="eng_GB", to_lang="afr_ZA")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Message.objects.filter(lang="afr_ZA").count(), 3)
+
+    def test_clone_track_to_other_messageset(self):
+        messageset = self.make_messageset()
+        other = self.make_messageset(short_name="other set")
+        self.make_message(messageset)
+        response = self.clone(messageset, lang="eng_GB", to_lang="eng_GB",
+                              to_messageset=other.id)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(other.messages.get().text_content, "Testing 1 2 3")
+
+    def test_clone_track_onto_itself(self):
+        messageset = self.make_messageset()
+        response = self.clone(messageset, lang="eng_GB", to_lang="eng_GB")
+        self.assertEqual(response.status_code, 400)
+
+    def test_clone_messageset_chain(self):
+        last = self.make_messageset(short_name="last")
+        first = self.make_messageset(short_name="first", next_set=last)
+        last.next_set = first
+        last.save()
+        for messageset in (first, last):
+            self.make_message(messageset, text_content=messageset.short_name)
+            self.make_message(messageset, lang="zul_ZA")
+
+        response = self.clone(first, short_name_suffix=" v2",
+                              include_next_sets=True)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([d['short_name'] for d in response.data],
+                         ["first v2", "last v2"])
+        first_clone = MessageSet.objects.get(short_name="first v2")
+        last_clone = MessageSet.objects.get(short_name="last v2")
+        self.assertEqual(first_clone.next_set, last_clone)
+        self.assertEqual(last_clone.next_set, first_clone)
+        self.assertEqual(
+            first_clone.messages.get(lang="eng_GB").text_content, "first")
+        self.assertEqual(last_clone.messages.count(), 2)
+        self.assertEqual(
+            MessageSetBundle.objects.filter(
+                messageset__in=[first_clone, last_clone]).count(), 4)
+
+    def test_clone_skips_concurrent_messages(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset, sequence_number=1)
+        copy_messages = bulk._copy_messages
+
+        def concurrent_copy(*args):
+            # Another transaction adds to the target track first.
+            self.make_message(messageset, sequence_number=5, lang="afr_ZA")
+            return copy_messages(*args)
+
+        bulk._copy_messages = concurrent_copy
+        try:
+            self.assertEqual(
+                clone_track(messageset, "eng_GB", "afr_ZA"), 2)
+        finally:
+            bulk._copy_messages = copy_messages
+        created = list(Change.objects.filter(
+            model="message", action=Change.CREATED).values_list(
+            'object_id', flat=True))
+        self.assertEqual(len(created), 3)
+        self.assertEqual(sorted(created), sorted(
+            Message.objects.values_list('pk', flat=True)))
+
+    def test_clone_messageset_name_taken_concurrently(self):
+        messageset = self.make_messageset()
+        taken_names = bulk._taken_names
+
+        def concurrent_clone(names):
+            # Another clone takes the name once it has been checked.
+            errors = taken_names(names)
+            bulk._taken_names = taken_names
+            MessageSet.objects.create(
+                short_name=names[0],
+                default_schedule_id=messageset.default_schedule_id)
+            return errors
+
+        bulk._taken_names = concurrent_clone
+        try:
+            response = self.clone(messageset, short_name_suffix=" v2")
+        finally:
+            bulk._taken_names = taken_names
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue("short_name_suffix" in response.data)
+        self.assertEqual(MessageSet.objects.count(), 1)
+
+    def test_clone_messageset_keeps_next_set(self):
+        last = self.make_messageset(short_name="last")
+        first = self.make_messageset(short_name="first", next_set=last)
+        response = self.clone(first, short_name_suffix=" v2")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data[0]['next_set'], last.id)
+        self.assertEqual(MessageSet.objects.count(), 3)
+
+    def test_clone_messageset_bad_name(self):
+        messageset = self.make_messageset()
+        self.make_messageset(short_name="new set v2")
+        response = self.clone(messageset, short_name_suffix=" v2")
+        self.assertEqual(response.status_code, 400)
+        response = self.clone(messageset, short_name_suffix=" " * 20)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(MessageSet.objects.count(), 2)
+
+
+class TestResequence(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestResequence, self).setUp()
+        self.messageset = self.make_messageset()
+        self.messages = [
+            self.make_message(self.messageset, sequence_number=i,
+                              text_content="Message %s" % i)
+            for i in range(1, 5)]
+        self.other = self.make_message(self.messageset, sequence_number=3,
+                                       lang="zul_ZA")
+
+    def resequence(self, **data):
+        return self.client.post(
+            '/messageset/%s/resequence/' % (self.messageset.id,),
+            json.dumps(data), content_type='application/json')
+
+    def track(self):
+        bundle = MessageSetBundle.objects.get(messageset=self.messageset,
+                                              lang="eng_GB")
+        return [(m['sequence_number'], m['text_content'])
+                for m in json.loads(bundle.get_content())]
+
+    def test_shift(self):
+        before = Change.objects.count()
+        version = MessageSetBundle.objects.get(
+            messageset=self.messageset, lang="eng_GB").version
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.resequence(lang="eng_GB", start=3, shift=1)
+        updates = [q['sql'] for q in ctx.captured_queries
+                   if 'UPDATE "' in q['sql']]
+        self.assertEqual(len(updates), 2)
+        self.assertTrue('UPDATE "contentstore_message"' in updates[0])
+        self.assertTrue('UPDATE "contentstore_messagesetbundle"' in updates[1])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'count': 2})
+        self.assertEqual(self.track(), [
+            (1, "Message 1"), (2, "Message 2"), (4, "Message 3"),
+            (5, "Message 4")])
+        self.assertEqual(Change.objects.count() - before, 2)
+        self.assertEqual(
+            MessageSetBundle.objects.get(messageset=self.messageset,
+                                         lang="eng_GB").version, version + 1)
+        self.assertEqual(Message.objects.get(pk=self.other.pk)
+                         .sequence_number, 3)
+
+    def test_order(self):
+        order = [m.id for m in reversed(self.messages)]
+        response = self.resequence(lang="eng_GB", order=order)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'count': 4})
+        self.assertEqual(self.track(), [
+            (1, "Message 4"), (2, "Message 3"), (3, "Message 2"),
+            (4, "Message 1")])
+
+    def test_order_must_cover_track(self):
+        response = self.resequence(lang="eng_GB",
+                                   order=[self.messages[0].id, self.other.id])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.track()[0], (1, "Message 1"))
+
+    def test_needs_start_and_shift_or_order(self):
+        self.assertEqual(self.resequence(lang="eng_GB").status_code, 400)
+        self.assertEqual(
+            self.resequence(lang="eng_GB", start=1).status_code, 400)
+        self.assertEqual(
+            self.resequence(lang="eng_GB", start=1, shift=1,
+                            order=[]).status_code, 400)
+
+
+class TestBulkDelete(ContentStoreServerTestCase):
+
+    def test_delete_many(self):
+        last = self.make_messageset(short_name="last")
+        first = self.make_messageset(short_name="first", next_set=last)
+        kept = self.make_messageset(short_name="kept")
+        for messageset in (first, last, kept):
+            self.make_message(messageset)
+            self.make_message(messageset, lang="zul_ZA")
+
+        response = self.client.post(
+            '/messageset/delete_many/', json.dumps({"ids": [last.id]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data,
+                         {'messagesets': 2, 'messages': 4, 'missing': []})
+        self.assertEqual(list(MessageSet.objects.all()), [kept])
+        self.assertEqual(Message.objects.count(), 2)
+        self.assertEqual(MessageSetBundle.objects.count(), 2)
+        deleted = Change.objects.filter(action=Change.DELETED)
+        self.assertEqual(
+            sorted(deleted.filter(model="messageset").values_list(
+                'object_id', flat=True)), [last.id, first.id])
+        self.assertEqual(deleted.filter(model="message").count(), 4)
+
+    def test_delete_many_reports_missing(self):
+        messageset = self.make_messageset()
+        response = self.client.post(
+            '/messageset/delete_many/',
+            json.dumps({"ids": [messageset.id + 2, messageset.id,
+                                messageset.id + 1]}),
+            content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            'messagesets': 1, 'messages': 0,
+            'missing': [messageset.id + 1, messageset.id + 2]})
+        self.assertEqual(MessageSet.objects.count(), 0)
+
+    def test_destroy_uses_bulk_delete(self):
+        messageset = self.make_messageset()
+        for i in range(10):
+            self.make_message(messageset, sequence_number=i)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.delete('/messageset/%s/' % messageset.id)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(Message.objects.count(), 0)
+        self.assertEqual(
+            len([q for q in ctx.captured_queries
+                 if 'DELETE FROM "contentstore_message"' in q['sql']]), 1)
+
+
+class TestCollectBinaryContent(ContentStoreServerTestCase):
+
+    def collect(self, **options):
+        stdout = six.StringIO()
+        call_command('collect_binarycontent', stdout=stdout,
+                     stderr=six.StringIO(), **options)
+        return stdout.getvalue()
+
+    def test_collect(self):
+        used = self.make_binary_content()
+        unused = [self.make_binary_content() for i in range(3)]
+        self.make_message(self.make_messageset(), binary_content=used)
+        storage = used.content.storage
+        size = sum(storage.size(b.content.name) for b in unused)
+
+        self.assertTrue('0 unused' in self.collect())
+        output = self.collect(older_than=0, batch_size=2, dry_run=True)
+        self.assertTrue('3 unused binary contents found, %s bytes' % size
+                        in output)
+        self.assertEqual(BinaryContent.objects.count(), 4)
+
+        output = self.collect(older_than=0, batch_size=2)
+        self.assertTrue('3 unused binary contents deleted, %s bytes freed'
+                        % size in output)
+        self.assertEqual(list(BinaryContent.objects.all()), [used])
+        self.assertTrue(storage.exists(used.content.name))
+        for binary_content in unused:
+            self.assertFalse(storage.exists(binary_content.content.name))
+        self.assertEqual(Change.objects.filter(
+            model="binarycontent", action=Change.DELETED).count(), 3)
+
+    def test_rows_locked_before_use_checked(self):
+        self.make_binary_content()
+        with CaptureQueriesContext(connection) as ctx:
+            collect_binary_content(timezone.now())
+        queries = [q['sql'] for q in ctx.captured_queries]
+        lock = [i for i, sql in enumerate(queries)
+                if 'FROM "contentstore_binarycontent" WHERE' in sql and
+                '"contentstore_binarycontent"."id" IN' in sql]
+        check = [i for i, sql in enumerate(queries)
+                 if 'FROM "contentstore_message" WHERE' in sql and
+                 '"binary_content_id" IN' in sql]
+        self.assertTrue(lock and check)
+        self.assertTrue(lock[0] < check[0])
+        if connection.features.has_select_for_update:
+            self.assertTrue('FOR UPDATE' in queries[lock[0]])
+
+    def test_published_and_bundled_files_kept(self):
+        published = self.make_binary_content()
+        bundled = self.make_binary_content()
+        messageset = self.make_messageset()
+        message = self.make_message(messageset, binary_content=published)
+        MessageSetVersion.objects.publish(messageset.id)
+        message.binary_content = bundled
+        message.save()
+        MessageSetBundle.objects.rebuild_stale()
+        message.binary_content = None
+        message.save()
+
+        output = self.collect(older_than=0)
+        self.assertTrue('0 unused binary contents deleted' in output)
+        MessageSetBundle.objects.rebuild_stale()
+        output = self.collect(older_than=0)
+        self.assertTrue('1 unused binary contents deleted' in output)
+        self.assertEqual(list(BinaryContent.objects.all()), [published])
+        self.assertTrue(
+            published.content.storage.exists(published.content.name))
+
+    def test_shared_file_kept(self):
+        used = self.make_binary_content()
+        self.make_message(self.make_messageset(), binary_content=used)
+        BinaryContent.objects.create(content=used.content.name)
+        output = self.collect(older_than=0)
+        self.assertTrue('1 unused binary contents deleted, 0 bytes' in output)
+        self.assertTrue(used.content.storage.exists(used.content.name))
+
+
+class TestBinaryContentChecksums(ContentStoreServerTestCase):
+
+    def png(self):
+        return pkg_resources.resource_stream('contentstore', 'test.png')
+
+    def test_checksum_on_upload(self):
+        binary_content = self.make_binary_content()
+        expected = hashlib.sha256(self.png().read()).hexdigest()
+        self.assertEqual(binary_content.checksum, expected)
+        content = self.get_json('/binarycontent/?checksum=%s' % (expected,))
+        self.assertEqual([b["id"] for b in content], [binary_content.id])
+        self.assertEqual(content[0]["checksum"], expected)
+        self.assertEqual(self.get_json('/binarycontent/?checksum=abc'), [])
+
+    def test_checksum_on_replace(self):
+        binary_content = self.make_binary_content()
+        response = self.client.patch(
+            '/binarycontent/%s/' % (binary_content.id,),
+            {"content": ContentFile(b"not a png", name="other.png")},
+            format='multipart')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(BinaryContent.objects.get().checksum,
+                         hashlib.sha256(b"not a png").hexdigest())
+
+    def test_streamed_upload(self):
+        upload = MultipartUpload('content', self.png())
+        response = self.client.post('/binarycontent/', upload.read(),
+                                    content_type=upload.content_type)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(json.loads(response.content)["checksum"],
+                         hashlib.sha256(self.png().read()).hexdigest())
+
+
+class TestUploadSpool(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestUploadSpool, self).setUp()
+        self.spool_dir = tempfile.mkdtemp()
+        self.backend_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool_dir)
+        self.addCleanup(shutil.rmtree, self.backend_dir)
+        self.backend = FileSystemStorage(location=self.backend_dir,
+                                         base_url='/media/')
+        self.storage = SpooledStorage(backend=self.backend,
+                                      location=self.spool_dir)
+        field = BinaryContent._meta.get_field('content')
+        self.addCleanup(setattr, field, 'storage', field.storage)
+        field.storage = self.storage
+
+    def flush(self, **options):
+        stdout = six.StringIO()
+        call_command('flush_upload_spool', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_upload_is_spooled(self):
+        binary_content = self.make_binary_content()
+        name = binary_content.content.name
+        self.assertTrue(self.storage.spool.exists(name))
+        self.assertFalse(self.backend.exists(name))
+        self.assertEqual(binary_content.content.url, '/spooled/' + name)
+        [content] = self.get_json('/binarycontent/')
+        self.assertEqual(content["content"],
+                         'http://testserver/spooled/' + name)
+        binary_content.content.open()
+        self.assertEqual(binary_content.content.read(8), b'\x89PNG\r\n\x1a\n')
+        binary_content.content.close()
+
+    def test_spooled_urls_work_before_and_after_flush(self):
+        binary_content = self.make_binary_content()
+        name = binary_content.content.name
+        url = binary_content.content.url
+        client = APIClient()  # No credentials, as for the backend.
+        response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(b''.join(response.streaming_content)[:8],
+                         b'\x89PNG\r\n\x1a\n')
+        flush_spool(self.storage, min_age=0)
+        self.assertEqual(self.storage.url(name), '/media/' + name)
+        response = client.get(url)
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(response['Location'].endswith('/media/' + name))
+
+    def test_flush(self):
+        binary_content = self.make_binary_content()
+        name = binary_content.content.name
+        size = self.storage.size(name)
+        self.assertTrue('0 spooled files moved' in self.flush())
+        output = self.flush(min_age=0)
+        self.assertTrue('1 spooled files moved, %s bytes.' % (size,)
+                        in output)
+        self.assertFalse(self.storage.spool.exists(name))
+        self.assertTrue(self.backend.exists(name))
+        self.assertEqual(self.storage.size(name), size)
+
+    def test_names_free_in_both(self):
+        self.backend.save('taken.png', ContentFile(b'png'))
+        name = self.storage.save('taken.png', ContentFile(b'png'))
+        self.assertNotEqual(name, 'taken.png')
+        self.assertEqual(flush_spool(self.storage, min_age=0), (1, 3))
+
+    def test_delete(self):
+        name = self.storage.save('a.png', ContentFile(b'png'))
+        self.storage.delete(name)
+        self.assertFalse(self.storage.exists(name))
+
+    def test_not_spooled(self):
+        field = BinaryContent._meta.get_field('content')
+        field.storage = self.backend
+        self.assertRaises(CommandError, self.flush)
+        response = APIClient().get('/spooled/missing.png')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CONTENTSTORE_READ_REPLICAS=['replica1', 'replica2'])
+class TestReadReplicas(ContentStoreServerTestCase):
+
+    multi_db = True
+
+    def setUp(self):
+        super(TestReadReplicas, self).setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def schedule_hours(self):
+        return [s['hour'] for s in self.get_json('/schedule/')]
+
+    def test_reads_from_replicas(self):
+        self.make_schedule(hour="1")
+        self.assertEqual(self.schedule_hours(), [])
+        Schedule.objects.using('replica1').create(hour="2")
+        Schedule.objects.using('replica2').create(hour="2")
+        self.assertEqual(self.schedule_hours(), ["2"])
+        self.assertEqual(get_read_database(), None)
+
+    def test_reads_own_writes(self):
+        response = self.client.post('/schedule/', {"hour": "3"},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.schedule_hours(), ["3"])
+
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=other).key)
+        self.assertEqual(client.get('/schedule/').data, [])
+
+        cache.clear()
+        self.assertEqual(self.schedule_hours(), [])
+
+    def test_pinned_per_token(self):
+        response = self.client.post('/schedule/', {"hour": "3"},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.schedule_hours(), ["3"])
+        # The same user, without the token that wrote, reads a replica.
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(
+            b'testuser:testpass').decode('ascii'))
+        self.assertEqual(client.get('/schedule/').data, [])
+
+    def test_writes_go_to_primary(self):
+        schedule = Schedule.objects.using('replica1').create(hour="4")
+        schedule.hour = "5"
+        schedule.save()
+        self.assertEqual(
+            list(Schedule.objects.values_list('hour', flat=True)), ["5"])
+        self.assertEqual(
+            Schedule.objects.using('replica1').get().hour, "4")
+
+    @override_settings(CONTENTSTORE_READ_REPLICAS=[])
+    def test_no_replicas(self):
+        self.make_schedule(hour="1")
+        self.assertEqual(self.schedule_hours(), ["1"])
+
+
+class TestSearch(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestSearch, self).setUp()
+        self.messageset = self.make_messageset()
+        self.other = self.make_messageset(short_name="other set")
+        self.make_message(self.messageset, sequence_number=1,
+                          text_content="Drink clean water every day")
+        self.make_message(self.messageset, sequence_number=2,
+                          text_content="Water, water and more water")
+        self.make_message(self.messageset, sequence_number=3,
+                          text_content="Visit the clinic")
+        self.make_message(self.messageset, sequence_number=1, lang="afr_ZA",
+                          text_content="Drink skoon water")
+        self.make_message(self.other, text_content="Boil water first")
+
+    def search(self, query, **params):
+        params['q'] = query
+        return self.get_json('/message/search/', data=params)
+
+    def texts(self, results):
+        return [r['text_content'] for r in results['results']]
+
+    def test_ranked(self):
+        results = self.search("water")
+        self.assertEqual(results['count'], 4)
+        self.assertEqual(self.texts(results)[0],
+                         "Water, water and more water")
+        ranks = [r['rank'] for r in results['results']]
+        self.assertEqual(ranks, sorted(ranks, reverse=True))
+
+    def test_all_words_match(self):
+        self.assertEqual(self.texts(self.search("clean water")),
+                         ["Drink clean water every day"])
+        self.assertEqual(self.search('clean "OR* clinic')['count'], 0)
+
+    def test_filters(self):
+        self.assertEqual(
+            self.texts(self.search("water", lang="afr_ZA")),
+            ["Drink skoon water"])
+        self.assertEqual(
+            self.texts(self.search("water", messageset=self.other.id)),
+            ["Boil water first"])
+
+    def test_pagination(self):
+        first = self.search("water", page_size=3)
+        self.assertEqual(len(first['results']), 3)
+        self.assertTrue('page=2' in first['next'])
+        second = self.search("water", page_size=3, page=2)
+        self.assertEqual(len(second['results']), 1)
+        self.assertEqual(second['next'], None)
+
+    def test_index_follows_writes(self):
+        message = Message.objects.get(text_content="Visit the clinic")
+        message.text_content = "Visit the hospital"
+        message.save()
+        self.assertEqual(self.search("clinic")['count'], 0)
+        self.assertEqual(self.search("hospital")['count'], 1)
+        message.delete()
+        self.assertEqual(self.search("hospital")['count'], 0)
+        clone_track(self.messageset, "eng_GB", "zul_ZA")
+        self.assertEqual(self.search("water", lang="zul_ZA")['count'], 2)
+
+    def test_query_required(self):
+        response = self.client.get('/message/search/')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.search("!!")['count'], 0)
+
+
+class TestThrottling(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestThrottling, self).setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+        # The start of a minute long window.
+        self.now = 1020.0
+        self.patch_timer()
+
+    def patch_timer(self):
+        original = SlidingWindowThrottle.timer
+        SlidingWindowThrottle.timer = lambda throttle: self.now
+        self.addCleanup(setattr, SlidingWindowThrottle, 'timer', original)
+
+    def get_status(self, path, client=None):
+        return (client or self.client).get(path).status_code
+
+    @override_settings(CONTENTSTORE_THROTTLE_RATES={'user': '3/min'})
+    def test_user_budget(self):
+        self.now += 40
+        for i in range(3):
+            self.assertEqual(self.get_status('/schedule/'), 200)
+        response = self.client.get('/message/')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+
+        other = User.objects.create_user('other', 'other@example.com', 'pw')
+        client = APIClient()
+        client.credentials(
+            HTTP_AUTHORIZATION='Token ' + Token.objects.create(user=other).key)
+        self.assertEqual(self.get_status('/schedule/', client), 200)
+
+    @override_settings(CONTENTSTORE_THROTTLE_RATES={'user': '2/min'})
+    def test_budget_per_token(self):
+        for i in range(2):
+            self.assertEqual(self.get_status('/schedule/'), 200)
+        self.assertEqual(self.get_status('/schedule/'), 429)
+        # The same user, without that token, has a budget of its own.
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(
+            b'testuser:testpass').decode('ascii'))
+        self.assertEqual(self.get_status('/schedule/', client), 200)
+
+    @override_settings(CONTENTSTORE_THROTTLE_RATES={'user': '4/min'})
+    def test_sliding_window(self):
+        for i in range(4):
+            self.assertEqual(self.get_status('/schedule/'), 200)
+        # Halfway into the next minute half the old requests still count.
+        self.now += 90
+        self.assertEqual(self.get_status('/schedule/'), 200)
+        self.assertEqual(self.get_status('/schedule/'), 200)
+        self.assertEqual(self.get_status('/schedule/'), 429)
+        self.now += 60
+        self.assertEqual(self.get_status('/schedule/'), 200)
+
+    @override_settings(CONTENTSTORE_THROTTLE_RATES={
+        'route': '100/min', 'messageset-messages.retrieve': '25/min'})
+    def test_route_budgets_and_costs(self):
+        messageset = self.make_messageset()
+        path = '/messageset/%s/messages' % messageset.id
+        self.assertEqual(self.get_status(path), 200)
+        self.assertEqual(self.get_status(path), 200)
+        self.assertEqual(self.get_status(path), 429)
+        for i in range(10):
+            self.assertEqual(self.get_status('/message/'), 200)
+        self.assertEqual(self.get_status('/message/'), 429)
+        self.assertEqual(self.get_status('/schedule/'), 200)
+
+    @override_settings(CONTENTSTORE_THROTTLE_RATES={'user': '10/min'},
+                       CONTENTSTORE_THROTTLE_COSTS={'schedule.list': 6})
+    def test_cost_setting(self):
+        self.assertEqual(self.get_status('/schedule/'), 200)
+        self.assertEqual(self.get_status('/schedule/'), 429)
+        self.assertEqual(self.get_status('/message/1/'), 404)
+
+    @override_settings(CONTENTSTORE_MAX_CONCURRENT_REQUESTS=1)
+    def test_concurrency(self):
+        key = 'contentstore:concurrency:token:%s' % (
+            hashlib.sha256(self.token.encode('ascii')).hexdigest(),)
+        self.assertEqual(self.get_status('/schedule/'), 200)
+        self.assertEqual(self.get_status('/schedule/'), 200)
+        cache.set(key, 1)
+        self.assertEqual(self.get_status('/schedule/'), 429)
+        cache.set(key, 0)
+        self.assertEqual(self.get_status('/schedule/'), 200)
+        self.assertEqual(cache.get(key), 0)
+
+
+class TestCachedTokenAuthentication(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestCachedTokenAuthentication, self).setUp()
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_cached(self):
+        self.assertEqual(self.client.get('/schedule/').status_code, 200)
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self.client.get('/schedule/').status_code, 200)
+        self.assertFalse(any('authtoken_token' in q['sql']
+                             for q in ctx.captured_queries))
+
+    def test_deleted_token(self):
+        self.assertEqual(self.client.get('/schedule/').status_code, 200)
+        Token.objects.get(key=self.token).delete()
+        self.assertEqual(self.client.get('/schedule/').status_code, 401)
+
+    def test_deactivated_user(self):
+        self.assertEqual(self.client.get('/schedule/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/schedule/').status_code, 401)
+
+    def test_invalid_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION='Token nope')
+        self.assertEqual(self.client.get('/schedule/').status_code, 401)
+
+
+class TestTemplates(ContentStoreServerTestCase):
+
+    def render(self, message, variables):
+        return self.client.post(
+            '/message/%s/render/' % (message.id,),
+            json.dumps({"variables": variables}),
+            content_type='application/json')
+
+    def test_compile_template(self):
+        self.assertEqual(
+            compile_template(u"Hi {{ name }}, {x} {{name}} {{ due_date }}"),
+            (u"Hi {name}, {{x}} {name} {due_date}", ["name", "due_date"]))
+        for text in (u"Hi {{ name", u"Hi name }}", u"{{ 1name }}",
+                     u"{{ a.b }}", u"{{ }}"):
+            self.assertRaises(TemplateError, compile_template, text)
+
+    def test_compiled_on_save(self):
+        message = self.make_message(
+            self.make_messageset(), text_content="Hi {{ name }} {{ clinic }}")
+        self.assertEqual(message.compiled_text, "Hi {name} {clinic}")
+        self.assertEqual(message.placeholders, "name,clinic")
+        message.text_content = "Plain"
+        message.save()
+        self.assertEqual(Message.objects.get(pk=message.pk).placeholders, "")
+
+    def test_invalid_template_rejected(self):
+        messageset = self.make_messageset()
+        response = self.client.post('/message/', {
+            "messageset": messageset.id, "sequence_number": 1,
+            "lang": "eng_GB", "text_content": "Hi {{ name"}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue('text_content' in response.data)
+
+    def test_render(self):
+        message = self.make_message(
+            self.make_messageset(),
+            text_content=u"Hi {{ name }}, {x} due {{ due_date }} \xe9")
+        response = self.render(message, [
+            {"name": "Thandi", "due_date": "2015-06-01"},
+            {"name": "Sipho", "due_date": 3, "extra": "ignored"},
+            {"name": "{{ due_date }}"},
+        ])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            "placeholders": ["name", "due_date"],
+            "results": [
+                {"text": u"Hi Thandi, {x} due 2015-06-01 \xe9"},
+                {"text": u"Hi Sipho, {x} due 3 \xe9"},
+                {"error": "Missing variable due_date."},
+            ],
+        })
+
+    def test_render_bad_requests(self):
+        message = self.make_message(self.make_messageset())
+        self.assertEqual(self.render(message, {"a": 1}).status_code, 400)
+        self.assertEqual(self.render(message, ["a"]).status_code, 400)
+        message.id = 999
+        self.assertEqual(self.render(message, []).status_code, 404)
+
+    def test_imported_and_cloned_messages_compiled(self):
+        messageset = self.make_messageset()
+        Importer('message').run([(1, {
+            "messageset": str(messageset.id), "sequence_number": "1",
+            "lang": "eng_GB", "text_content": "Hi {{ name }}",
+            "binary_content": ""})])
+        clone_track(messageset, "eng_GB", "zul_ZA")
+        self.assertEqual(
+            list(Message.objects.values_list('compiled_text', flat=True)),
+            ["Hi {name}", "Hi {name}"])
+
+
+class TestSmsSegments(ContentStoreServerTestCase):
+
+    def test_count_segments(self):
+        cases = [
+            (u"", ("gsm7", 0)),
+            (u"x" * 160, ("gsm7", 1)),
+            (u"x" * 161, ("gsm7", 2)),
+            (u"x" * 306, ("gsm7", 2)),
+            (u"x" * 307, ("gsm7", 3)),
+            # Extension characters take two septets.
+            (u"\u20ac" * 80, ("gsm7", 1)),
+            (u"\u20ac" * 81, ("gsm7", 2)),
+            # ...and aren't split across segments.
+            (u"x" * 152 + u"[" + u"x" * 152, ("gsm7", 3)),
+            (u"\xe9\u0394\n", ("gsm7", 1)),
+            (u"\u0101" * 70, ("ucs2", 1)),
+            (u"\u0101" * 71, ("ucs2", 2)),
+            # Characters outside the BMP take two UTF-16 code units.
+            (u"\U0001f600" * 35, ("ucs2", 1)),
+            (u"x" * 69 + u"\U0001f600", ("ucs2", 2)),
+        ]
+        for text, expected in cases:
+            self.assertEqual(count_segments(text), expected)
+
+    def test_counted_on_save(self):
+        messageset = self.make_messageset()
+        message = self.make_message(
+            messageset, text_content="Hi {{ name }}" + "x" * 157)
+        self.assertEqual((message.encoding, message.segments), ("gsm7", 1))
+        message.text_content = u"Hi \u263a"
+        message.save()
+        message = Message.objects.get(pk=message.pk)
+        self.assertEqual((message.encoding, message.segments), ("ucs2", 1))
+        message.text_content = None
+        message.binary_content = self.make_binary_content()
+        message.save()
+        self.assertEqual((message.encoding, message.segments), ("", 0))
+
+    def test_imported_and_cloned_messages_counted(self):
+        messageset = self.make_messageset()
+        Importer('message').run([(1, {
+            "messageset": str(messageset.id), "sequence_number": "1",
+            "lang": "eng_GB", "text_content": "x" * 200,
+            "binary_content": ""})])
+        clone_track(messageset, "eng_GB", "zul_ZA")
+        self.assertEqual(
+            list(Message.objects.values_list('encoding', 'segments')),
+            [("gsm7", 2), ("gsm7", 2)])
+
+    def test_filter_segments(self):
+        messageset = self.make_messageset()
+        short = self.make_message(messageset, text_content="Short")
+        long_ = self.make_message(messageset, sequence_number=2,
+                                  text_content="x" * 400)
+        unicode_ = self.make_message(messageset, sequence_number=3,
+                                     text_content=u"\u0101" * 100)
+
+        def ids(params):
+            response = self.client.get('/message/', params)
+            self.assertEqual(response.status_code, 200)
+            return sorted(m["id"] for m in response.data)
+
+        self.assertEqual(ids({"min_segments": 2}),
+                         sorted([long_.id, unicode_.id]))
+        self.assertEqual(ids({"max_segments": 2}),
+                         sorted([short.id, unicode_.id]))
+        self.assertEqual(ids({"encoding": "ucs2"}), [unicode_.id])
+        self.assertEqual(ids({"segments": 3}), [long_.id])
+        response = self.client.get('/message/%s/' % (long_.id,))
+        self.assertEqual(
+            (response.data["encoding"], response.data["segments"]),
+            ("gsm7", 3))
+
+    def test_segment_totals(self):
+        messageset = self.make_messageset()
+        other = self.make_messageset(short_name="other")
+        self.make_message(messageset, text_content="Short")
+        self.make_message(messageset, sequence_number=2,
+                          text_content="x" * 400)
+        self.make_message(messageset, sequence_number=3,
+                          text_content=u"\u0101" * 100)
+        self.make_message(messageset, sequence_number=4, text_content=None,
+                          binary_content=self.make_binary_content())
+        self.make_message(other, text_content="x" * 400)
+        # The token was cached by the upload in make_binary_content, which
+        # leaves the filter's message set lookup and the aggregate.
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                '/message/segment_totals/', {"messageset": messageset.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {
+            "messages": 3,
+            "segments": 6,
+            "encodings": {
+                "gsm7": {"messages": 2, "segments": 4},
+                "ucs2": {"messages": 1, "segments": 2},
+            },
+        })
+
+
+class TestCrontab(TestCase):
+
+    def at(self, *args):
+        return datetime(*args, tzinfo=timezone.utc)
+
+    def test_parse_field(self):
+        self.assertEqual(parse_field('*/15', 0, 59), set([0, 15, 30, 45]))
+        self.assertEqual(parse_field('1,3, 10-12', 0, 59),
+                         set([1, 3, 10, 11, 12]))
+        self.assertEqual(parse_field('mon-fri', 0, 7, WEEKDAYS),
+                         set([1, 2, 3, 4, 5]))
+        self.assertEqual(parse_field('20/20', 0, 59), set([20, 40]))
+        for value in ('60', 'x', '5-1', '*/0'):
+            self.assertRaises(ScheduleError, parse_field, value, 0, 59)
+
+    def test_next_run(self):
+        daily = Crontab(minute='0', hour='8')
+        self.assertEqual(daily.next_run(self.at(2015, 1, 1, 9, 30)),
+                         self.at(2015, 1, 2, 8, 0))
+        self.assertEqual(daily.next_run(self.at(2015, 1, 2, 8, 0)),
+                         self.at(2015, 1, 2, 8, 0))
+        self.assertEqual(daily.next_run(self.at(2015, 1, 2, 8, 0, 1)),
+                         self.at(2015, 1, 3, 8, 0))
+        weekly = Crontab(minute='30', hour='9', day_of_week='sun,thu')
+        self.assertEqual(weekly.next_run(self.at(2015, 6, 1)),
+                         self.at(2015, 6, 4, 9, 30))
+        self.assertEqual(weekly.next_run(self.at(2015, 6, 5)),
+                         self.at(2015, 6, 7, 9, 30))
+        quarterly = Crontab(minute='0', hour='0', day_of_month='1',
+                            month_of_year='*/3')
+        self.assertEqual(quarterly.next_run(self.at(2015, 1, 2)),
+                         self.at(2015, 4, 1))
+
+    def test_never_runs(self):
+        crontab = Crontab(day_of_month='30', month_of_year='feb')
+        self.assertRaises(ScheduleError, crontab.next_run,
+                          self.at(2015, 1, 1))
+
+
+class TestTimeline(ContentStoreServerTestCase):
+
+    def setUp(self):
+        super(TestTimeline, self).setUp()
+        cache.clear()
+        self.second = self.make_messageset(
+            short_name="second", default_schedule=self.make_schedule(
+                minute="0", hour="8"))
+        self.first = self.make_messageset(
+            short_name="first", next_set=self.second,
+            default_schedule=self.make_schedule(
+                minute="0", hour="9", day_of_week="1,4"))
+        for number in (1, 2, 3):
+            self.make_message(self.first, sequence_number=number)
+        for number in (1, 2):
+            self.make_message(self.second, sequence_number=number)
+        self.make_message(self.second, sequence_number=3, lang="afr_ZA")
+
+    def timeline(self, **params):
+        params.setdefault("start", "2015-06-01T10:00:00Z")
+        params.setdefault("lang", "eng_GB")
+        return self.get_json('/messageset/%s/timeline/?%s' % (
+            self.first.id, urlencode(params)))
+
+    def sends(self, content):
+        return [(s["messageset"], s["sequence_number"], s["send_at"])
+                for s in content["sends"]]
+
+    def test_timeline(self):
+        content = self.timeline()
+        first, second = self.first.id, self.second.id
+        self.assertEqual(self.sends(content), [
+            (first, 1, "2015-06-04T09:00:00Z"),
+            (first, 2, "2015-06-08T09:00:00Z"),
+            (first, 3, "2015-06-11T09:00:00Z"),
+            (second, 1, "2015-06-12T08:00:00Z"),
+            (second, 2, "2015-06-13T08:00:00Z"),
+        ])
+        self.assertEqual(content["finishes_at"], "2015-06-13T08:00:00Z")
+        self.assertEqual(content["start_sequence"], 1)
+        self.assertEqual(content["lang"], "eng_GB")
+
+    def test_start_sequence_and_lang(self):
+        content = self.timeline(start_sequence=3)
+        self.assertEqual(self.sends(content), [
+            (self.first.id, 3, "2015-06-04T09:00:00Z"),
+            (self.second.id, 1, "2015-06-05T08:00:00Z"),
+            (self.second.id, 2, "2015-06-06T08:00:00Z"),
+        ])
+        content = self.timeline(lang="afr_ZA")
+        self.assertEqual(self.sends(content), [
+            (self.second.id, 3, "2015-06-05T08:00:00Z")])
+
+    def test_cached_per_first_run(self):
+        with CaptureQueriesContext(connection) as uncached:
+            expected = self.timeline()
+        with CaptureQueriesContext(connection) as cached:
+            content = self.timeline(start="2015-06-03T12:00:00+02:00")
+        self.assertEqual(content, expected)
+        self.assertTrue(len(cached) < len(uncached))
+
+        self.make_message(self.second, sequence_number=4)
+        content = self.timeline()
+        self.assertEqual(content["finishes_at"], "2015-06-14T08:00:00Z")
+
+    def test_looping_chain(self):
+        self.second.next_set = self.first
+        self.second.save()
+        content = self.timeline()
+        self.assertEqual(len(content["sends"]), 5)
+
+    def test_bad_params(self):
+        response = self.client.get(
+            '/messageset/%s/timeline/?lang=eng_GB' % (self.first.id,))
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            '/messageset/%s/timeline/?start=2015-06-01T10:00:00Z' % (
+                self.first.id,))
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue("lang" in json.loads(response.content))
+        response = self.client.get(
+            '/messageset/%s/timeline/?start=2015-06-01T10:00:00Z'
+            '&lang=eng_GB&start_sequence=0' % (self.first.id,))
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(CONTENTSTORE_CHANGES_SETTLE_SECONDS=60)
+    def test_cache_follows_settled_changes(self):
+        def settle():
+            Change.objects.update(
+                created_at=timezone.now() - timedelta(minutes=5))
+        settle()
+        self.assertEqual(self.timeline()["finishes_at"],
+                         "2015-06-13T08:00:00Z")
+        self.make_message(self.second, sequence_number=4)
+        self.assertEqual(self.timeline()["finishes_at"],
+                         "2015-06-13T08:00:00Z")
+        settle()
+        self.assertEqual(self.timeline()["finishes_at"],
+                         "2015-06-14T08:00:00Z")
+
+    def test_bad_schedule(self):
+        Schedule.objects.filter(pk=self.first.default_schedule_id).update(
+            minute="75")
+        response = self.client.get(
+            '/messageset/%s/timeline/?start=2015-06-01T10:00:00Z'
+            '&lang=eng_GB' % (self.first.id,))
+        self.assertEqual(response.status_code, 400)
+        self.assertTrue("default_schedule" in json.loads(response.content))
+
+
+class TestCompression(ContentStoreServerTestCase):
+
+    def make_long_messageset(self):
+        messageset = self.make_messageset()
+        for seq in range(20):
+            self.make_message(
+                messageset, sequence_number=seq,
+                text_content="Message %s: remember to drink clean water "
+                             "and to visit the clinic." % (seq,))
+        return messageset
+
+    def gunzip(self, content):
+        return zlib.decompress(content, 16 + zlib.MAX_WBITS)
+
+    def test_choose_encoding(self):
+        self.assertEqual(parse_accept_encoding("gzip;q=0.5, br, *;q=0"),
+                         {"gzip": 0.5, "br": 1.0, "*": 0.0})
+        encodings = ("br", "gzip")
+        self.assertEqual(choose_encoding("gzip, deflate", encodings), "gzip")
+        self.assertEqual(choose_encoding("gzip, br", encodings), "br")
+        self.assertEqual(choose_encoding("gzip, br;q=0.1", encodings),
+                         "gzip")
+        self.assertEqual(choose_encoding("*", encodings), "br")
+        self.assertEqual(choose_encoding("gzip;q=0, identity", encodings),
+                         None)
+        self.assertEqual(choose_encoding("", encodings), None)
+        self.assertEqual(choose_encoding(None, encodings), None)
+
+    def test_compressed(self):
+        messageset = self.make_long_messageset()
+        path = '/messageset/%s/messages' % (messageset.id,)
+        plain = self.client.get(path)
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertEqual(plain['Vary'], 'Accept, Accept-Encoding')
+
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(int(response['Content-Length']),
+                         len(response.content))
+        self.assertTrue(len(response.content) < len(plain.content) / 3)
+        self.assertEqual(self.gunzip(response.content), plain.content)
+
+    def test_small_responses_not_compressed(self):
+        message = self.make_message(self.make_messageset())
+        response = self.client.get('/message/%s/' % (message.id,),
+                                   HTTP_ACCEPT_ENCODING='gzip')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with override_settings(CONTENTSTORE_COMPRESS_MIN_LENGTH=10):
+            response = self.client.get('/message/%s/' % (message.id,),
+                                       HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_weak_etag_matches(self):
+        messageset = self.make_long_messageset()
+        path = '/messageset/%s/bundles/eng_GB' % (messageset.id,)
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['ETag'], 'W/"%s-eng_GB-20"' % (
+            messageset.id,))
+        response = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip',
+                                   HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    @override_settings(CONTENTSTORE_COMPRESS_CACHE_SECONDS=60)
+    def test_cached_bodies(self):
+        cache.clear()
+        messageset = self.make_long_messageset()
+        path = '/messageset/%s/bundles/eng_GB' % (messageset.id,)
+        first = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+        plain = self.gunzip(first.content)
+        key = 'contentstore:compressed:gzip:%s' % (
+            hashlib.sha1(plain).hexdigest(),)
+        self.assertEqual(cache.get(key), first.content)
+        cache.set(key, b'cached body')
+        second = self.client.get(path, HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(second.content, b'cached body')
+
+
+@unittest.skipIf(msgpack is None, "msgpack is not installed")
+class TestMessagePack(ContentStoreServerTestCase):
+
+    def unpack(self, response):
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+        return msgpack.unpackb(response.content, raw=False)
+
+    def test_render(self):
+        messageset = self.make_messageset()
+        message = self.make_message(messageset, text_content=u"Sawubona \xe9")
+        response = self.client.get('/message/%s/' % (message.id,),
+                                   HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(self.unpack(response),
+                         json.loads(json.dumps(MessageSerializer(
+                             message).data)))
+        response = self.client.get('/messageset/%s/messages' % (
+            messageset.id,), HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(self.unpack(response)["messages"][0]["text_content"],
+                         u"Sawubona \xe9")
+        response = self.client.get('/changes/',
+                                   HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(len(self.unpack(response)["changes"]), 3)
+
+    def test_precompiled_documents(self):
+        messageset = self.make_messageset()
+        self.make_message(messageset, text_content=u"Sawubona \xe9")
+        MessageSetVersion.objects.publish(messageset.id)
+        for path in ('/messageset/%s/bundles/eng_GB',
+                     '/messageset/%s/versions/1',
+                     '/messageset/%s/versions/1/eng_GB'):
+            path = path % (messageset.id,)
+            response = self.client.get(path)
+            self.assertEqual(response['Content-Type'], 'application/json')
+            expected = json.loads(response.content)
+            etag = response['ETag']
+            self.assertTrue('Accept' in response['Vary'])
+            response = self.client.get(path,
+                                       HTTP_ACCEPT='application/msgpack')
+            self.assertEqual(self.unpack(response), expected)
+            self.assertTrue('Accept' in response['Vary'])
+            packed_etag = response['ETag']
+            self.assertNotEqual(packed_etag, etag)
+            # A validator for one format doesn't revalidate the other.
+            response = self.client.get(path, HTTP_IF_NONE_MATCH=packed_etag)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(path, HTTP_ACCEPT='application/msgpack',
+                                       HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            response = self.client.get(path, HTTP_ACCEPT='application/msgpack',
+                                       HTTP_IF_NONE_MATCH=packed_etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], packed_etag)
+            self.assertTrue('Accept' in response['Vary'])
+
+    def test_json_by_default(self):
+        response = self.client.get('/message/')
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+    def test_parse(self):
+        messageset = self.make_messageset()
+        response = self.client.post(
+            '/message/', msgpack.packb({
+                "messageset": messageset.id, "sequence_number": 1,
+                "lang": "eng_GB", "text_content": u"Hi \u263a"},
+                use_bin_type=True),
+            content_type='application/msgpack',
+            HTTP_ACCEPT='application/msgpack')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.unpack(response)["text_content"], u"Hi \u263a")
+
+        response = self.client.post('/message/', b'\xc1',
+                                    content_type='application/msgpack')
+        self.assertEqual(response.status_code, 400)
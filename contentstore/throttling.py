@@ -0,0 +1,178 @@
+"""
+Request throttling for the contentstore API, keyed by client token.
+
+``SlidingWindowThrottle`` enforces an overall budget per client and a
+budget per client and route, weighting expensive routes with a cost.
+Usage is counted in the cache as a pair of fixed windows, with the
+previous window's count weighted by how much of it still overlaps the
+sliding window, so a check costs one ``get_many`` and an ``incr`` per
+budget. ``ConcurrencyThrottle`` caps how many requests a client can have
+in flight at once.
+
+Both are configured in the settings and do nothing until they are::
+
+    CONTENTSTORE_THROTTLE_RATES = {
+        'user': '6000/min',
+        'route': '1200/min',
+        'message.list': '60/min',
+    }
+    CONTENTSTORE_THROTTLE_COSTS = {'message.list': 10}
+    CONTENTSTORE_MAX_CONCURRENT_REQUESTS = 8
+
+The counters need a cache shared by every worker, such as memcached.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache as default_cache
+from django.utils.encoding import force_bytes
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """
+        Turns ``'<requests>/<period>'`` into the number of requests and the
+        period in seconds, as DRF's throttles do.
+    """
+    num, period = rate.split('/')
+    return int(num), PERIODS[period[0]]
+
+
+def get_client(request, throttle):
+    """
+        The API token the request authenticated with, or for other kinds of
+        authentication its user, or else its address.
+    """
+    key = getattr(request.auth, 'key', None)
+    if key is not None:
+        # Token keys are credentials, so keep them out of the cache.
+        return 'token:%s' % (hashlib.sha256(force_bytes(key)).hexdigest(),)
+    if request.user and request.user.is_authenticated():
+        return 'user:%s' % (request.user.pk,)
+    return 'ip:%s' % (throttle.get_ident(request),)
+
+
+def get_route(view):
+    """
+        The view's throttle scope and action, e.g. ``message.list``.
+    """
+    action = getattr(view, 'action', None) or view.request.method.lower()
+    return '%s.%s' % (view.get_throttle_scope(), action)
+
+
+class SlidingWindowThrottle(BaseThrottle):
+
+    """
+    Limits each client to the ``user`` rate across the whole API and to a
+    rate per route, given by the route name or the ``route`` default.
+    Requests count as the route's cost, from ``CONTENTSTORE_THROTTLE_COSTS``
+    or the view's ``throttle_costs``, instead of 1.
+    """
+
+    cache = default_cache
+    timer = time.time
+    cache_format = 'contentstore:throttle:%s:%s:%s'
+
+    def __init__(self):
+        self.rates = getattr(settings, 'CONTENTSTORE_THROTTLE_RATES', {})
+        self.costs = getattr(settings, 'CONTENTSTORE_THROTTLE_COSTS', {})
+        self.wait_seconds = None
+
+    def get_budgets(self, route):
+        rates = [('user', self.rates.get('user')),
+                 (route, self.rates.get(route, self.rates.get('route')))]
+        return [(scope, parse_rate(rate)) for scope, rate in rates if rate]
+
+    def get_cost(self, view, route):
+        if route in self.costs:
+            return self.costs[route]
+        return getattr(view, 'throttle_costs', {}).get(
+            getattr(view, 'action', None), 1)
+
+    def allow_request(self, request, view):
+        if not self.rates:
+            return True
+        route = get_route(view)
+        budgets = self.get_budgets(route)
+        if not budgets:
+            return True
+        cost = self.get_cost(view, route)
+        client = get_client(request, self)
+        now = self.timer()
+
+        windows = []
+        for scope, (limit, duration) in budgets:
+            window, elapsed = divmod(now, duration)
+            windows.append((
+                limit, duration, elapsed,
+                self.cache_format % (scope, client, int(window)),
+                self.cache_format % (scope, client, int(window) - 1)))
+        counts = self.cache.get_many(
+            [key for w in windows for key in w[3:]])
+
+        for limit, duration, elapsed, current, previous in windows:
+            overlap = 1 - elapsed / duration
+            used = counts.get(previous, 0) * overlap + counts.get(current, 0)
+            if used + cost > limit:
+                self.wait_seconds = duration - elapsed
+                return False
+        for limit, duration, elapsed, current, previous in windows:
+            self.add(current, cost, duration * 2)
+        return True
+
+    def add(self, key, amount, timeout):
+        try:
+            self.cache.incr(key, amount)
+        except ValueError:
+            # The window's first request, or its counter just expired.
+            if not self.cache.add(key, amount, timeout):
+                self.cache.incr(key, amount)
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class ConcurrencyThrottle(BaseThrottle):
+
+    """
+    Limits each client to ``CONTENTSTORE_MAX_CONCURRENT_REQUESTS`` requests
+    in flight. Views using it must call the callables it appends to
+    ``view.throttle_releases`` once the response is ready. Counters expire
+    after ``timeout`` seconds in case a worker dies mid request.
+    """
+
+    cache = default_cache
+    cache_format = 'contentstore:concurrency:%s'
+    timeout = 300
+
+    def allow_request(self, request, view):
+        limit = getattr(settings, 'CONTENTSTORE_MAX_CONCURRENT_REQUESTS',
+                        None)
+        if not limit:
+            return True
+        key = self.cache_format % (get_client(request, self),)
+        if self.cache.add(key, 1, self.timeout):
+            count = 1
+        else:
+            try:
+                count = self.cache.incr(key)
+            except ValueError:
+                self.cache.add(key, 1, self.timeout)
+                count = 1
+        if count > limit:
+            self.release(key)
+            return False
+        view.throttle_releases.append(lambda: self.release(key))
+        return True
+
+    def release(self, key):
+        try:
+            self.cache.decr(key)
+        except ValueError:
+            pass
+
+    def wait(self):
+        return 1
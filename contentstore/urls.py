@@ -7,6 +7,7 @@ router.register(r'schedule', views.ScheduleViewSet)
 router.register(r'messageset', views.MessageSetViewSet)
 router.register(r'message', views.MessageViewSet)
 router.register(r'binarycontent', views.BinaryContentViewSet)
+router.register(r'changes', views.ChangeViewSet)
 
 # Wire up our API using automatic URL routing.
 # Additionally, we include login URLs for the browseable API.
@@ -20,4 +21,19 @@ urlpatterns = [
         views.MessagesContentView.as_view({'get': 'retrieve'})),
     url('^messageset/(?P<pk>.+)/messages$',
         views.MessagesetMessagesContentView.as_view({'get': 'retrieve'})),
+    url(r'^messageset/(?P<pk>\d+)/bundles$',
+        views.MessageSetBundleViewSet.as_view({'get': 'list'})),
+    url(r'^messageset/(?P<pk>\d+)/bundles/(?P<lang>[^/]+)$',
+        views.MessageSetBundleViewSet.as_view({'get': 'retrieve'})),
+    url(r'^messageset/(?P<pk>\d+)/versions$',
+        views.MessageSetVersionViewSet.as_view({'get': 'list'})),
+    url(r'^messageset/(?P<pk>\d+)/versions/(?P<number>\d+)$',
+        views.MessageSetVersionViewSet.as_view({'get': 'retrieve'})),
+    url(r'^messageset/(?P<pk>\d+)/versions/(?P<number>\d+)/'
+        r'(?P<lang>[^/]+)$',
+        views.MessageSetVersionViewSet.as_view({'get': 'retrieve'})),
+    url(r'^download/(?P<name>.+)$', views.download,
+        name='contentstore-download'),
+    url(r'^spooled/(?P<name>.+)$', views.spooled,
+        name='contentstore-spooled'),
 ]
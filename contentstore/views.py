@@ -1,12 +1,282 @@
-from .models import Schedule, MessageSet, Message, BinaryContent
-from rest_framework.viewsets import ModelViewSet
-from rest_framework.permissions import IsAuthenticated
+import hashlib
+import json
+import mimetypes
+import time
+from collections import OrderedDict
+
+from .models import (Schedule, MessageSet, Message, BinaryContent,
+                     MessageSetBundle, MessageSetVersion, Change)
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Sum
+from django.http import (FileResponse, Http404, HttpResponse,
+                         HttpResponseForbidden, HttpResponseNotModified,
+                         HttpResponseRedirect)
+from django.utils.cache import patch_vary_headers
+from django.utils.encoding import force_bytes
+from django.views.decorators.http import require_safe
+from rest_framework import status
+from rest_framework.decorators import detail_route, list_route
+from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework.exceptions import ValidationError
+from rest_framework.permissions import (IsAuthenticated, BasePermission,
+                                        SAFE_METHODS)
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from . import replicas, signing
+from .bulk import (clone_track, clone_messagesets, resequence_track,
+                   delete_messagesets)
+from .fastpath import (ValuesPlan, UnsupportedSerializer, file_url,
+                       format_datetime)
+from .filters import MessageFilter
+from .parsers import MessagePackParser
+from .renderers import FastJSONRenderer, MessagePackRenderer, msgpack
+from .schedules import ScheduleError, next_run, send_timeline
+from .search import search_messages
+from .storage import SpooledStorage
+from .templating import render_many
+from .throttling import ConcurrencyThrottle, SlidingWindowThrottle
 from .serializers import (ScheduleSerializer, MessageSetSerializer,
                           MessageSerializer, BinaryContentSerializer,
-                          MessageListSerializer, MessageSetMessagesSerializer)
+                          MessageListSerializer, MessageSetMessagesSerializer,
+                          TrackCloneSerializer, MessageSetCloneSerializer,
+                          TrackResequenceSerializer,
+                          MessageSetDeleteSerializer, TimelineSerializer,
+                          narrow_queryset)
+
+
+class SparseFieldsetViewMixin(object):
+
+    """
+    Narrows the queryset of safe requests to the columns the serializer
+    will render, so ``?fields=`` and ``?omit=`` also shrink database reads.
+    """
+
+    def get_queryset(self):
+        queryset = super(SparseFieldsetViewMixin, self).get_queryset()
+        if self.request.method not in SAFE_METHODS:
+            return queryset
+        return narrow_queryset(queryset, self.get_serializer())
+
+
+def _method_function(method):
+    return getattr(method, '__func__', method)
+
+
+class MessagePackMixin(object):
+
+    """
+    Accepts and renders MessagePack alongside the default formats when the
+    ``msgpack`` package is installed, chosen by ``Content-Type`` and
+    ``Accept``.
+    """
+
+    def get_renderers(self):
+        renderers = super(MessagePackMixin, self).get_renderers()
+        if msgpack is not None:
+            renderers.append(MessagePackRenderer())
+        return renderers
+
+    def get_parsers(self):
+        parsers = super(MessagePackMixin, self).get_parsers()
+        if msgpack is not None:
+            parsers.append(MessagePackParser())
+        return parsers
+
+
+class ValuesReadMixin(object):
+
+    """
+    Serves ``list`` and ``retrieve`` from ``.values()`` rows when the
+    serializer allows it, skipping model instantiation and per-field DRF
+    serialization. Falls back to the regular path for paginators other than
+    :class:`KeysetPagination`, object-level permissions and serializers the
+    fast path can't render.
+    """
+    renderer_classes = tuple(
+        FastJSONRenderer if renderer is JSONRenderer else renderer
+        for renderer in api_settings.DEFAULT_RENDERER_CLASSES)
+    values_rendered = False
+
+    def get_values_plan(self):
+        try:
+            return ValuesPlan(self.get_serializer(), self.queryset.model)
+        except UnsupportedSerializer:
+            return None
+
+    def has_object_permission_checks(self):
+        default = _method_function(BasePermission.has_object_permission)
+        return any(
+            _method_function(type(permission).has_object_permission)
+            is not default for permission in self.get_permissions())
+
+    def list(self, request, *args, **kwargs):
+        plan = self.get_values_plan()
+        paginator = self.paginator
+        if plan is None or not isinstance(
+                paginator, (type(None), KeysetPagination)):
+            return super(ValuesReadMixin, self).list(request, *args, **kwargs)
+        queryset = self.filter_queryset(self.get_queryset())
+        self.values_rendered = True
+        page = None
+        if paginator is not None:
+            page = paginator.get_page_queryset(queryset, request)
+        if page is None:
+            return Response(plan.serialize(queryset))
+        rows = paginator.trim(plan.rows(page), lambda row: row[0][plan.pk])
+        return paginator.get_paginated_response([data for _, data in rows])
+
+    def retrieve(self, request, *args, **kwargs):
+        plan = self.get_values_plan()
+        if plan is None or self.has_object_permission_checks():
+            return super(ValuesReadMixin, self).retrieve(
+                request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset())
+        try:
+            results = plan.serialize(queryset.filter(
+                **{self.lookup_field: self.kwargs[lookup_url_kwarg]}))
+        except (TypeError, ValueError):
+            raise Http404
+        if not results:
+            raise Http404
+        self.values_rendered = True
+        return Response(results[0])
+
+
+class KeysetPagination(BasePagination):
+
+    """
+    Opt-in pagination for walking large lists: ``?limit=<n>`` returns the
+    first ``n`` objects by id as ``{"cursor", "more", "results"}``, and
+    ``?limit=<n>&after=<cursor>`` the next page while ``more`` is true.
+    Pages are found through the primary key index, so late pages cost the
+    same as early ones. Without ``limit`` the whole list is returned.
+    """
+    limit_query_param = 'limit'
+    cursor_query_param = 'after'
+    max_limit = 10000
+
+    def _int_param(self, request, name, default):
+        try:
+            return int(request.query_params.get(name, default))
+        except ValueError:
+            raise ValidationError({name: ['A valid integer is required.']})
+
+    def get_page_queryset(self, queryset, request):
+        """
+            Narrows ``queryset`` to the requested page and the first object
+            after it, or returns ``None`` when no ``limit`` was given.
+        """
+        if self.limit_query_param not in request.query_params:
+            return None
+        self.limit = max(1, min(
+            self._int_param(request, self.limit_query_param, 0),
+            self.max_limit))
+        self.cursor = self._int_param(request, self.cursor_query_param, 0)
+        return queryset.filter(pk__gt=self.cursor).order_by('pk')[
+            :self.limit + 1]
+
+    def trim(self, items, get_pk):
+        """
+            Drops the lookahead object from a page fetched with
+            :meth:`get_page_queryset`, moving the cursor to its last object.
+        """
+        items = list(items)
+        self.more = len(items) > self.limit
+        items = items[:self.limit]
+        if items:
+            self.cursor = get_pk(items[-1])
+        return items
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page = self.get_page_queryset(queryset, request)
+        if page is None:
+            return None
+        return self.trim(page, lambda obj: obj.pk)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('cursor', self.cursor),
+            ('more', self.more),
+            ('results', data),
+        ]))
+
+
+class SearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ThrottledViewMixin(object):
+
+    """
+    Applies the contentstore throttles. ``throttle_scope`` names the view
+    in throttle settings (the model name by default) and ``throttle_costs``
+    weights expensive actions.
+    """
+    throttle_classes = (ConcurrencyThrottle, SlidingWindowThrottle)
+    throttle_scope = None
+    throttle_costs = {}
+
+    def get_throttle_scope(self):
+        return self.throttle_scope or self.queryset.model._meta.model_name
+
+    def dispatch(self, request, *args, **kwargs):
+        self.throttle_releases = []
+        try:
+            return super(ThrottledViewMixin, self).dispatch(
+                request, *args, **kwargs)
+        finally:
+            for release in self.throttle_releases:
+                release()
+
+
+class ReplicaReadMixin(object):
+
+    """
+    Reads safe requests from a read replica, unless the client has written
+    recently, and pins clients to the primary database when they write.
+    """
+
+    def get_replica_client(self, request):
+        key = getattr(request.auth, 'key', None)
+        if key is not None:
+            # Token keys are credentials, so keep them out of the cache.
+            return 'token:%s' % (
+                hashlib.sha256(force_bytes(key)).hexdigest(),)
+        if request.user and request.user.is_authenticated():
+            return 'user:%s' % (request.user.pk,)
+        return None
+
+    def initial(self, request, *args, **kwargs):
+        super(ReplicaReadMixin, self).initial(request, *args, **kwargs)
+        client = self.get_replica_client(request)
+        if request.method in SAFE_METHODS:
+            replicas.set_read_database(replicas.choose_replica(client))
+        elif client is not None and replicas.get_replicas():
+            replicas.pin(client)
+
+    def dispatch(self, request, *args, **kwargs):
+        with replicas.use_replica(None):
+            return super(ReplicaReadMixin, self).dispatch(
+                request, *args, **kwargs)
+
+
+class ContentStoreViewSet(ThrottledViewMixin, ReplicaReadMixin,
+                          MessagePackMixin, ValuesReadMixin,
+                          SparseFieldsetViewMixin, ModelViewSet):
+
+    """
+    Base for the contentstore API viewsets.
+    """
+    pagination_class = KeysetPagination
 
 
-class ScheduleViewSet(ModelViewSet):
+class ScheduleViewSet(ContentStoreViewSet):
 
     """
     API endpoint that allows Schedule models to be viewed or edited.
@@ -16,7 +286,7 @@ class ScheduleViewSet(ModelViewSet):
     serializer_class = ScheduleSerializer
 
 
-class MessageSetViewSet(ModelViewSet):
+class MessageSetViewSet(ContentStoreViewSet):
 
     """
     API endpoint that allows MessageSet models to be viewed or edited.
@@ -24,9 +294,128 @@ class MessageSetViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated,)
     queryset = MessageSet.objects.all()
     serializer_class = MessageSetSerializer
+    throttle_costs = {'clone': 20, 'resequence': 5, 'delete_many': 20,
+                      'publish': 20, 'timeline': 5}
+
+    def perform_destroy(self, instance):
+        delete_messagesets([instance.pk])
+
+    @detail_route(methods=['post'])
+    def publish(self, request, pk=None):
+        """
+            Snapshots the message set's current messages as its next
+            published version, served unchanged from then on.
+        """
+        messageset = self.get_object()
+        version = MessageSetVersion.objects.publish(messageset.pk)
+        return Response({
+            'messageset': messageset.pk,
+            'version': version.number,
+            'published_at': format_datetime(version.published_at),
+            'langs': version.langs,
+        }, status=status.HTTP_201_CREATED)
+
+    @detail_route(methods=['get'])
+    def timeline(self, request, pk=None):
+        """
+            Projects when a subscriber starting the message set at
+            ``start`` in ``lang``, from message ``start_sequence``, is sent
+            each message through to the end of the ``next_set`` chain.
+            Timelines depend only on the schedule's first run after
+            ``start``, so they're cached for every subscriber starting
+            between the same two runs until content changes.
+        """
+        messageset = self.get_object()
+        params = TimelineSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        start_sequence = params.validated_data['start_sequence']
+        lang = params.validated_data['lang']
+        try:
+            first_run = next_run(messageset.default_schedule,
+                                 params.validated_data['start'])
+        except ScheduleError as err:
+            raise ValidationError({'default_schedule': [str(err)]})
+        # Any content change moves the settled change feed cursor once it
+        # settles, retiring timelines cached before it. Unlike the newest
+        # id, the settled cursor never passes a change still being
+        # committed, which would leave its timeline cached as if it had it.
+        cursor = Change.objects.settled_cursor()
+        key = 'contentstore:timeline:%s:%s:%s:%s:%s' % (
+            cursor, messageset.pk, start_sequence, lang,
+            first_run.isoformat())
+        sends = cache.get(key)
+        if sends is None:
+            try:
+                sends = [{
+                    'messageset': messageset_id,
+                    'sequence_number': number,
+                    'send_at': format_datetime(send_at),
+                } for messageset_id, number, send_at in send_timeline(
+                    messageset.pk, first_run, lang, start_sequence)]
+            except ScheduleError as err:
+                raise ValidationError({'default_schedule': [str(err)]})
+            cache.set(key, sends, getattr(
+                settings, 'CONTENTSTORE_TIMELINE_CACHE_SECONDS', 24 * 60 * 60))
+        return Response({
+            'messageset': messageset.pk,
+            'start_sequence': start_sequence,
+            'lang': lang,
+            'sends': sends,
+            'finishes_at': sends[-1]['send_at'] if sends else None,
+        })
+
+    @list_route(methods=['post'])
+    def delete_many(self, request):
+        """
+            Deletes the message sets listed in ``ids`` along with their
+            messages, and the sets that cascade from them through
+            ``next_set``. ``missing`` lists the ``ids`` that didn't exist.
+        """
+        params = MessageSetDeleteSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        messagesets, messages, missing = delete_messagesets(
+            params.validated_data['ids'])
+        return Response({'messagesets': messagesets, 'messages': messages,
+                         'missing': missing})
+
+    @detail_route(methods=['post'])
+    def clone(self, request, pk=None):
+        """
+            Copies a language track when ``lang`` is given, otherwise copies
+            the whole message set (and its ``next_set`` chain with
+            ``include_next_sets``).
+        """
+        messageset = self.get_object()
+        if 'lang' in request.data:
+            params = TrackCloneSerializer(data=request.data)
+            params.is_valid(raise_exception=True)
+            count = clone_track(
+                messageset, params.validated_data['lang'],
+                params.validated_data['to_lang'],
+                params.validated_data.get('to_messageset'))
+            return Response({'count': count}, status=status.HTTP_201_CREATED)
+        params = MessageSetCloneSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        clones = clone_messagesets(messageset, **params.validated_data)
+        serializer = MessageSetSerializer(
+            sorted(clones.values(), key=lambda clone: clone.pk), many=True,
+            context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
 
+    @detail_route(methods=['post'])
+    def resequence(self, request, pk=None):
+        """
+            Renumbers a language track in one update, so senders never see
+            it half shifted.
+        """
+        messageset = self.get_object()
+        params = TrackResequenceSerializer(data=request.data)
+        params.is_valid(raise_exception=True)
+        count = resequence_track(messageset, **params.validated_data)
+        return Response({'count': count})
 
-class MessageViewSet(ModelViewSet):
+
+class MessageViewSet(ContentStoreViewSet):
 
     """
     API endpoint that allows Message models to be viewed or edited.
@@ -34,10 +423,77 @@ class MessageViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated,)
     queryset = Message.objects.all()
     serializer_class = MessageSerializer
-    filter_fields = ('messageset', 'sequence_number', 'lang', )
+    filter_class = MessageFilter
+    throttle_costs = {'list': 10, 'search': 5, 'render': 5,
+                      'segment_totals': 5}
+
+    @list_route(methods=['get'])
+    def search(self, request):
+        """
+            Full-text search of ``text_content`` for the words in ``q``,
+            best match first, paginated with ``page`` and ``page_size``.
+            Accepts the same filters as the list view.
+        """
+        text = request.query_params.get('q', '').strip()
+        if not text:
+            raise ValidationError({'q': ['This field is required.']})
+        queryset = search_messages(
+            self.filter_queryset(self.get_queryset()), text)
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        data = self.get_serializer(page, many=True).data
+        for item, message in zip(data, page):
+            item['rank'] = message.rank
+        return paginator.get_paginated_response(data)
+
+    @list_route(methods=['get'])
+    def segment_totals(self, request):
+        """
+            Message and SMS segment counts per encoding for the messages
+            matching the list view's filters, in one aggregate query.
+            Messages without text are left out.
+        """
+        rows = self.filter_queryset(self.get_queryset()).exclude(
+            encoding='').order_by().values('encoding').annotate(
+            messages=Count('id'), segments=Sum('segments'))
+        encodings = dict(
+            (row['encoding'], {'messages': row['messages'],
+                               'segments': row['segments']})
+            for row in rows)
+        return Response({
+            'messages': sum(e['messages'] for e in encodings.values()),
+            'segments': sum(e['segments'] for e in encodings.values()),
+            'encodings': encodings,
+        })
+
+    @detail_route(methods=['post'])
+    def render(self, request, pk=None):
+        """
+            Fills the message's placeholders from each dict in
+            ``variables``, returning the texts in the same order. Sets
+            missing a placeholder get an ``error`` instead of a ``text``.
+        """
+        variable_sets = request.data.get('variables')
+        if not isinstance(variable_sets, list) or not all(
+                isinstance(variables, dict) for variables in variable_sets):
+            raise ValidationError({'variables': [
+                'Expected a list of objects.']})
+        try:
+            text, compiled, placeholders = self.get_queryset().filter(
+                pk=pk).values_list(
+                'text_content', 'compiled_text', 'placeholders').get()
+        except (Message.DoesNotExist, ValueError):
+            raise Http404
+        if compiled is None and text:
+            raise ValidationError({'text_content': [
+                'The message text is not a valid template.']})
+        return Response({
+            'placeholders': placeholders.split(',') if placeholders else [],
+            'results': render_many(compiled or '', variable_sets),
+        })
 
 
-class BinaryContentViewSet(ModelViewSet):
+class BinaryContentViewSet(ContentStoreViewSet):
 
     """
     API endpoint that allows BinaryContent models to be viewed or edited.
@@ -45,9 +501,10 @@ class BinaryContentViewSet(ModelViewSet):
     permission_classes = (IsAuthenticated,)
     queryset = BinaryContent.objects.all()
     serializer_class = BinaryContentSerializer
+    filter_fields = ('checksum',)
 
 
-class MessagesContentView(ModelViewSet):
+class MessagesContentView(ContentStoreViewSet):
 
     """
     A simple ViewSet for viewing more detailed message content.
@@ -55,9 +512,10 @@ class MessagesContentView(ModelViewSet):
     permission_classes = (IsAuthenticated,)
     queryset = Message.objects.all()
     serializer_class = MessageListSerializer
+    throttle_scope = 'message-content'
 
 
-class MessagesetMessagesContentView(ModelViewSet):
+class MessagesetMessagesContentView(ContentStoreViewSet):
 
     """
     API endpoint that allows MessageSet models to be viewed or edited.
@@ -65,3 +523,227 @@ class MessagesetMessagesContentView(ModelViewSet):
     permission_classes = (IsAuthenticated,)
     queryset = MessageSet.objects.all()
     serializer_class = MessageSetMessagesSerializer
+    throttle_scope = 'messageset-messages'
+    throttle_costs = {'retrieve': 10}
+
+
+def _etag_matches(request, etag):
+    # If-None-Match compares weakly, and compressed responses carry the
+    # weak form of the ETag.
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    tags = [tag.strip() for tag in header.split(',')]
+    tags = [tag[2:] if tag.startswith('W/') else tag for tag in tags]
+    return etag in tags or '*' in tags
+
+
+def _precompiled_response(request, content, etag, cache_control):
+    """
+        A response for a document stored as JSON, answering
+        ``If-None-Match`` with a 304. It's sent as it is unless the client
+        negotiated MessagePack, when it's decoded and rendered again under
+        an ETag of its own. Both vary on ``Accept``, so caches never hand
+        out one format for the other.
+    """
+    packed = isinstance(getattr(request, 'accepted_renderer', None),
+                        MessagePackRenderer)
+    if packed:
+        etag = '%s-msgpack"' % (etag[:-1],)
+    if _etag_matches(request, etag):
+        response = HttpResponseNotModified()
+    elif packed:
+        response = Response(json.loads(content))
+    else:
+        response = HttpResponse(content, content_type='application/json')
+    response['ETag'] = etag
+    response['Cache-Control'] = cache_control
+    patch_vary_headers(response, ('Accept',))
+    return response
+
+
+class MessageSetBundleViewSet(ThrottledViewMixin, ReplicaReadMixin,
+                              MessagePackMixin, GenericViewSet):
+
+    """
+    API endpoint serving precompiled language tracks of a MessageSet.
+
+    ``list`` returns the current version of every track, so clients can
+    cheaply poll for changes. ``retrieve`` serves a whole track as a single
+    document with an ``ETag``, answering ``If-None-Match`` with a 304.
+    Neither writes: bundles that are stale are served from the messages
+    until the ``rebuild_bundles`` worker recompiles them.
+    """
+    permission_classes = (IsAuthenticated,)
+    queryset = MessageSetBundle.objects.all()
+
+    def list(self, request, pk=None):
+        bundles = self.get_queryset().filter(messageset_id=pk)
+        # Stale bundles may be left over from tracks that lost every
+        # message.
+        langs = set(Message.objects.filter(messageset_id=pk).values_list(
+            'lang', flat=True).distinct())
+        if not langs and not MessageSet.objects.filter(pk=pk).exists():
+            raise Http404
+        return Response([{
+            'lang': lang,
+            'version': version,
+        } for lang, version in bundles.values_list('lang', 'version')
+            if lang in langs])
+
+    def retrieve(self, request, pk=None, lang=None):
+        bundle = self.get_queryset().filter(messageset_id=pk,
+                                            lang=lang).first()
+        content = bundle and bundle.render()
+        if content is None:
+            raise Http404
+        return _precompiled_response(request, content, bundle.etag,
+                                     'max-age=0, must-revalidate')
+
+
+class MessageSetVersionViewSet(ThrottledViewMixin, ReplicaReadMixin,
+                               MessagePackMixin, GenericViewSet):
+
+    """
+    API endpoint serving the published versions of a MessageSet.
+
+    ``list`` returns every version number, for senders to pick one to pin
+    to. ``retrieve`` serves a version, or one language track of it. Since
+    published versions never change they're served with a year long
+    ``Cache-Control``. It's ``private``, since they need a token, so only
+    the client's own cache keeps them, never a shared one.
+    """
+    permission_classes = (IsAuthenticated,)
+    queryset = MessageSetVersion.objects.all()
+    cache_control = 'private, max-age=31536000, immutable'
+
+    def list(self, request, pk=None):
+        versions = list(self.get_queryset().filter(
+            messageset_id=pk).values_list('number', 'published_at'))
+        if not versions and not MessageSet.objects.filter(pk=pk).exists():
+            raise Http404
+        response = Response([{
+            'version': number,
+            'published_at': format_datetime(published_at),
+        } for number, published_at in versions])
+        response['Cache-Control'] = 'max-age=0, must-revalidate'
+        return response
+
+    def retrieve(self, request, pk=None, number=None, lang=None):
+        version = self.get_queryset().filter(
+            messageset_id=pk, number=number).first()
+        content = version and version.render(lang)
+        if content is None:
+            raise Http404
+        etag = version.etag if lang is None else '"%s-v%s-%s"' % (
+            pk, number, lang)
+        return _precompiled_response(request, content, etag,
+                                     self.cache_control)
+
+
+class ChangeViewSet(ThrottledViewMixin, ReplicaReadMixin, MessagePackMixin,
+                    GenericViewSet):
+
+    """
+    API endpoint listing content changes after the ``since`` cursor, oldest
+    first, so clients can keep a local mirror in sync. Deletes are listed as
+    tombstones without data. Follow ``cursor`` while ``more`` is true.
+
+    Changes are only listed once settled (see
+    :meth:`ChangeManager.settled_cursor`), so a change committed after a
+    newer one isn't skipped by clients that already read past it.
+    """
+    permission_classes = (IsAuthenticated,)
+    queryset = Change.objects.all()
+    default_limit = 1000
+    max_limit = 10000
+
+    def _int_param(self, name, default):
+        try:
+            return int(self.request.query_params.get(name, default))
+        except ValueError:
+            raise ValidationError({name: ['A valid integer is required.']})
+
+    def _sign_content_urls(self, changes, using, request):
+        # Snapshots keep plain file URLs; sign those that still point at
+        # the content's current file.
+        snapshots = [change['data'] for change in changes
+                     if change['model'] == 'binarycontent' and change['data']]
+        if not snapshots:
+            return
+        storage = BinaryContent._meta.get_field('content').storage
+        names = dict(BinaryContent.objects.db_manager(using).filter(
+            pk__in=[data['id'] for data in snapshots]).values_list(
+            'pk', 'content'))
+        for data in snapshots:
+            name = names.get(data['id'])
+            if name and data['content'] == storage.url(name):
+                data['content'] = file_url(storage, name, request)
+
+    def list(self, request):
+        since = self._int_param('since', 0)
+        limit = max(1, min(self._int_param('limit', self.default_limit),
+                           self.max_limit))
+        queryset = self.get_queryset()
+        settled = Change.objects.db_manager(queryset.db).settled_cursor()
+        rows = list(queryset.filter(pk__gt=since, pk__lte=settled).values_list(
+            'id', 'model', 'object_id', 'action', 'data')[:limit + 1])
+        changes = [{
+            'id': pk,
+            'model': model,
+            'object_id': object_id,
+            'action': action,
+            'data': json.loads(data) if data is not None else None,
+        } for pk, model, object_id, action, data in rows[:limit]]
+        if signing.get_lifetime():
+            self._sign_content_urls(changes, queryset.db, request)
+        return Response({
+            'cursor': changes[-1]['id'] if changes else since,
+            'more': len(rows) > limit,
+            'changes': changes,
+        })
+
+
+def _content_type(name):
+    return mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+@require_safe
+def download(request, name):
+    """
+        Serves a stored file to holders of a URL signed by
+        :func:`contentstore.signing.signed_url`, cacheable until the URL
+        expires so a CDN in front can answer repeat downloads. The signature
+        is the only check, so this needs no database queries.
+    """
+    expires = request.GET.get('expires')
+    if not signing.verify(name, expires, request.GET.get('signature')):
+        return HttpResponseForbidden()
+    storage = BinaryContent._meta.get_field('content').storage
+    try:
+        content = storage.open(name)
+    except (IOError, OSError):
+        raise Http404
+    response = FileResponse(content, content_type=_content_type(name))
+    response['Cache-Control'] = 'public, max-age=%d' % (
+        int(expires) - int(time.time()),)
+    return response
+
+
+@require_safe
+def spooled(request, name):
+    """
+        Serves a file uploaded to
+        :class:`~contentstore.storage.SpooledStorage` while it's still in
+        the spool, and redirects to the backend once ``flush_upload_spool``
+        has moved it, so URLs handed out before the move keep working. Like
+        backend URLs, these need no credentials.
+    """
+    storage = BinaryContent._meta.get_field('content').storage
+    if not isinstance(storage, SpooledStorage):
+        raise Http404
+    try:
+        content = storage.spool.open(name)
+    except (IOError, OSError):
+        return HttpResponseRedirect(storage.backend.url(name))
+    response = FileResponse(content, content_type=_content_type(name))
+    response['Cache-Control'] = 'no-cache'
+    return response
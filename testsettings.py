@@ -64,6 +64,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE_CLASSES = (
+    'contentstore.compression.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -85,9 +86,21 @@ DATABASES = {
         'PASSWORD': '',
         'HOST': '',
         'PORT': '',
-    }
+    },
+    # Stand-ins for read replicas, used when CONTENTSTORE_READ_REPLICAS
+    # lists them.
+    'replica1': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'contentstore-replica1.db',
+    },
+    'replica2': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': 'contentstore-replica2.db',
+    },
 }
 
+DATABASE_ROUTERS = ['contentstore.replicas.ReadReplicaRouter']
+
 LANGUAGE_CODE = 'en-gb'
 
 TIME_ZONE = 'UTC'
@@ -105,10 +118,14 @@ REST_FRAMEWORK = {
     'PAGINATE_BY': None,
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.BasicAuthentication',
-        'rest_framework.authentication.TokenAuthentication',
+        'contentstore.authentication.CachedTokenAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
     'DEFAULT_FILTER_BACKENDS': ('rest_framework.filters.DjangoFilterBackend',)
 }
+
+# Tests read the change feed straight after writing, with nothing else
+# writing concurrently.
+CONTENTSTORE_CHANGES_SETTLE_SECONDS = 0
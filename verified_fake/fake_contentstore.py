@@ -8,11 +8,22 @@ same for both.
 """
 
 
+import email
+import hashlib
 import json
+import re
 import weakref
+from datetime import datetime, timedelta
 from urlparse import urlparse, parse_qs
 from random import randint
 
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
 
 class Request(object):
 
@@ -37,7 +48,10 @@ class Response(object):
         self.code = code
         self.headers = headers if headers is not None else {}
         self.data = data
-        self.body = json.dumps(data)
+        if self.headers.get("Content-Type") == MSGPACK_MEDIA_TYPE:
+            self.body = msgpack.packb(data, use_bin_type=True)
+        else:
+            self.body = json.dumps(data)
 
 
 class FakeObjectError(Exception):
@@ -61,12 +75,132 @@ def _data_to_json(data):
     return json.loads(data)
 
 
+GSM7_BASIC = (
+    u"@\xa3$\xa5\xe8\xe9\xf9\xec\xf2\xc7\n\xd8\xf8\r\xc5\xe5"
+    u"\u0394_\u03a6\u0393\u039b\u03a9\u03a0\u03a8\u03a3\u0398\u039e"
+    u"\xc6\xe6\xdf\xc9 !\"#\xa4%&'()*+,-./0123456789:;<=>?"
+    u"\xa1ABCDEFGHIJKLMNOPQRSTUVWXYZ\xc4\xd6\xd1\xdc\xa7"
+    u"\xbfabcdefghijklmnopqrstuvwxyz\xe4\xf6\xf1\xfc\xe0")
+GSM7_EXTENDED = u"\f^{}\\[~]|\u20ac"
+
+
+def _count_segments(text):
+    text = re.sub(r'{{\s*(.*?)\s*}}', u"", text or u"")
+    if not text:
+        return u"", 0
+    if all(c in GSM7_BASIC or c in GSM7_EXTENDED for c in text):
+        encoding, single, split = u"gsm7", 160, 153
+        sizes = [2 if c in GSM7_EXTENDED else 1 for c in text]
+    else:
+        encoding, single, split = u"ucs2", 70, 67
+        sizes = [len(c.encode('utf-16-le')) // 2 for c in text]
+    if sum(sizes) <= single:
+        return encoding, 1
+    segments, used = 1, 0
+    for size in sizes:
+        if used + size > split:
+            segments, used = segments + 1, 0
+        used += size
+    return encoding, segments
+
+
+CRON_NAMES = {
+    u"day_of_week": (u"sun", u"mon", u"tue", u"wed", u"thu", u"fri", u"sat"),
+    u"month_of_year": (u"jan", u"feb", u"mar", u"apr", u"may", u"jun",
+                       u"jul", u"aug", u"sep", u"oct", u"nov", u"dec"),
+}
+CRON_RANGES = {
+    u"minute": (0, 59),
+    u"hour": (0, 23),
+    u"day_of_week": (0, 7),
+    u"day_of_month": (1, 31),
+    u"month_of_year": (1, 12),
+}
+
+
+def _cron_values(field, value):
+    low, high = CRON_RANGES[field]
+    names = CRON_NAMES.get(field, ())
+
+    def number(v):
+        return names.index(v) + low if v in names else int(v)
+
+    values = set()
+    try:
+        for part in (value or u"*").lower().split(u","):
+            part, _, step = part.strip().partition(u"/")
+            step = int(step) if step else 1
+            if part == u"*":
+                start, end = low, high
+            elif u"-" in part:
+                start, end = [number(v) for v in part.split(u"-", 1)]
+            else:
+                start = number(part)
+                end = high if step > 1 else start
+            if step < 1 or not low <= start <= end <= high:
+                raise ValueError(value)
+            values.update(range(start, end + 1, step))
+    except ValueError:
+        raise FakeObjectError(400, "{'default_schedule': ['Invalid crontab "
+                                   "field %r.']}" % (value,))
+    if field == u"day_of_week":
+        values = set(v % 7 for v in values)
+    return values
+
+
+def _parse_datetime(value):
+    """
+    Parse an ISO 8601 time with an optional UTC offset into naive UTC.
+    """
+    match = re.match(r'^(\d{4}-\d\d-\d\dT\d\d:\d\d(?::\d\d)?)(?:\.\d+)?'
+                     r'(Z|[+-]\d\d:?\d\d)?$', value or u"")
+    if match is None:
+        raise FakeObjectError(400, "{'start': ['Invalid datetime.']}")
+    when, offset = match.groups()
+    when = datetime.strptime(
+        when, u"%Y-%m-%dT%H:%M:%S" if when.count(u":") == 2
+        else u"%Y-%m-%dT%H:%M")
+    if offset and offset != u"Z":
+        minutes = int(offset[1:3]) * 60 + int(offset[-2:])
+        when -= timedelta(minutes=minutes if offset[0] == u"+" else -minutes)
+    return when
+
+
+def _format_datetime(when):
+    return when.strftime(u"%Y-%m-%dT%H:%M:%SZ")
+
+
+def _next_run(schedule, when):
+    """
+    Step a minute at a time to the next time ``schedule`` runs, which is
+    slow but obviously right.
+    """
+    fields = dict((field, _cron_values(field, schedule[field]))
+                  for field in CRON_RANGES)
+    if when.second or when.microsecond:
+        when = when.replace(second=0, microsecond=0) + timedelta(minutes=1)
+    # Four years covers every schedule that runs at all, bar the 29th of
+    # February on a given weekday.
+    for _ in xrange(4 * 366 * 24 * 60):
+        if (when.minute in fields[u"minute"] and
+                when.hour in fields[u"hour"] and
+                when.isoweekday() % 7 in fields[u"day_of_week"] and
+                when.day in fields[u"day_of_month"] and
+                when.month in fields[u"month_of_year"]):
+            return when
+        when += timedelta(minutes=1)
+    raise FakeObjectError(
+        400, "{'default_schedule': ['The schedule never runs.']}")
+
+
 class FakeEndpoint(object):
 
     """
     FakeEndpoint base class
     """
 
+    name = None
+
     def __init__(self, parent, endpoint_data={}):
         self.parent = weakref.ref(parent)
         self.endpoint_data = endpoint_data
@@ -121,8 +255,13 @@ class FakeEndpoint(object):
         newobject = self.make_dict(endpoint_data)
         self.endpoint_data[newobject[u"id"]] = newobject
         self._check_fields_unique(self.endpoint_data)
+        self._record_change(newobject, u"created")
         return newobject
 
+    def _record_change(self, obj, action):
+        if self.name is not None:
+            self.parent().changes.record(self.name, obj, action)
+
     def get_object(self, object_key, sub_request=None):
         existingobject = self.endpoint_data.get(object_key)
         if existingobject is None:
@@ -138,22 +277,40 @@ class FakeEndpoint(object):
     def get_all(self, query):
         q = query.get('query', None)
         q = q and q[0]
-        return self.get_all_objects(q)
+        objects = self.get_all_objects(q)
+        if 'limit' not in query:
+            return objects
+        limit = int(query['limit'][0])
+        after = int(query.get('after', [0])[0])
+        objects = sorted((o for o in objects if o[u"id"] > after),
+                         key=lambda o: o[u"id"])
+        page = objects[:limit]
+        return {
+            u"cursor": page[-1][u"id"] if page else after,
+            u"more": len(objects) > limit,
+            u"results": page,
+        }
 
     def update_object(self, object_key, endpoint_data):
         existingobject = self.get_object(object_key)
         endpoint_data = _data_to_json(endpoint_data)
         self._check_fields(endpoint_data)
+        changed = any(existingobject.get(k) != v
+                      for k, v in endpoint_data.iteritems())
         for k, v in endpoint_data.iteritems():
             existingobject[k] = v
         self.endpoint_data[object_key] = existingobject
         self._check_fields_required(existingobject)  # After to allow PATCH
         self._check_fields_unique(self.endpoint_data)
+        if changed:
+            # Like the server, updates that change nothing aren't logged.
+            self._record_change(existingobject, u"updated")
         return existingobject
 
     def delete_object(self, object_key):
         existingobject = self.get_object(object_key)
         self.endpoint_data.pop(object_key)
+        self._record_change(existingobject, u"deleted")
         return existingobject
 
     def request(self, request, object_key, query, sub_request):
@@ -172,8 +329,8 @@ class FakeEndpoint(object):
             else:
                 return (200, self.get_object(object_key, sub_request))
         elif request.method == "PUT":
-            # NOTE: This is an incorrect use of the PUT method, but
-            # it's what we have for now.
+            # PUT replaces the whole object, so it needs every field.
+            self._check_fields_required(_data_to_json(request.body))
             return (200, self.update_object(object_key, request.body))
         elif request.method == "PATCH":
             return (200, self.update_object(object_key, request.body))
@@ -185,10 +342,14 @@ class FakeEndpoint(object):
 
 class FakeMessageSet(FakeEndpoint):
 
+    name = u"messageset"
+
     def __init__(self, parent, endpoint_data={}):
         super(FakeMessageSet, self).__init__(parent, endpoint_data)
         self.required_fields = [u"short_name", u"default_schedule"]
         self.unique_fields = [u"short_name"]
+        # Published versions of each message set, as lists of tracks
+        self.versions = {}
 
     @staticmethod
     def make_dict(fields):
@@ -210,16 +371,235 @@ class FakeMessageSet(FakeEndpoint):
         if existingobject is None:
             raise FakeObjectError(
                 404, u"Object %r not found." % (object_key,))
-        if sub_request is not None:
-            # get messages - assumes all messages in fake are for current set
-            messages = sorted(self.parent().messages.endpoint_data.values(),
-                              key=lambda k: k['sequence_number'])
-            existingobject["messages"] = messages
+        if sub_request is None:
+            return existingobject
+        if sub_request.startswith("bundles"):
+            return self.get_bundles(existingobject, sub_request)
+        if sub_request.startswith("versions"):
+            return self.get_versions(existingobject, sub_request)
+        # get messages - assumes all messages in fake are for current set
+        messages = sorted(self.parent().messages.endpoint_data.values(),
+                          key=lambda k: k['sequence_number'])
+        existingobject["messages"] = messages
         return existingobject
 
+    def request(self, request, object_key, query, sub_request):
+        if (request.method == "GET" and sub_request is not None and
+                sub_request.strip("/") == "timeline"):
+            return (200, self.timeline(object_key, query))
+        if request.method == "POST" and object_key == "delete_many":
+            return (200, self.delete_many(_data_to_json(request.body)))
+        if request.method == "POST" and sub_request is not None:
+            params = _data_to_json(request.body)
+            if sub_request.strip("/") == "clone":
+                return (201, self.clone(object_key, params))
+            if sub_request.strip("/") == "resequence":
+                return (200, self.resequence(object_key, params))
+            if sub_request.strip("/") == "publish":
+                return (201, self.publish(object_key))
+        return super(FakeMessageSet, self).request(
+            request, object_key, query, sub_request)
+
+    def delete_many(self, params):
+        ids = set(params["ids"]) & set(self.endpoint_data)
+        missing = sorted(set(params["ids"]) - ids)
+        new = ids
+        while new:
+            new = set(pk for pk, m in self.endpoint_data.items()
+                      if m["next_set"] in new and pk not in ids)
+            ids |= new
+        messages = self.parent().messages
+        message_ids = [pk for pk, m in messages.endpoint_data.items()
+                       if m["messageset"] in ids]
+        for pk in message_ids:
+            messages.delete_object(pk)
+        for pk in ids:
+            self.delete_object(pk)
+            self.versions.pop(pk, None)
+        return {u"messagesets": len(ids), u"messages": len(message_ids),
+                u"missing": missing}
+
+    def clone(self, object_key, params):
+        messageset = self.get_object(object_key)
+        messages = self.parent().messages
+        if "lang" in params:
+            target = params.get("to_messageset") or messageset["id"]
+            self.get_object(target)
+            if any(m["messageset"] == target and
+                   m["lang"] == params["to_lang"]
+                   for m in messages.endpoint_data.values()):
+                raise FakeObjectError(
+                    400, "{'to_lang': ['The track already has messages.']}")
+            count = 0
+            for m in list(messages.endpoint_data.values()):
+                if (m["messageset"] == messageset["id"] and
+                        m["lang"] == params["lang"]):
+                    fields = dict(m, messageset=target,
+                                  lang=params["to_lang"])
+                    fields.pop(u"id")
+                    messages.create_object(fields)
+                    count += 1
+            return {u"count": count}
+
+        originals = [messageset]
+        while params.get("include_next_sets"):
+            next_set = originals[-1]["next_set"]
+            if next_set is None or next_set in [o["id"] for o in originals]:
+                break
+            originals.append(self.get_object(next_set))
+        clones = {}
+        for original in originals:
+            fields = dict(original, short_name=(
+                original["short_name"] + params["short_name_suffix"]))
+            fields.pop(u"id")
+            fields.pop(u"messages", None)
+            clones[original["id"]] = self.create_object(fields)
+        for original in originals:
+            clone = clones[original["id"]]
+            if original["next_set"] in clones:
+                clone["next_set"] = clones[original["next_set"]]["id"]
+            for m in list(messages.endpoint_data.values()):
+                if m["messageset"] == original["id"]:
+                    fields = dict(m, messageset=clone["id"])
+                    fields.pop(u"id")
+                    messages.create_object(fields)
+        return sorted(clones.values(), key=lambda k: k["id"])
+
+    def resequence(self, object_key, params):
+        messageset = self.get_object(object_key)
+        messages = self.parent().messages
+        track = dict(
+            (m["id"], m) for m in messages.endpoint_data.values()
+            if m["messageset"] == messageset["id"] and
+            m["lang"] == params["lang"])
+        if "order" in params:
+            if sorted(params["order"]) != sorted(track):
+                raise FakeObjectError(400, "{'order': ['Must list every "
+                                      "message in the track exactly once.']}")
+            numbers = dict((pk, i) for i, pk in enumerate(params["order"], 1))
+        else:
+            numbers = dict(
+                (pk, m["sequence_number"] + params["shift"])
+                for pk, m in track.items()
+                if m["sequence_number"] >= params["start"])
+        for pk, sequence_number in numbers.items():
+            messages.update_object(pk, {"sequence_number": sequence_number})
+        return {u"count": len(numbers)}
+
+    def get_tracks(self, messageset_id):
+        messages = sorted(
+            [m for m in self.parent().messages.endpoint_data.values()
+             if m["messageset"] == messageset_id],
+            key=lambda k: (k['sequence_number'], k['id']))
+        tracks = {}
+        for m in messages:
+            tracks.setdefault(m["lang"], []).append({
+                u"id": m["id"],
+                u"sequence_number": m["sequence_number"],
+                u"text_content": m["text_content"],
+                u"binary_content": m["binary_content"],
+            })
+        return tracks
+
+    def get_bundles(self, messageset, sub_request):
+        # Bundles always report version 1, the fake doesn't track edits.
+        tracks = self.get_tracks(messageset["id"])
+        if sub_request == "bundles":
+            return [{u"lang": lang, u"version": 1}
+                    for lang in sorted(tracks)]
+        lang = sub_request.split("/", 1)[1]
+        if lang not in tracks:
+            raise FakeObjectError(
+                404, u"Bundle %r not found." % (sub_request,))
+        return {
+            u"messageset": messageset["id"],
+            u"lang": lang,
+            u"version": 1,
+            u"messages": tracks[lang],
+        }
+
+    def publish(self, object_key):
+        messageset = self.get_object(object_key)
+        versions = self.versions.setdefault(messageset["id"], [])
+        versions.append(json.loads(json.dumps(
+            self.get_tracks(messageset["id"]))))
+        return {
+            u"messageset": messageset["id"],
+            u"version": len(versions),
+            u"published_at": u"2014-07-25T12:44:11.159151Z",
+            u"langs": sorted(versions[-1]),
+        }
+
+    def timeline(self, object_key, query):
+        messageset = self.get_object(object_key)
+        for field in ("start", "lang"):
+            if field not in query:
+                raise FakeObjectError(
+                    400, "{'%s': ['This field is required.']}" % field)
+        start_sequence = int(query.get("start_sequence", [1])[0])
+        if start_sequence < 1:
+            raise FakeObjectError(400, "{'start_sequence': ['Ensure this "
+                                       "value is greater than or equal to "
+                                       "1.']}")
+        lang = query["lang"][0]
+        messages = self.parent().messages.endpoint_data.values()
+        schedules = self.parent().schedules
+        sends = []
+        when = _parse_datetime(query["start"][0])
+        seen = set()
+        while messageset is not None and messageset["id"] not in seen:
+            seen.add(messageset["id"])
+            schedule = schedules.get_object(messageset["default_schedule"])
+            numbers = sorted(set(
+                m["sequence_number"] for m in messages
+                if m["messageset"] == messageset["id"] and
+                m["lang"] == lang))
+            if len(seen) == 1:
+                when = _next_run(schedule, when)
+                numbers = [n for n in numbers if n >= start_sequence]
+            for number in numbers:
+                when = _next_run(schedule, when)
+                sends.append({u"messageset": messageset["id"],
+                              u"sequence_number": number,
+                              u"send_at": _format_datetime(when)})
+                when += timedelta(minutes=1)
+            next_set = messageset["next_set"]
+            messageset = (self.endpoint_data.get(next_set)
+                          if next_set is not None else None)
+        return {
+            u"messageset": object_key,
+            u"start_sequence": start_sequence,
+            u"lang": lang,
+            u"sends": sends,
+            u"finishes_at": sends[-1][u"send_at"] if sends else None,
+        }
+
+    def get_versions(self, messageset, sub_request):
+        versions = self.versions.get(messageset["id"], [])
+        parts = sub_request.split("/")
+        if len(parts) == 1:
+            return [{u"version": number,
+                     u"published_at": u"2014-07-25T12:44:11.159151Z"}
+                    for number in range(1, len(versions) + 1)]
+        number = int(parts[1])
+        if not 0 < number <= len(versions):
+            raise FakeObjectError(
+                404, u"Version %r not found." % (sub_request,))
+        tracks = versions[number - 1]
+        if len(parts) == 2:
+            return {u"messageset": messageset["id"], u"version": number,
+                    u"tracks": tracks}
+        if parts[2] not in tracks:
+            raise FakeObjectError(
+                404, u"Version %r not found." % (sub_request,))
+        return {u"messageset": messageset["id"], u"version": number,
+                u"lang": parts[2], u"messages": tracks[parts[2]]}
+
 
 class FakeSchedule(FakeEndpoint):
 
+    name = u"schedule"
+
     def __init__(self, parent, endpoint_data={}):
         super(FakeSchedule, self).__init__(parent, endpoint_data)
         self.required_fields = [u"minute", u"hour", u"day_of_week",
@@ -244,6 +624,8 @@ class FakeSchedule(FakeEndpoint):
 
 class FakeMessage(FakeEndpoint):
 
+    name = u"message"
+
     def __init__(self, parent, endpoint_data={}):
         super(FakeMessage, self).__init__(parent, endpoint_data)
         self.required_fields = [u"messageset", u"sequence_number",
@@ -259,15 +641,104 @@ class FakeMessage(FakeEndpoint):
             u'lang': None,
             u'text_content': None,
             u'binary_content': None,
+            u'encoding': u'',
+            u'segments': 0,
             u'created_at': u'2014-07-25 12:44:11.159151',
             u'updated_at': u'2014-07-25 12:44:11.159151',
         }
         data.update(fields)
+        data[u'encoding'], data[u'segments'] = _count_segments(
+            data[u'text_content'])
         return data
 
+    def update_object(self, object_key, endpoint_data):
+        message = super(FakeMessage, self).update_object(
+            object_key, endpoint_data)
+        message[u'encoding'], message[u'segments'] = _count_segments(
+            message[u'text_content'])
+        return message
+
+    def request(self, request, object_key, query, sub_request):
+        if request.method == "GET" and object_key == "search":
+            return (200, self.search(query))
+        if request.method == "GET" and object_key == "segment_totals":
+            return (200, self.segment_totals(query))
+        if (request.method == "POST" and sub_request is not None and
+                sub_request.strip("/") == "render"):
+            return (200, self.render(object_key, _data_to_json(request.body)))
+        return super(FakeMessage, self).request(
+            request, object_key, query, sub_request)
+
+    def render(self, object_key, params):
+        message = self.get_object(object_key)
+        text = message["text_content"] or ""
+        names = []
+        for name in re.findall(r'{{\s*(.*?)\s*}}', text):
+            if name not in names:
+                names.append(name)
+        results = []
+        for variables in params["variables"]:
+            missing = [name for name in names if name not in variables]
+            if missing:
+                results.append({u"error": u"Missing variable %s." % (
+                    missing[0],)})
+                continue
+            results.append({u"text": re.sub(
+                r'{{\s*(.*?)\s*}}',
+                lambda m: u"%s" % (variables[m.group(1)],), text)})
+        return {u"placeholders": names, u"results": results}
+
+    def segment_totals(self, query):
+        encodings = {}
+        for m in self.endpoint_data.values():
+            if not m["encoding"] or any(
+                    str(m[f]) != query[f][0]
+                    for f in ('messageset', 'lang', 'encoding')
+                    if f in query):
+                continue
+            totals = encodings.setdefault(
+                m["encoding"], {u"messages": 0, u"segments": 0})
+            totals[u"messages"] += 1
+            totals[u"segments"] += m["segments"]
+        return {
+            u"messages": sum(e[u"messages"] for e in encodings.values()),
+            u"segments": sum(e[u"segments"] for e in encodings.values()),
+            u"encodings": encodings,
+        }
+
+    def search(self, query):
+        # Ranks by how often the words appear, rather than like the server.
+        words = re.findall(r'\w+', query.get('q', [''])[0].lower(),
+                           re.UNICODE)
+        if not words:
+            raise FakeObjectError(400, "{'q': ['This field is required.']}")
+        results = []
+        for m in self.endpoint_data.values():
+            if any(str(m[f]) != query[f][0]
+                   for f in ('messageset', 'lang') if f in query):
+                continue
+            found = re.findall(r'\w+', (m["text_content"] or "").lower(),
+                               re.UNICODE)
+            if all(word in found for word in words):
+                rank = sum(found.count(word) for word in words)
+                results.append(dict(m, rank=rank))
+        results.sort(key=lambda k: (-k["rank"], k["id"]))
+        page = int(query.get('page', [1])[0])
+        page_size = int(query.get('page_size', [20])[0])
+        start = (page - 1) * page_size
+        return {
+            u"count": len(results),
+            u"next": (u"?page=%s" % (page + 1)
+                      if start + page_size < len(results) else None),
+            u"previous": u"?page=%s" % (page - 1) if page > 1 else None,
+            u"results": results[start:start + page_size],
+        }
+
 
 class FakeBinaryContent(FakeEndpoint):
 
+    name = u"binarycontent"
+
     def __init__(self, parent, endpoint_data={}):
         super(FakeBinaryContent, self).__init__(parent, endpoint_data)
         self.required_fields = [u"content"]
@@ -278,12 +749,70 @@ class FakeBinaryContent(FakeEndpoint):
         data = {
             u'id': randint(1, 100000000),
             u'content': None,
+            u'checksum': u'',
             u'created_at': u'2014-07-25 12:44:11.159151',
             u'updated_at': u'2014-07-25 12:44:11.159151',
         }
         data.update(fields)
         return data
 
+    @staticmethod
+    def parse_upload(request):
+        message = email.message_from_string(
+            "Content-Type: %s\r\n\r\n%s" % (
+                request.headers["Content-Type"], request.body))
+        for part in message.get_payload():
+            if part.get_param("name", header="content-disposition") == (
+                    "content"):
+                data = part.get_payload(decode=True)
+                return {
+                    u"content": u"/media/%s" % (part.get_filename(),),
+                    u"checksum": hashlib.sha256(data).hexdigest(),
+                }
+        raise FakeObjectError(400, "{'content': ['No file was submitted.']}")
+
+    def get_all(self, query):
+        if 'checksum' not in query:
+            return super(FakeBinaryContent, self).get_all(query)
+        return [b for b in self.endpoint_data.values()
+                if b[u"checksum"] == query['checksum'][0]]
+
+    def request(self, request, object_key, query, sub_request):
+        if request.headers.get("Content-Type", "").startswith(
+                "multipart/form-data"):
+            fields = self.parse_upload(request)
+            if request.method == "POST" and not object_key:
+                return (201, self.create_object(fields))
+            if request.method == "PUT" and object_key:
+                return (200, self.update_object(object_key, fields))
+            raise FakeObjectError(405, "")
+        return super(FakeBinaryContent, self).request(
+            request, object_key, query, sub_request)
+
+
+class FakeChanges(FakeEndpoint):
+
+    def record(self, model, obj, action):
+        cursor = len(self.endpoint_data) + 1
+        self.endpoint_data.append({
+            u"id": cursor,
+            u"model": model,
+            u"object_id": obj[u"id"],
+            u"action": action,
+            u"data": None if action == u"deleted" else dict(obj),
+        })
+
+    def get_all(self, query):
+        since = int(query.get('since', [0])[0])
+        limit = int(query.get('limit', [1000])[0])
+        changes = [c for c in self.endpoint_data if c[u"id"] > since]
+        page = changes[:limit]
+        return {
+            u"cursor": page[-1][u"id"] if page else since,
+            u"more": len(changes) > limit,
+            u"changes": page,
+        }
+
 
 class FakeContentStoreApi(object):
 
@@ -299,6 +828,7 @@ class FakeContentStoreApi(object):
         self.schedules = FakeSchedule(self, schedule_data)
         self.messages = FakeMessage(self, message_data)
         self.binary_contents = FakeBinaryContent(self, binary_content_data)
+        self.changes = FakeChanges(self, [])
 
     make_messageset_dict = staticmethod(FakeMessageSet.make_dict)
     make_schedule_dict = staticmethod(FakeSchedule.make_dict)
@@ -319,7 +849,7 @@ class FakeContentStoreApi(object):
         if len(parts) >= 2:
             key = parts[1]
         if len(parts) >= 3:
-            sub_request = parts[2]
+            sub_request = "/".join(parts[2:])
 
         try:
             key = int(key)
@@ -331,16 +861,34 @@ class FakeContentStoreApi(object):
             'schedule': self.schedules,
             'message': self.messages,
             'binarycontent': self.binary_contents,
+            'changes': self.changes,
         }.get(request_type, None)
 
         if handler is None:
             self.build_response("", 404)
 
+        if hasattr(request.body, "read"):
+            # Streamed request bodies.
+            request.body = request.body.read()
+
+        content_type = "application/json"
+        if msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get(
+                "Accept", ""):
+            content_type = MSGPACK_MEDIA_TYPE
+        headers = dict(request.headers, **{"Content-Type": content_type})
+        if request.headers.get("Content-Type") == MSGPACK_MEDIA_TYPE:
+            # The endpoints below only understand JSON bodies.
+            if request.body:
+                request.body = json.dumps(
+                    msgpack.unpackb(request.body, raw=False))
+            request.headers = dict(
+                request.headers, **{"Content-Type": "application/json"})
+
         try:
             query_string = parse_qs(url.query.decode('utf8'))
             result = handler.request(request, key, query_string, sub_request)
             return self.build_response(result[1], code=result[0],
-                                       headers=request.headers)
+                                       headers=headers)
         except FakeObjectError as err:
             return self.build_response(err.data, err.code)
 